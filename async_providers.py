@@ -0,0 +1,401 @@
+# async_providers.py
+
+import json
+import queue
+import atexit
+import asyncio
+import threading
+from providers import get_openai
+
+
+class ProviderError(Exception):
+    """A model request failed: connection or HTTP error, provider error or timeout"""
+
+
+def usage_from_ollama(data):
+    """Token counts and timings (in seconds) from Ollama's final response object"""
+    usage = {
+        'prompt_tokens': data.get('prompt_eval_count'),
+        'completion_tokens': data.get('eval_count')
+    }
+    for key in ('prompt_eval_duration', 'eval_duration', 'total_duration', 'load_duration'):
+        if data.get(key) is not None:
+            usage[key] = data[key] / 1e9
+    return usage
+
+
+class AsyncOllamaProvider:
+    """
+    Ollama chat over aiohttp.
+
+    The aiohttp session is created on the provider loop when the first request
+    is made and is reused, so connections stay pooled across turns.
+    """
+
+    def __init__(self, base_url='http://localhost:11434', connect_timeout=3.05,
+                 read_timeout=300, keep_alive='30m', max_concurrent=4):
+        self.base_url = base_url.rstrip('/')
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.keep_alive = keep_alive
+        self.max_concurrent = max_concurrent
+        self.session = None
+        self.limit = None
+
+    def _ensure_session(self):
+        # Called on the provider loop; aiohttp is only imported once a request is made
+        import aiohttp
+
+        if self.session is None:
+            self.session = aiohttp.ClientSession(
+                timeout=aiohttp.ClientTimeout(sock_connect=self.connect_timeout, sock_read=self.read_timeout)
+            )
+            self.limit = asyncio.Semaphore(self.max_concurrent)
+        return self.session
+
+    def _payload(self, model, messages, stream, temperature, max_tokens):
+        payload = {'model': model, 'messages': messages, 'stream': stream}
+        if self.keep_alive is not None:
+            payload['keep_alive'] = self.keep_alive
+        model_options = {}
+        if temperature is not None:
+            model_options['temperature'] = temperature
+        if max_tokens is not None:
+            model_options['num_predict'] = max_tokens
+        if model_options:
+            payload['options'] = model_options
+        return payload
+
+    async def chat(self, model, messages, temperature=None, max_tokens=None):
+        """Return the full reply; None for temperature or max_tokens keeps the model's default"""
+        return (await self.complete(model, messages, temperature, max_tokens))['content']
+
+    async def complete(self, model, messages, temperature=None, max_tokens=None):
+        """Return the reply and its usage, see usage_from_ollama()"""
+        data = await self._post_chat(self._payload(model, messages, False, temperature, max_tokens))
+        return dict(usage_from_ollama(data), content=data['message']['content'])
+
+    async def prefill(self, model, messages):
+        """
+        Evaluate messages into the model's KV cache, loading the model if needed.
+
+        Ollama keeps the last evaluated prompt of a loaded model, so a request
+        that starts with the same messages only evaluates what follows them.
+        One token is generated, since num_predict 0 means no limit.
+
+        Returns:
+            Dict[str, Any]: The usage, see usage_from_ollama().
+        """
+        return usage_from_ollama(await self._post_chat(self._payload(model, messages, False, None, 1)))
+
+    async def _post_chat(self, payload):
+        import aiohttp
+
+        session = self._ensure_session()
+        try:
+            async with self.limit:
+                async with session.post(f"{self.base_url}/api/chat", json=payload) as response:
+                    response.raise_for_status()
+                    data = await response.json(content_type=None)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            raise ProviderError(f"Error communicating with Ollama: {e}") from e
+        except ValueError as e:
+            raise ProviderError(f"Invalid response from Ollama: {e}") from e
+        if data.get('error'):
+            raise ProviderError(f"Ollama error: {data['error']}")
+        return data
+
+    async def stream_chat(self, model, messages, temperature=None, max_tokens=None, usage=None):
+        """Yield reply text chunks as they are generated; usage, if given, is filled in at the end"""
+        import aiohttp
+
+        session = self._ensure_session()
+        payload = self._payload(model, messages, True, temperature, max_tokens)
+        try:
+            async with self.limit:
+                async with session.post(f"{self.base_url}/api/chat", json=payload) as response:
+                    response.raise_for_status()
+                    async for line in response.content:
+                        if not line.strip():
+                            continue
+                        try:
+                            data = json.loads(line)
+                        except ValueError as e:
+                            raise ProviderError(f"Invalid response from Ollama: {e}") from e
+                        if data.get('error'):
+                            raise ProviderError(f"Ollama error: {data['error']}")
+                        content = data.get('message', {}).get('content')
+                        if content:
+                            yield content
+                        if data.get('done') and usage is not None:
+                            usage.update(usage_from_ollama(data))
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            raise ProviderError(f"Error communicating with Ollama: {e}") from e
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+
+class AsyncOpenAIProvider:
+    """OpenAI chat through the openai package's aiohttp-based acreate()"""
+
+    def __init__(self, max_concurrent=4):
+        # Imports openai and reads the API key in the calling thread, so a
+        # missing key is asked for on the terminal rather than on the loop thread
+        self.openai = get_openai()
+        self.max_concurrent = max_concurrent
+        self.limit = None
+
+    def _ensure_limit(self):
+        if self.limit is None:
+            self.limit = asyncio.Semaphore(self.max_concurrent)
+        return self.limit
+
+    async def chat(self, model, messages, temperature=None, max_tokens=None):
+        return (await self.complete(model, messages, temperature, max_tokens))['content']
+
+    async def complete(self, model, messages, temperature=None, max_tokens=None):
+        try:
+            async with self._ensure_limit():
+                response = await self.openai.ChatCompletion.acreate(
+                    model=model, messages=messages, temperature=temperature, max_tokens=max_tokens
+                )
+        except self.openai.error.OpenAIError as e:
+            raise ProviderError(f"OpenAI request failed: {e}") from e
+        usage = response.get('usage', {})
+        return {
+            'content': response['choices'][0]['message']['content'],
+            'prompt_tokens': usage.get('prompt_tokens'),
+            'completion_tokens': usage.get('completion_tokens')
+        }
+
+    async def stream_chat(self, model, messages, temperature=None, max_tokens=None, usage=None):
+        # The streaming API of this openai version does not report usage
+        try:
+            async with self._ensure_limit():
+                response = await self.openai.ChatCompletion.acreate(
+                    model=model, messages=messages, temperature=temperature, max_tokens=max_tokens,
+                    stream=True
+                )
+                async for event in response:
+                    content = event['choices'][0].get('delta', {}).get('content')
+                    if content:
+                        yield content
+        except self.openai.error.OpenAIError as e:
+            raise ProviderError(f"OpenAI request failed: {e}") from e
+
+    async def close(self):
+        pass
+
+
+class ProviderLoop:
+    """
+    An asyncio event loop on a daemon thread that runs every model request.
+
+    Requests from the REPL, the startup tasks and the summarizer are scheduled
+    on the same loop and overlap freely. Each request can be given a timeout,
+    and cancelling its future (or interrupting the thread waiting on it)
+    cancels the task, which closes the HTTP connection so the provider stops
+    generating.
+    """
+
+    def __init__(self):
+        self.loop = None
+        self.lock = threading.Lock()
+        # In-flight futures by the id of the thread that submitted them
+        self.requests = {}
+
+    def _ensure_loop(self):
+        with self.lock:
+            if self.loop is None:
+                self.loop = asyncio.new_event_loop()
+                threading.Thread(target=self.loop.run_forever, name="sage-providers", daemon=True).start()
+            return self.loop
+
+    def submit(self, coro, timeout=None):
+        """
+        Schedule a coroutine on the loop.
+
+        Returns:
+            concurrent.futures.Future: Its result. Cancelling it cancels the request.
+        """
+        future = asyncio.run_coroutine_threadsafe(with_timeout(coro, timeout), self._ensure_loop())
+        thread = threading.get_ident()
+        with self.lock:
+            self.requests.setdefault(thread, set()).add(future)
+        future.add_done_callback(lambda done: self._forget(thread, done))
+        return future
+
+    def _forget(self, thread, future):
+        with self.lock:
+            futures = self.requests.get(thread)
+            if futures is not None:
+                futures.discard(future)
+                if not futures:
+                    del self.requests[thread]
+
+    def cancel_thread(self, thread):
+        """Cancel the requests submitted from a thread, e.g. a background task that is no longer wanted"""
+        with self.lock:
+            futures = list(self.requests.get(thread, ()))
+        for future in futures:
+            future.cancel()
+
+    def run(self, coro, timeout=None):
+        """Run a coroutine on the loop and wait for it; the request is cancelled if the wait is interrupted"""
+        future = self.submit(coro, timeout)
+        try:
+            return future.result()
+        finally:
+            future.cancel()
+
+    def stream(self, chunks, timeout=None):
+        """
+        Iterate over an async generator from a synchronous caller.
+
+        Chunks are handed over through a queue as they arrive. If the caller
+        stops early (an exception, Ctrl-C, or closing the iterator), the
+        generator's task is cancelled and its HTTP stream closed.
+        """
+        handoff = queue.Queue()
+        finished = object()
+
+        async def pump():
+            try:
+                async for chunk in chunks:
+                    handoff.put(chunk)
+            finally:
+                await chunks.aclose()
+
+        future = self.submit(pump(), timeout)
+        future.add_done_callback(lambda _: handoff.put(finished))
+        try:
+            while True:
+                chunk = handoff.get()
+                if chunk is finished:
+                    break
+                yield chunk
+            future.result()
+        finally:
+            future.cancel()
+
+
+async def with_timeout(coro, timeout=None):
+    if not timeout:
+        return await coro
+    try:
+        return await asyncio.wait_for(coro, timeout)
+    except asyncio.TimeoutError:
+        raise ProviderError(f"Request timed out after {timeout:g}s") from None
+
+
+_provider_loop = ProviderLoop()
+_providers = {}
+
+
+def get_provider_loop():
+    return _provider_loop
+
+
+def get_async_provider(options, provider=None):
+    """
+    Return the shared async provider for options['model_provider'] (or provider).
+
+    Providers are created once and reused; the Ollama provider is replaced when
+    its connection settings change.
+    """
+    provider = provider or options['model_provider']
+    concurrency = options.get('max_concurrent_requests', 4)
+    if provider == 'ollama':
+        settings = (
+            'ollama',
+            options.get('ollama_url', 'http://localhost:11434'),
+            options.get('ollama_connect_timeout', 3.05),
+            options.get('ollama_read_timeout', 300),
+            options.get('ollama_keep_alive', '30m'),
+            concurrency
+        )
+    else:
+        settings = ('openai', concurrency)
+
+    current = _providers.get(provider)
+    if current is None or current[0] != settings:
+        if current is not None:
+            _provider_loop.submit(current[1].close())
+        if provider == 'ollama':
+            instance = AsyncOllamaProvider(*settings[1:])
+        else:
+            instance = AsyncOpenAIProvider(concurrency)
+        current = _providers[provider] = (settings, instance)
+    return current[1]
+
+
+def close_providers():
+    """Close the providers' HTTP sessions; runs at exit"""
+    for _, instance in list(_providers.values()):
+        try:
+            _provider_loop.run(instance.close(), timeout=1)
+        except Exception:
+            pass
+    _providers.clear()
+
+
+atexit.register(close_providers)
+
+
+def submit_chat(messages, options, temperature=None, max_tokens=None, provider=None, timeout=None):
+    """
+    Start a chat request on the provider loop without waiting for it.
+
+    Args:
+        messages (List[Dict[str, Any]]): Messages to send.
+        options (Dict[str, Any]): Configuration options.
+        temperature (float): Sampling temperature; None keeps the provider's default.
+        max_tokens (int): Reply length limit; None keeps the provider's default.
+        provider (str): Overrides options['model_provider'].
+        timeout (float): Seconds before the request is cancelled; defaults to
+            the 'request_timeout' option (None or 0 means no limit).
+
+    Returns:
+        concurrent.futures.Future: The reply, a dict with its 'content' and
+        usage (see usage_from_ollama()), or a ProviderError.
+    """
+    client = get_async_provider(options, provider)
+    return _provider_loop.submit(
+        client.complete(options['model'], messages, temperature, max_tokens),
+        options.get('request_timeout') if timeout is None else timeout
+    )
+
+
+def chat(messages, options, temperature=None, max_tokens=None, provider=None, timeout=None, usage=None):
+    """Send a chat request and wait for the reply text; see submit_chat(). usage, if given, is filled in."""
+    future = submit_chat(messages, options, temperature, max_tokens, provider, timeout)
+    try:
+        reply = future.result()
+    finally:
+        future.cancel()
+    if usage is not None:
+        usage.update((key, value) for key, value in reply.items() if key != 'content')
+    return reply['content']
+
+
+def stream_chat(messages, options, temperature=None, max_tokens=None, provider=None, timeout=None, usage=None):
+    """Yield reply text chunks as they arrive; see chat() for the arguments"""
+    client = get_async_provider(options, provider)
+    return _provider_loop.stream(
+        client.stream_chat(options['model'], messages, temperature, max_tokens, usage),
+        options.get('request_timeout') if timeout is None else timeout
+    )
+
+
+def complete_chat(messages, options, temperature=None, max_tokens=None):
+    """
+    Return the reply to messages from the configured provider without rendering it.
+
+    Used for background work such as summaries; errors are raised to the caller.
+    """
+    temperature = options['temperature'] if temperature is None else temperature
+    max_tokens = options['max_tokens'] if max_tokens is None else max_tokens
+    return chat(messages, options, temperature, max_tokens)
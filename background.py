@@ -0,0 +1,97 @@
+# background.py
+
+import threading
+from concurrent.futures import Future
+
+_current = threading.local()
+
+
+def task_cancelled():
+    """Return whether the background task running on this thread has been cancelled"""
+    event = getattr(_current, 'cancelled', None)
+    return event is not None and event.is_set()
+
+
+class BackgroundTasks:
+    """
+    Run named pieces of work on daemon threads.
+
+    Daemon threads (rather than a ThreadPoolExecutor, whose workers are joined
+    at interpreter exit) let Sage quit while a slow model call is still running.
+
+    on_cancel, if given, is called with the thread id of a task that is
+    cancelled while running, to stop the work it has in flight (see
+    ProviderLoop.cancel_thread()).
+    """
+
+    def __init__(self, on_cancel=None):
+        self.futures = {}
+        self.threads = {}
+        self.cancel_events = {}
+        self.on_cancel = on_cancel
+
+    def submit(self, name, fn, *args, **kwargs):
+        future = Future()
+        cancelled = threading.Event()
+
+        def run():
+            if not future.set_running_or_notify_cancel():
+                return
+            _current.cancelled = cancelled
+            try:
+                future.set_result(fn(*args, **kwargs))
+            except BaseException as e:
+                future.set_exception(e)
+
+        thread = threading.Thread(target=run, name=f"sage-{name}", daemon=True)
+        self.futures[name] = future
+        self.threads[name] = thread
+        self.cancel_events[name] = cancelled
+        thread.start()
+        return future
+
+    def pending(self, name):
+        return name in self.futures
+
+    def done(self, name):
+        return name in self.futures and self.futures[name].done()
+
+    def pop(self, name, default=None):
+        """
+        Remove a task and return its result, waiting for it to finish if needed.
+
+        Returns default if the task is unknown or raised an exception.
+        """
+        future = self.futures.pop(name, None)
+        self.threads.pop(name, None)
+        self.cancel_events.pop(name, None)
+        if future is None:
+            return default
+        try:
+            return future.result()
+        except Exception as e:
+            print(f"Background task '{name}' failed: {e}")
+            return default
+
+    def discard(self, name):
+        """Forget a task; it keeps running but its result is no longer collected."""
+        self.futures.pop(name, None)
+        self.threads.pop(name, None)
+        self.cancel_events.pop(name, None)
+
+    def cancel(self, name):
+        """
+        Forget a task and stop it.
+
+        The task sees task_cancelled() become true, and on_cancel stops the
+        requests it is waiting for.
+        """
+        future = self.futures.pop(name, None)
+        thread = self.threads.pop(name, None)
+        cancelled = self.cancel_events.pop(name, None)
+        if future is None:
+            return
+        cancelled.set()
+        future.cancel()
+        if self.on_cancel is not None and thread.is_alive():
+            self.on_cancel(thread.ident)
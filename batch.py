@@ -0,0 +1,152 @@
+# batch.py
+
+import os
+import sys
+import json
+import time
+import asyncio
+from concurrent.futures import as_completed
+from async_providers import ProviderError, get_async_provider, get_provider_loop, with_timeout
+
+
+def default_output_path(input_path):
+    root, _ = os.path.splitext(input_path)
+    return f"{root}.results.jsonl"
+
+
+def read_batch_items(path):
+    """
+    Read batch prompts from a JSON lines file.
+
+    Each line is either an object with a 'prompt' and an optional 'id', or a
+    bare JSON string. Items without an id are numbered by their line. Blank
+    lines are skipped; invalid lines are reported and skipped.
+
+    Returns:
+        List[Dict[str, str]]: The items, with 'id' and 'prompt'.
+    """
+    items = []
+    with open(path, 'r') as f:
+        for line_number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            try:
+                data = json.loads(line)
+            except json.JSONDecodeError as e:
+                print(f"Skipping line {line_number}: invalid JSON ({e})", file=sys.stderr)
+                continue
+            if isinstance(data, str):
+                data = {'prompt': data}
+            if not isinstance(data, dict) or not isinstance(data.get('prompt'), str):
+                print(f"Skipping line {line_number}: expected a string or an object with a 'prompt'", file=sys.stderr)
+                continue
+            items.append({'id': str(data.get('id', line_number)), 'prompt': data['prompt']})
+    return items
+
+
+def completed_ids(output_path):
+    """Return the ids that already have a successful result in output_path"""
+    done = set()
+    if not os.path.exists(output_path):
+        return done
+    with open(output_path, 'r') as f:
+        for line in f:
+            try:
+                result = json.loads(line)
+            except json.JSONDecodeError:
+                # A line cut short by an interrupted run
+                continue
+            if isinstance(result, dict) and result.get('error') is None and 'id' in result:
+                done.add(str(result['id']))
+    return done
+
+
+def run_batch(input_path, options, prefix_messages, output_path=None, concurrency=None):
+    """
+    Answer every prompt in a JSON lines file without user interaction.
+
+    Requests run concurrently on the provider loop, at most ``concurrency`` at a
+    time ('batch_concurrency' by default, itself capped by
+    'max_concurrent_requests'). Each result is appended to the
+    output file as soon as it arrives, with its latency and token counts.
+    Prompts that already have a successful result in the output file are
+    skipped, so an interrupted or partly failed run is resumed by running the
+    same command again.
+
+    Args:
+        input_path (str): JSON lines file of prompts, see read_batch_items().
+        options (Dict[str, Any]): Configuration options.
+        prefix_messages (List[Dict[str, str]]): Messages sent before each prompt,
+            e.g. the system prompt and system information.
+        output_path (str): Results file; defaults to <input>.results.jsonl.
+        concurrency (int): Maximum number of requests in flight.
+
+    Returns:
+        int: The exit status: 0 if every prompt succeeded, 1 if any failed,
+        130 if interrupted.
+    """
+    output_path = output_path or default_output_path(input_path)
+    concurrency = max(1, concurrency or options.get('batch_concurrency', 4))
+    try:
+        items = read_batch_items(input_path)
+    except OSError as e:
+        print(f"Error reading batch input: {e}", file=sys.stderr)
+        return 1
+
+    done = completed_ids(output_path)
+    pending = [item for item in items if item['id'] not in done]
+    if done:
+        print(f"Resuming: {len(items) - len(pending)} of {len(items)} prompts already answered", file=sys.stderr)
+    if not pending:
+        return 0
+
+    client = get_async_provider(options)
+    limit = asyncio.Semaphore(concurrency)
+
+    async def answer(item):
+        messages = prefix_messages + [{'role': 'user', 'content': item['prompt']}]
+        async with limit:
+            start = time.perf_counter()
+            try:
+                # The timeout covers the request itself, not the wait for a free slot
+                reply = await with_timeout(
+                    client.complete(options['model'], messages, options['temperature'], options['max_tokens']),
+                    options.get('request_timeout')
+                )
+                error = None
+            except ProviderError as e:
+                reply = {}
+                error = str(e)
+            latency = time.perf_counter() - start
+        return {
+            'id': item['id'],
+            'prompt': item['prompt'],
+            'response': reply.get('content'),
+            'error': error,
+            'model': options['model'],
+            'latency': round(latency, 3),
+            'prompt_tokens': reply.get('prompt_tokens'),
+            'completion_tokens': reply.get('completion_tokens')
+        }
+
+    loop = get_provider_loop()
+    futures = [loop.submit(answer(item)) for item in pending]
+    failed = 0
+    try:
+        with open(output_path, 'a') as output:
+            for completed, future in enumerate(as_completed(futures), 1):
+                result = future.result()
+                output.write(json.dumps(result) + '\n')
+                output.flush()
+                if result['error']:
+                    failed += 1
+                status = f"failed: {result['error']}" if result['error'] else f"{result['latency']:.2f}s"
+                print(f"[{completed}/{len(pending)}] {result['id']} {status}", file=sys.stderr)
+    except KeyboardInterrupt:
+        for future in futures:
+            future.cancel()
+        print("\nInterrupted. Run the same command again to resume.", file=sys.stderr)
+        return 130
+
+    print(f"{len(pending) - failed} answered, {failed} failed. Results in {output_path}", file=sys.stderr)
+    return 1 if failed else 0
@@ -0,0 +1,484 @@
+# benchmarks/bench.py
+#
+# End-to-end benchmarks of Sage's own overhead, run against the mock model
+# server in mock_server.py so model time is scripted and can be subtracted.
+#
+#   cold_start      'import sage' in a fresh interpreter
+#   first_prompt    launching sage.py until the prompt is shown
+#   turn_overhead   one turn, minus the time the mock server spent on it
+#   render          rendering a large Markdown reply, streamed and at once
+#   memory          RSS growth over a long session
+#   system_info     gather_system_info() with a cold and a warm cache
+#   models          load_available_models() with a cold and a warm cache
+#
+# Each benchmark is repeated and reported as a median, in a HOME of its own so
+# the user's ~/.sage is never touched. Save a run with --json and compare a
+# later one against it with --compare to catch regressions.
+#
+# Usage: python3 benchmarks/bench.py [--quick] [--only turn_overhead,...]
+#                                    [--json results.json] [--compare baseline.json]
+
+import io
+import os
+import pty
+import sys
+import json
+import time
+import shutil
+import select
+import signal
+import argparse
+import platform
+import tempfile
+import statistics
+import subprocess
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+from mock_server import MockModelServer, MODELS  # noqa: E402
+
+PROMPT_MARKER = b'Prompt: '
+# Printed under every streamed reply
+REPLY_DONE_MARKER = b'First token: '
+SYSTEM_PROMPT_QUESTION = b'System prompt not found'
+OPENAI_MODEL = 'gpt-4o-mini'
+
+# Scripted model timing for the interactive benchmarks: the same for every run
+TTFT = 0.05
+TOKENS_PER_SECOND = 400
+
+BENCHMARKS = ['cold_start', 'first_prompt', 'turn_overhead', 'render', 'memory', 'system_info', 'models']
+
+
+def median(values):
+    return statistics.median(values) if values else None
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    if not values:
+        return None
+    return values[min(len(values) - 1, int(round(fraction * (len(values) - 1))))]
+
+
+def make_home(root, name, mock_url, provider='ollama'):
+    """Create a HOME with a ~/.sage/config.json pointing Sage at the mock server"""
+    home = os.path.join(root, name)
+    sage_dir = os.path.join(home, '.sage')
+    os.makedirs(sage_dir, exist_ok=True)
+    config = {
+        'model': OPENAI_MODEL if provider == 'openai' else MODELS[0],
+        'model_provider': provider,
+        'ollama_url': mock_url,
+        'semantic_cache': False,
+        # The response cache only serves deterministic requests; keep it out
+        # of the way so every turn reaches the (mock) model
+        'response_cache': 'off',
+        'temperature': 0.3,
+        'stream': True,
+        # Prefill requests would overlap the measured turns and blur the
+        # subtraction of model time
+        'speculative_prefill': False
+    }
+    with open(os.path.join(sage_dir, 'config.json'), 'w') as f:
+        json.dump(config, f)
+    return home
+
+
+def sage_env(home, mock_url):
+    env = dict(os.environ, HOME=home, PYTHONPATH=REPO_DIR, TERM='xterm-256color',
+               COLUMNS='100', LINES='40', PROMPT_TOOLKIT_NO_CPR='1')
+    env['OPENAI_API_BASE'] = f"{mock_url}/v1"
+    return env
+
+
+class SageSession:
+    """sage.py running in a pseudo-terminal, driven like a user would"""
+
+    def __init__(self, home, mock_url):
+        self.start = time.perf_counter()
+        env = sage_env(home, mock_url)
+        self.pid, self.fd = pty.fork()
+        if self.pid == 0:
+            os.chdir(REPO_DIR)
+            os.execve(sys.executable, [sys.executable, os.path.join(REPO_DIR, 'sage.py')], env)
+        self.buffer = b''
+
+    def read(self, timeout):
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return b''
+        try:
+            data = os.read(self.fd, 65536)
+        except OSError:
+            raise EOFError("sage.py exited")
+        if not data:
+            raise EOFError("sage.py exited")
+        return data
+
+    def expect(self, marker=PROMPT_MARKER, timeout=60):
+        """Wait until marker is printed; output before it is discarded"""
+        deadline = time.perf_counter() + timeout
+        while True:
+            index = self.buffer.find(marker)
+            if index >= 0:
+                self.buffer = self.buffer[index + len(marker):]
+                return
+            if SYSTEM_PROMPT_QUESTION in self.buffer:
+                # No /usr/share/sage/system_prompt.txt on this machine; answer once
+                self.buffer = self.buffer.replace(SYSTEM_PROMPT_QUESTION, b'')
+                self.send("You are a Linux assistant.\r")
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                tail = self.buffer[-500:].decode(errors='replace')
+                raise TimeoutError(f"timed out waiting for {marker!r}; last output:\n{tail}")
+            self.buffer += self.read(remaining)
+            # Keep memory flat over long sessions
+            self.buffer = self.buffer[-65536:]
+
+    def drain(self, quiet=0.3):
+        """Discard output until none has arrived for quiet seconds"""
+        while self.read(quiet):
+            pass
+        self.buffer = b''
+
+    def send(self, text):
+        os.write(self.fd, text.encode())
+
+    def rss_kb(self):
+        with open(f"/proc/{self.pid}/status") as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1])
+        return None
+
+    def close(self):
+        try:
+            self.send("exit\r")
+            deadline = time.perf_counter() + 10
+            while time.perf_counter() < deadline:
+                pid, _ = os.waitpid(self.pid, os.WNOHANG)
+                if pid:
+                    break
+                try:
+                    self.read(0.1)
+                except EOFError:
+                    pass
+            else:
+                os.kill(self.pid, signal.SIGKILL)
+                os.waitpid(self.pid, 0)
+        except (OSError, ChildProcessError):
+            pass
+        finally:
+            os.close(self.fd)
+
+
+def wait_for_requests(mock, count, timeout=30):
+    deadline = time.perf_counter() + timeout
+    while mock.counters()[0] < count:
+        if time.perf_counter() > deadline:
+            raise TimeoutError(f"expected {count} model requests, saw {mock.counters()[0]}")
+        time.sleep(0.01)
+
+
+def start_session(template, root, name, mock):
+    """Launch sage.py in a copy of the template HOME and wait until the greeting is done"""
+    home = os.path.join(root, name)
+    shutil.copytree(template, home)
+    requests_before = mock.counters()[0]
+    session = SageSession(home, mock.url)
+    session.expect()
+    # The greeting is generated in the background after the prompt appears
+    wait_for_requests(mock, requests_before + 1)
+    session.drain()
+    return session
+
+
+def run_turn(session, mock, text):
+    """Send one prompt; return (wall seconds, model seconds) until the next prompt"""
+    _, model_before = mock.counters()
+    start = time.perf_counter()
+    session.send(text + "\r")
+    # prompt_toolkit redraws the prompt line with the input when Enter is
+    # pressed, so wait for the reply's timing line before the next prompt
+    session.expect(REPLY_DONE_MARKER)
+    session.expect()
+    wall = time.perf_counter() - start
+    _, model_after = mock.counters()
+    return wall, model_after - model_before
+
+
+# Benchmarks. Each returns {metric: (value, unit)}.
+
+def bench_cold_start(ctx):
+    script = ("import time; start = time.perf_counter(); import sage; "
+              "print((time.perf_counter() - start) * 1000)")
+    env = dict(os.environ, HOME=ctx['template'], PYTHONPATH=REPO_DIR)
+    # Warm the bytecode cache first
+    subprocess.run([sys.executable, '-c', 'import sage'], cwd=REPO_DIR, env=env, check=True, capture_output=True)
+    imports, processes = [], []
+    for _ in range(ctx['repeat'] * 2):
+        start = time.perf_counter()
+        result = subprocess.run([sys.executable, '-c', script], cwd=REPO_DIR, env=env,
+                                check=True, capture_output=True, text=True)
+        processes.append((time.perf_counter() - start) * 1000)
+        imports.append(float(result.stdout.strip().splitlines()[-1]))
+    return {
+        'import_ms': (median(imports), 'ms'),
+        'process_ms': (median(processes), 'ms')
+    }
+
+
+def bench_first_prompt(ctx):
+    mock = ctx['mock']
+    timings = []
+    for run in range(ctx['repeat']):
+        home = os.path.join(ctx['root'], f"first_prompt_{run}")
+        shutil.copytree(ctx['template'], home)
+        session = SageSession(home, mock.url)
+        try:
+            session.expect()
+            timings.append((time.perf_counter() - session.start) * 1000)
+        finally:
+            session.close()
+    return {'first_prompt_ms': (median(timings), 'ms')}
+
+
+def bench_turn_overhead(ctx):
+    results = {}
+    for provider, template in ctx['templates'].items():
+        session = start_session(template, ctx['root'], f"turns_{provider}", ctx['mock'])
+        overheads = []
+        try:
+            for turn in range(ctx['turns']):
+                wall, model = run_turn(session, ctx['mock'], f"How do I check why service number {turn} failed?")
+                overheads.append((wall - model) * 1000)
+        finally:
+            session.close()
+        results[f"{provider}_p50_ms"] = (median(overheads), 'ms')
+        results[f"{provider}_p95_ms"] = (percentile(overheads, 0.95), 'ms')
+    return results
+
+
+def large_markdown(sections=60):
+    parts = []
+    for n in range(sections):
+        parts.append(f"## Step {n}\n\nCheck the unit with `systemctl status app{n}` and read the log. "
+                     "The **service** may fail because of a *configuration* error, a busy port, "
+                     "or missing permissions on its data directory.\n")
+        parts.append(f"```bash\nsudo systemctl restart app{n}\njournalctl -u app{n} -n 50 --no-pager\n```\n")
+        parts.append("- first, validate the configuration\n- then, check the port\n- finally, fix permissions\n")
+    return '\n'.join(parts)
+
+
+def bench_render(ctx):
+    from rich.console import Console
+    from rich.markdown import Markdown
+    from streaming import render_stream
+
+    text = large_markdown()
+    chunks = text.split(' ')
+    chunks = [chunk + ' ' for chunk in chunks[:-1]] + chunks[-1:]
+
+    def console():
+        return Console(file=io.StringIO(), force_terminal=True, color_system='truecolor', width=100)
+
+    streamed, whole = [], []
+    for _ in range(ctx['repeat']):
+        start = time.perf_counter()
+        render_stream(iter(chunks), console())
+        streamed.append((time.perf_counter() - start) * 1000)
+
+        start = time.perf_counter()
+        console().print(Markdown(text))
+        whole.append((time.perf_counter() - start) * 1000)
+    return {
+        'stream_ms': (median(streamed), 'ms'),
+        'markdown_ms': (median(whole), 'ms'),
+        'reply_kb': (len(text) / 1024, 'KB')
+    }
+
+
+def bench_memory(ctx):
+    mock = ctx['mock']
+    # Model time does not matter here; answer instantly to keep the run short
+    timing = mock.first_token_delay, mock.tokens_per_second
+    mock.first_token_delay, mock.tokens_per_second = 0, 0
+    session = start_session(ctx['templates']['ollama'], ctx['root'], 'memory', mock)
+    try:
+        # Let the first turns warm up lazily imported modules and caches
+        for turn in range(10):
+            run_turn(session, mock, f"Warm-up question {turn}?")
+        start_kb = session.rss_kb()
+        for turn in range(ctx['session_turns']):
+            run_turn(session, mock, f"Why does service {turn} keep restarting?")
+        end_kb = session.rss_kb()
+    finally:
+        session.close()
+        mock.first_token_delay, mock.tokens_per_second = timing
+    return {
+        'start_mb': (start_kb / 1024, 'MB'),
+        'growth_mb': ((end_kb - start_kb) / 1024, 'MB'),
+        'per_turn_kb': ((end_kb - start_kb) / ctx['session_turns'], 'KB'),
+        'turns': (ctx['session_turns'], '')
+    }
+
+
+def bench_system_info(ctx):
+    import system_info
+    from sage import gather_system_info
+
+    cold, warm = [], []
+    for _ in range(ctx['repeat']):
+        system_info._static_info = system_info._static_info_key = None
+        if os.path.exists(system_info.SYSTEM_INFO_CACHE_FILE):
+            os.remove(system_info.SYSTEM_INFO_CACHE_FILE)
+        start = time.perf_counter()
+        gather_system_info()
+        cold.append((time.perf_counter() - start) * 1000)
+
+        # A new launch: the disk cache is warm, the in-process copy is not
+        system_info._static_info = system_info._static_info_key = None
+        start = time.perf_counter()
+        gather_system_info()
+        warm.append((time.perf_counter() - start) * 1000)
+    return {'cold_ms': (median(cold), 'ms'), 'warm_ms': (median(warm), 'ms')}
+
+
+def bench_models(ctx):
+    import config
+
+    options = dict(config.DEFAULT_OPTIONS, ollama_url=ctx['mock'].url)
+    cold, warm = [], []
+    for _ in range(ctx['repeat']):
+        start = time.perf_counter()
+        config.load_available_models(options, refresh=True)
+        cold.append((time.perf_counter() - start) * 1000)
+
+        start = time.perf_counter()
+        models = config.load_available_models(options)
+        warm.append((time.perf_counter() - start) * 1000)
+    if MODELS[0] not in models['ollama']:
+        raise RuntimeError(f"mock models not listed: {models['ollama']}")
+    return {'cold_ms': (median(cold), 'ms'), 'warm_ms': (median(warm), 'ms')}
+
+
+def compare(results, baseline, tolerance):
+    """Return the metrics that got worse than the baseline by more than tolerance"""
+    regressions = []
+    for name, metrics in results['benchmarks'].items():
+        for metric, data in metrics.items():
+            before = baseline.get('benchmarks', {}).get(name, {}).get(metric)
+            if not before or data['unit'] not in ('ms', 'MB', 'KB') or metric == 'reply_kb':
+                continue
+            # Small absolute differences are noise, whatever the ratio
+            floor = 1.0 if data['unit'] == 'ms' else 0.5
+            if data['value'] > before['value'] * (1 + tolerance) and data['value'] - before['value'] > floor:
+                regressions.append((f"{name}.{metric}", before['value'], data['value'], data['unit']))
+    return regressions
+
+
+def print_results(results):
+    print(f"\n{'benchmark':<36}{'value':>12}")
+    for name, metrics in results['benchmarks'].items():
+        for metric, data in metrics.items():
+            value = data['value']
+            shown = f"{value:.1f} {data['unit']}" if isinstance(value, float) else f"{value} {data['unit']}"
+            print(f"{name + '.' + metric:<36}{shown:>12}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark Sage against a local mock model server")
+    parser.add_argument('--only', help="comma-separated benchmarks: " + ', '.join(BENCHMARKS))
+    parser.add_argument('--repeat', type=int, default=5, help="repetitions per benchmark (median reported)")
+    parser.add_argument('--turns', type=int, default=30, help="turns measured for turn_overhead")
+    parser.add_argument('--session-turns', type=int, default=500, help="turns in the memory benchmark")
+    parser.add_argument('--quick', action='store_true', help="fewer repetitions and turns, for a smoke test")
+    parser.add_argument('--no-openai', action='store_true', help="skip the OpenAI variant of turn_overhead")
+    parser.add_argument('--json', help="write the results to this file")
+    parser.add_argument('--compare', help="baseline results file to compare against")
+    parser.add_argument('--tolerance', type=float, default=0.25, help="allowed slowdown before failing (0.25 = 25%%)")
+    args = parser.parse_args()
+    if args.quick:
+        args.repeat, args.turns, args.session_turns = 2, 5, 50
+
+    selected = args.only.split(',') if args.only else BENCHMARKS
+    unknown = set(selected) - set(BENCHMARKS)
+    if unknown:
+        parser.error(f"unknown benchmarks: {', '.join(sorted(unknown))}")
+
+    root = tempfile.mkdtemp(prefix='sage-bench-')
+    mock = MockModelServer(first_token_delay=TTFT, tokens_per_second=TOKENS_PER_SECOND).start()
+    try:
+        templates = {'ollama': make_home(root, 'template', mock.url)}
+        if not args.no_openai:
+            templates['openai'] = make_home(root, 'template_openai', mock.url, 'openai')
+
+        # The in-process benchmarks import Sage's modules, which read HOME at
+        # import time; point them at the template so its caches get primed
+        os.environ['HOME'] = templates['ollama']
+        sys.path.insert(0, REPO_DIR)
+        from utils import ensure_sage_setup, load_key, encrypt_api_key
+        from system_info import load_static_info
+        import config
+
+        ensure_sage_setup()
+        # A dummy key, so the OpenAI variant starts without asking for one
+        encrypt_api_key('sk-bench', load_key())
+        load_static_info()
+        config.load_available_models(dict(config.DEFAULT_OPTIONS, ollama_url=mock.url))
+        if 'openai' in templates:
+            shutil.copytree(os.path.join(templates['ollama'], '.sage'), os.path.join(templates['openai'], '.sage'),
+                            dirs_exist_ok=True, ignore=shutil.ignore_patterns('config.json'))
+
+        ctx = {
+            'root': root,
+            'mock': mock,
+            'template': templates['ollama'],
+            'templates': templates,
+            'repeat': args.repeat,
+            'turns': args.turns,
+            'session_turns': args.session_turns
+        }
+        results = {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+            'model_timing': {'first_token_delay': TTFT, 'tokens_per_second': TOKENS_PER_SECOND},
+            'benchmarks': {}
+        }
+        for name in BENCHMARKS:
+            if name not in selected:
+                continue
+            print(f"Running {name}...", file=sys.stderr)
+            metrics = globals()[f"bench_{name}"](ctx)
+            results['benchmarks'][name] = {
+                metric: {'value': round(value, 3) if isinstance(value, float) else value, 'unit': unit}
+                for metric, (value, unit) in metrics.items()
+            }
+    finally:
+        mock.stop()
+        shutil.rmtree(root, ignore_errors=True)
+
+    print_results(results)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"\nResults written to {args.json}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print(f"\nRegressions against {args.compare} (tolerance {args.tolerance:.0%}):")
+            for metric, before, after, unit in regressions:
+                print(f"  {metric}: {before:.1f} -> {after:.1f} {unit}")
+            sys.exit(1)
+        print(f"\nNo regressions against {args.compare}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,235 @@
+# benchmarks/mock_server.py
+#
+# A local stand-in for Ollama and the OpenAI API with scripted timing, so
+# Sage's own overhead can be measured separately from model time.
+#
+# Every chat reply takes first_token_delay seconds before its first token and
+# then produces tokens_per_second tokens (words) per second. The time spent
+# inside chat handlers is accumulated in model_time, which benchmarks subtract
+# from the wall time they measure on the client side.
+#
+# Usage: python3 benchmarks/mock_server.py [--port 11434] [--ttft 0.2] [--tokens-per-second 50]
+
+import json
+import time
+import zlib
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_REPLY = (
+    "To see why the service failed, check its status and recent log entries:\n\n"
+    "```bash\nsystemctl status nginx\njournalctl -u nginx --since '10 minutes ago'\n```\n\n"
+    "Common causes are:\n\n"
+    "- a syntax error in the configuration (run `nginx -t`)\n"
+    "- another process already listening on port 80\n"
+    "- missing permissions on the log directory\n\n"
+    "Fix the reported problem and restart the service with `sudo systemctl restart nginx`."
+)
+MODELS = ['bench-model:latest', 'bench-embed:latest']
+EMBEDDING_DIM = 64
+
+
+class MockModelServer:
+    """
+    Threaded HTTP server speaking enough of the Ollama and OpenAI APIs for Sage.
+
+    Ollama: /api/chat (streaming and not), /api/tags, /api/embed, /api/embeddings.
+    OpenAI: /v1/chat/completions (streaming and not), /v1/models.
+    """
+
+    def __init__(self, port=0, first_token_delay=0.0, tokens_per_second=0, reply=DEFAULT_REPLY):
+        self.first_token_delay = first_token_delay
+        self.tokens_per_second = tokens_per_second
+        self.reply = reply
+        self.lock = threading.Lock()
+        self.model_time = 0.0
+        self.chat_requests = 0
+        self.server = ThreadingHTTPServer(('127.0.0.1', port), self._handler_class())
+        self.server.daemon_threads = True
+        self.port = self.server.server_address[1]
+        self.url = f"http://127.0.0.1:{self.port}"
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, name="mock-model-server", daemon=True).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def counters(self):
+        with self.lock:
+            return self.chat_requests, self.model_time
+
+    def tokens(self):
+        """Split the reply into tokens: words with their trailing whitespace"""
+        tokens = []
+        current = ''
+        for char in self.reply:
+            if char.isspace() and current and not current[-1].isspace():
+                tokens.append(current)
+                current = ''
+            current += char
+        if current:
+            tokens.append(current)
+        return tokens
+
+    def generate(self, limit=None):
+        """Yield reply tokens with the scripted timing, at most limit of them if it is positive"""
+        time.sleep(self.first_token_delay)
+        delay = 1.0 / self.tokens_per_second if self.tokens_per_second else 0
+        tokens = self.tokens()
+        for token in tokens[:limit] if limit and limit > 0 else tokens:
+            if delay:
+                time.sleep(delay)
+            yield token
+
+    def record(self, elapsed):
+        with self.lock:
+            self.chat_requests += 1
+            self.model_time += elapsed
+
+    def _handler_class(self):
+        mock = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, format, *args):
+                pass
+
+            def send_json(self, data, status=200):
+                body = json.dumps(data).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def start_chunked(self, content_type):
+                self.send_response(200)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Transfer-Encoding', 'chunked')
+                self.end_headers()
+
+            def write_chunk(self, data):
+                self.wfile.write(b'%x\r\n%s\r\n' % (len(data), data))
+                self.wfile.flush()
+
+            def end_chunked(self):
+                self.wfile.write(b'0\r\n\r\n')
+                self.wfile.flush()
+
+            def do_GET(self):
+                if self.path == '/api/tags':
+                    self.send_json({'models': [{'name': name} for name in MODELS]})
+                elif self.path == '/v1/models':
+                    self.send_json({'object': 'list', 'data': [{'id': name, 'object': 'model'} for name in MODELS]})
+                else:
+                    self.send_json({'error': 'not found'}, 404)
+
+            def do_POST(self):
+                length = int(self.headers.get('Content-Length', 0))
+                request = json.loads(self.rfile.read(length) or b'{}')
+                if self.path in ('/api/embed', '/api/embeddings'):
+                    text = request.get('input') or request.get('prompt') or ''
+                    if isinstance(text, list):
+                        text = text[0]
+                    vector = [(zlib.crc32(word.encode()) % 1000) / 1000.0 for word in (text.split() * EMBEDDING_DIM)[:EMBEDDING_DIM]]
+                    vector += [0.0] * (EMBEDDING_DIM - len(vector))
+                    self.send_json({'embedding': vector, 'embeddings': [vector]})
+                elif self.path == '/api/chat':
+                    self.ollama_chat(request)
+                elif self.path in ('/v1/chat/completions', '/chat/completions'):
+                    self.openai_chat(request)
+                else:
+                    self.send_json({'error': 'not found'}, 404)
+
+            def prompt_tokens(self, request):
+                return sum(len(str(msg.get('content', '')).split()) for msg in request.get('messages', []))
+
+            def ollama_chat(self, request):
+                start = time.perf_counter()
+                model = request.get('model', MODELS[0])
+                limit = request.get('options', {}).get('num_predict')
+                count = 0
+                if request.get('stream', True):
+                    self.start_chunked('application/x-ndjson')
+                    first = None
+                    for token in mock.generate(limit):
+                        first = first or time.perf_counter()
+                        count += 1
+                        self.write_chunk(json.dumps({'model': model, 'message': {'role': 'assistant', 'content': token},
+                                                     'done': False}).encode() + b'\n')
+                    elapsed = time.perf_counter() - start
+                    self.write_chunk(json.dumps(self.ollama_final(model, request, count, elapsed, first, start, '')).encode() + b'\n')
+                    self.end_chunked()
+                else:
+                    first = None
+                    content = ''
+                    for token in mock.generate(limit):
+                        first = first or time.perf_counter()
+                        count += 1
+                        content += token
+                    elapsed = time.perf_counter() - start
+                    self.send_json(self.ollama_final(model, request, count, elapsed, first, start, content))
+                mock.record(elapsed)
+
+            def ollama_final(self, model, request, count, elapsed, first, start, content):
+                prompt_eval = (first or time.perf_counter()) - start
+                return {
+                    'model': model,
+                    'message': {'role': 'assistant', 'content': content},
+                    'done': True,
+                    'prompt_eval_count': self.prompt_tokens(request),
+                    'prompt_eval_duration': int(prompt_eval * 1e9),
+                    'eval_count': count,
+                    'eval_duration': int((elapsed - prompt_eval) * 1e9),
+                    'total_duration': int(elapsed * 1e9)
+                }
+
+            def openai_chat(self, request):
+                start = time.perf_counter()
+                model = request.get('model', MODELS[0])
+                count = 0
+                if request.get('stream'):
+                    self.start_chunked('text/event-stream')
+                    for token in mock.generate():
+                        count += 1
+                        event = {'object': 'chat.completion.chunk', 'model': model,
+                                 'choices': [{'index': 0, 'delta': {'content': token}, 'finish_reason': None}]}
+                        self.write_chunk(f"data: {json.dumps(event)}\n\n".encode())
+                    self.write_chunk(b"data: [DONE]\n\n")
+                    self.end_chunked()
+                else:
+                    for _ in mock.generate():
+                        count += 1
+                    self.send_json({
+                        'object': 'chat.completion',
+                        'model': model,
+                        'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': mock.reply},
+                                     'finish_reason': 'stop'}],
+                        'usage': {'prompt_tokens': self.prompt_tokens(request), 'completion_tokens': count}
+                    })
+                mock.record(time.perf_counter() - start)
+
+        return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Mock Ollama/OpenAI server with scripted latency")
+    parser.add_argument('--port', type=int, default=11434)
+    parser.add_argument('--ttft', type=float, default=0.2, help="seconds before the first token")
+    parser.add_argument('--tokens-per-second', type=float, default=50)
+    args = parser.parse_args()
+    server = MockModelServer(args.port, args.ttft, args.tokens_per_second).start()
+    print(f"Mock model server listening on {server.url}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
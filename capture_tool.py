@@ -1,10 +1,15 @@
 # capture_tool.py
 
 from PyQt5.QtWidgets import QApplication, QWidget, QDesktopWidget
-from PyQt5.QtGui import QPainter, QPen, QColor, QScreen, QPixmap
-from PyQt5.QtCore import Qt, QRect, QPoint
-import os
-from constants import CAPTURE_FILE
+from PyQt5.QtGui import QPainter, QPen, QColor, QPixmap, QImage, QImageWriter
+from PyQt5.QtCore import Qt, QRect, QPoint, QBuffer, QByteArray, QIODevice, QTimer
+
+IMAGE_MIME_TYPES = {
+    'jpeg': 'image/jpeg',
+    'webp': 'image/webp',
+    'png': 'image/png'
+}
+
 
 class CaptureWidget(QWidget):
     def __init__(self):
@@ -14,17 +19,16 @@ class CaptureWidget(QWidget):
         self.setStyleSheet("background-color:black;")
         self.setWindowOpacity(0.3)
         self.origin = QPoint()
+        self.origin_global = QPoint()
         self.end = QPoint()
         self.rect = None
+        self.pixmap = None
 
         # Get all screens
         self.screens = QApplication.screens()
         self.full_geometry = self.get_full_geometry()
         self.setGeometry(self.full_geometry)
 
-        # Create a pixmap of the entire virtual desktop
-        self.fullscreen = self.grab_full_screen()
-
     def get_full_geometry(self):
         # Calculate the bounding rectangle of all screens
         desktop = QDesktopWidget()
@@ -33,16 +37,31 @@ class CaptureWidget(QWidget):
             total_rect = total_rect.united(desktop.screenGeometry(i))
         return total_rect
 
-    def grab_full_screen(self):
-        # Capture the entire virtual desktop
-        full_pixmap = QPixmap(self.full_geometry.size())
-        painter = QPainter(full_pixmap)
+    def grab_region(self, region):
+        """
+        Grab only the given area of the virtual desktop.
+
+        Each screen that intersects the region contributes just its overlapping
+        part; nothing outside the selection is read back from the display.
+        """
+        parts = []
         for screen in self.screens:
-            screen_geo = screen.geometry()
-            screen_pixmap = screen.grabWindow(0)
-            painter.drawPixmap(screen_geo.topLeft(), screen_pixmap)
+            overlap = screen.geometry().intersected(region)
+            if overlap.isEmpty():
+                continue
+            local = overlap.translated(-screen.geometry().topLeft())
+            parts.append((overlap, screen.grabWindow(0, local.x(), local.y(), local.width(), local.height())))
+
+        if len(parts) == 1 and parts[0][0] == region:
+            return parts[0][1]
+
+        pixmap = QPixmap(region.size())
+        pixmap.fill(Qt.black)
+        painter = QPainter(pixmap)
+        for overlap, part in parts:
+            painter.drawPixmap(overlap.topLeft() - region.topLeft(), part)
         painter.end()
-        return full_pixmap
+        return pixmap
 
     def paintEvent(self, event):
         painter = QPainter(self)
@@ -50,8 +69,13 @@ class CaptureWidget(QWidget):
             painter.setPen(QPen(QColor('red'), 2))
             painter.drawRect(self.rect)
 
+    def keyPressEvent(self, event):
+        if event.key() == Qt.Key_Escape:
+            self.close()
+
     def mousePressEvent(self, event):
         self.origin = event.pos()
+        self.origin_global = event.globalPos()
         self.rect = None
         self.update()
 
@@ -63,27 +87,68 @@ class CaptureWidget(QWidget):
     def mouseReleaseEvent(self, event):
         QApplication.restoreOverrideCursor()
         self.hide()  # Hide the widget before capturing
-        x1 = min(self.origin.x(), self.end.x())
-        y1 = min(self.origin.y(), self.end.y())
-        x2 = max(self.origin.x(), self.end.x())
-        y2 = max(self.origin.y(), self.end.y())
-        
-        # Capture the screen area without the overlay
-        img = self.fullscreen.copy(x1, y1, x2-x1, y2-y1)
-        
-        # Ensure the directory exists
-        os.makedirs(os.path.dirname(CAPTURE_FILE), exist_ok=True)
-        
-        img.save(CAPTURE_FILE)
-        print(f"Image captured and saved as '{CAPTURE_FILE}'.")
+        region = QRect(self.origin_global, event.globalPos()).normalized()
+        if region.width() < 2 or region.height() < 2:
+            self.close()
+            return
+
+        # Give the compositor a moment to remove the overlay before grabbing
+        QApplication.processEvents()
+        QTimer.singleShot(50, lambda: self.finish_capture(region))
+
+    def finish_capture(self, region):
+        self.pixmap = self.grab_region(region)
         self.close()
 
-def start_capture():
+
+def encode_pixmap(pixmap, max_dimension=1568, image_format='jpeg', quality=85):
+    """
+    Downscale and encode a pixmap in memory.
+
+    Args:
+        pixmap (QPixmap): The captured image.
+        max_dimension (int): Longest side after downscaling; 0 keeps the size.
+        image_format (str): 'jpeg', 'webp' or 'png'. WebP falls back to JPEG
+            when the Qt image plugin is not installed.
+        quality (int): Encoder quality, 0-100 (ignored for PNG).
+
+    Returns:
+        Tuple[bytes, str, Tuple[int, int]]: The encoded image, its MIME type and its size.
+    """
+    image = pixmap.toImage()
+    if max_dimension and max(image.width(), image.height()) > max_dimension:
+        image = image.scaled(max_dimension, max_dimension, Qt.KeepAspectRatio, Qt.SmoothTransformation)
+
+    image_format = image_format.lower()
+    supported = {bytes(fmt).decode().lower() for fmt in QImageWriter.supportedImageFormats()}
+    if image_format not in IMAGE_MIME_TYPES or image_format not in supported:
+        image_format = 'jpeg'
+    if image_format == 'jpeg' and image.hasAlphaChannel():
+        image = image.convertToFormat(QImage.Format_RGB32)
+
+    data = QByteArray()
+    buffer = QBuffer(data)
+    buffer.open(QIODevice.WriteOnly)
+    image.save(buffer, image_format.upper(), -1 if image_format == 'png' else quality)
+    buffer.close()
+    return bytes(data), IMAGE_MIME_TYPES[image_format], (image.width(), image.height())
+
+
+def start_capture(max_dimension=1568, image_format='jpeg', quality=85):
+    """
+    Let the user select a screen region and return it encoded in memory.
+
+    Returns:
+        Tuple[bytes, str, Tuple[int, int]]: See encode_pixmap(), or None if the
+        capture was cancelled.
+    """
     app = QApplication.instance() or QApplication([])
     widget = CaptureWidget()
     widget.showFullScreen()
     app.exec_()
-    return CAPTURE_FILE  # Return the path of the captured image
+    if widget.pixmap is None or widget.pixmap.isNull():
+        return None
+    return encode_pixmap(widget.pixmap, max_dimension, image_format, quality)
 
 if __name__ == "__main__":
     start_capture()
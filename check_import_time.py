@@ -0,0 +1,86 @@
+# check_import_time.py
+#
+# Startup import budget check. Imports sage in fresh interpreters and fails if
+# the import takes longer than the budget, or if a dependency that should only
+# be loaded on first use (PyQt5 for 'capture', openai for the OpenAI provider,
+# ...) is pulled in at startup.
+#
+# Usage: python3 check_import_time.py [--budget-ms 200] [--runs 5]
+
+import os
+import sys
+import json
+import argparse
+import subprocess
+
+IMPORT_BUDGET_MS = 200
+RUNS = 5
+
+# Modules that must not be imported by 'import sage'
+DEFERRED_MODULES = [
+    'PyQt5',
+    'openai',
+    'aiohttp',
+    'numpy',
+    'cryptography',
+    'psutil',
+    'requests',
+    'rich.markdown',
+    'rich.progress'
+]
+
+MEASURE_SCRIPT = """
+import sys, json, time
+start = time.perf_counter()
+import sage
+elapsed = (time.perf_counter() - start) * 1000
+print(json.dumps({'elapsed_ms': elapsed, 'modules': [m for m in %r if m in sys.modules]}))
+""" % (DEFERRED_MODULES,)
+
+
+def measure_once(repo_dir):
+    """Import sage in a new interpreter and return (milliseconds, deferred modules loaded)"""
+    env = dict(os.environ, PYTHONPATH=repo_dir)
+    result = subprocess.run([sys.executable, '-c', MEASURE_SCRIPT], cwd=repo_dir, env=env,
+                            capture_output=True, text=True, check=True)
+    data = json.loads(result.stdout.strip().splitlines()[-1])
+    return data['elapsed_ms'], data['modules']
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check the import time of sage against a budget")
+    parser.add_argument('--budget-ms', type=float, default=IMPORT_BUDGET_MS)
+    parser.add_argument('--runs', type=int, default=RUNS)
+    args = parser.parse_args()
+
+    repo_dir = os.path.dirname(os.path.abspath(__file__))
+    # The first run also compiles and caches bytecode; it is not counted
+    measure_once(repo_dir)
+
+    timings = []
+    loaded = set()
+    for _ in range(args.runs):
+        elapsed, modules = measure_once(repo_dir)
+        timings.append(elapsed)
+        loaded.update(modules)
+
+    # The best run is the least affected by other load on the machine
+    best = min(timings)
+    print(f"import sage: best {best:.1f} ms, worst {max(timings):.1f} ms "
+          f"over {args.runs} runs (budget {args.budget_ms:.0f} ms)")
+
+    failed = False
+    if best > args.budget_ms:
+        print(f"FAIL: import time exceeds the budget by {best - args.budget_ms:.1f} ms")
+        failed = True
+    if loaded:
+        print(f"FAIL: imported at startup instead of on first use: {', '.join(sorted(loaded))}")
+        failed = True
+    if failed:
+        print("Run 'python3 -X importtime -c \"import sage\"' to see where the time goes.")
+        sys.exit(1)
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()
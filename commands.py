@@ -4,7 +4,16 @@ import sys
 import os
 from config import save_options, load_available_models, read_api_key 
 from utils import encrypt_api_key, load_key
-from conversation import clear_conversation, save_conversation
+import time
+from rich.markup import escape
+from conversation import clear_conversation, end_conversation, search_conversations, save_conversation, save_summary, current_session_id
+from context_window import split_pinned, count_tokens
+from summarizer import map_reduce_summary
+from system_info import find_packages, get_probe_timings, load_static_info
+from response_cache import cache_enabled, get_response_cache
+from metrics import MODEL_FIELDS, percentile, summarize_turns
+from hedging import breaker_states, get_hedge_stats
+from shell_pool import get_shell_pool
 from rich.console import Console
 from rich.theme import Theme
 
@@ -25,14 +34,306 @@ Available commands:
 - api: Manage API key
 - capture: Capture screen and send image to AI
 - clear: Clear the conversation history
+- history search <terms>: Search past conversations
+- summarize: Summarize the current conversation
+- packages <name>: Look up installed packages and share them with Sage
+- shell [restart]: Show the shells that run your commands, or start fresh ones
+- profile on|off: Profile each turn with cProfile and tracemalloc and show the hotspots (start with --profile to include startup)
+- prefill on|off: Evaluate the conversation in Ollama while you type, so answers start sooner
+- stats [all]: Show where the time goes in each turn (p50/p95 per stage) for this session or all sessions
+- cache stats|clear: Show or clear the response cache; stats also shows prompt prefix reuse (prefix a question with ! to bypass the cache)
 - exit: Exit the program
     """
     print(help_text)
 
 
-def exit_program(conversation):
+def show_packages(pattern, conversation):
+    """Look up installed packages by name and add the matches to the conversation"""
+    if not pattern:
+        packages = load_static_info()['packages']
+        count = len(packages) if packages is not None else 'an unknown number of'
+        console.print(f"[info]{count} packages installed. Usage: packages <name>[/info]")
+        return
+
+    matches = find_packages(pattern)
+    if not matches:
+        console.print(f"[warning]No installed packages match '{pattern}'.[/warning]")
+        return
+
+    for name, version in matches[:50]:
+        console.print(f"{name} [cyan]{version}[/cyan]")
+    if len(matches) > 50:
+        console.print(f"[info]... and {len(matches) - 50} more[/info]")
+
+    package_list = ', '.join(f"{name} {version}" for name, version in matches[:50])
+    conversation.append({'role': 'system', 'content': f"Installed packages matching '{pattern}': {package_list}"})
+
+
+def manage_response_cache(action, options, prefix_stats=None):
+    from semantic_cache import get_semantic_cache
+
+    cache = get_response_cache(options)
+    if action == 'stats':
+        stats = cache.stats()
+        if not cache_enabled(options):
+            # The semantic cache is gated the same way
+            console.print(f"[warning]The response and semantic caches are off: 'response_cache' is "
+                          f"'{options.get('response_cache', 'auto')}' and the temperature is "
+                          f"{options.get('temperature')} ('auto' only caches at temperature 0; "
+                          f"'always' caches at any temperature).[/warning]")
+        console.print(f"Entries: [cyan]{stats['entries']}[/cyan]")
+        console.print(f"Size: [cyan]{stats['bytes'] / 1024:.1f} KB[/cyan]")
+        console.print(f"Hits this session: [cyan]{stats['session_hits']}[/cyan]")
+        console.print(f"Misses this session: [cyan]{stats['session_misses']}[/cyan]")
+        console.print(f"Location: [cyan]{stats['path']}[/cyan]")
+        semantic_cache = get_semantic_cache(options)
+        if semantic_cache is not None:
+            console.print(f"Semantic entries: [cyan]{len(semantic_cache.entries)}[/cyan]")
+        if prefix_stats is not None:
+            show_prefix_stats(prefix_stats)
+    elif action == 'clear':
+        cache.clear()
+        semantic_cache = get_semantic_cache(options)
+        if semantic_cache is not None:
+            semantic_cache.clear()
+        console.print("[success]Response cache cleared.[/success]")
+    else:
+        console.print("[warning]Usage: cache stats|clear[/warning]")
+
+
+def show_prefix_stats(prefix_stats, turns=10):
+    """Show how much of the recent requests' prompts was shared with the request before"""
+    if not prefix_stats.turns:
+        return
+    reuse = prefix_stats.summary()
+    if reuse is not None:
+        console.print(f"Prompt prefix reused: [cyan]{reuse:.0%}[/cyan] of prompt tokens on average")
+    first = len(prefix_stats.turns) - min(turns, len(prefix_stats.turns)) + 1
+    for number, turn in enumerate(prefix_stats.turns[-turns:], first):
+        line = (f"  Turn {number}: ~{turn['prompt_tokens']} prompt tokens, "
+                f"~{turn['shared_tokens']} shared with the previous request")
+        if turn['evaluated_tokens'] is not None:
+            line += f", {turn['evaluated_tokens']} evaluated"
+        if turn['prompt_eval'] is not None:
+            line += f" in {turn['prompt_eval'] * 1000:.0f} ms"
+        console.print(f"[info]{line}[/info]")
+
+
+def show_stats(metrics, scope='', prefiller=None):
+    """Show the p50/p95 time of each turn stage for this session, or for all sessions with 'stats all'"""
+    if scope not in ('', 'all'):
+        console.print("[warning]Usage: stats [all][/warning]")
+        return
+    turns = metrics.load_all() if scope == 'all' else metrics.turns
+    startups = [turn for turn in turns if turn['kind'] == 'startup']
+    answered = [turn for turn in turns if turn['kind'] in ('chat', 'cached', 'failed')]
+    commands = [turn for turn in turns if turn['kind'] in ('command', 'bash')]
+    cached = sum(1 for turn in answered if turn['kind'] == 'cached')
+    where = "all sessions" if scope == 'all' else "this session"
+    console.print(f"[info]{len(answered)} questions ({cached} cached), {len(commands)} commands "
+                  f"and {len(startups)} startups in {where}[/info]")
+
+    def print_rows(title, rows, unit='ms'):
+        if not rows:
+            return
+        console.print(f"\n[bold]{title}[/bold]{'':<{max(0, 24 - len(title))}}{'count':>7}{'p50':>10}{'p95':>10}")
+        for name, (count, p50, p95) in rows:
+            console.print(f"  {name:<22}{count:>7}{p50:>8.1f}{unit:>2}{p95:>8.1f}{unit:>2}")
+
+    for title, group in (("Question turns", answered), ("Commands", commands), ("Startup", startups)):
+        if group:
+            print_rows(title, list(summarize_turns(group)['stages'].items()))
+
+    if answered:
+        summary = summarize_turns(answered)
+        labels = dict(MODEL_FIELDS)
+        print_rows("Model", [(labels[key], value) for key, value in summary['model'].items()])
+        print_rows("Tokens", [(label, summary[key]) for key, label in (
+            ('prompt_tokens', "prompt tokens"),
+            ('completion_tokens', "completion tokens"),
+            ('tokens_per_second', "tokens per second")
+        ) if summary[key]], unit='')
+    show_probe_timings()
+    show_hedge_stats()
+    if prefiller is not None:
+        show_prefill_stats(prefiller)
+    if metrics.enabled:
+        console.print(f"\n[info]Per-turn records are written to {metrics.path}[/info]")
+
+
+def show_probe_timings():
+    """Show how long each system probe took the last time it ran"""
+    timings = get_probe_timings()
+    if not timings:
+        return
+    console.print(f"\n[bold]System probes (last run)[/bold]")
+    for name, timing in sorted(timings.items(), key=lambda item: -item[1]['seconds']):
+        status = '' if timing['status'] == 'ok' else f"  {escape(timing['status'])}"
+        console.print(f"  {name:<22}{timing['seconds'] * 1000:>9.1f}ms{status}")
+
+
+def show_hedge_stats():
+    """Show how this session's hedged requests went and the state of each provider's circuit breaker"""
+    stats = get_hedge_stats()
+    if not stats.requests:
+        return
+    console.print(f"\n[bold]Hedging (this session)[/bold]")
+    console.print(f"  {stats.requests} requests, {stats.hedged} hedged, "
+                  f"{stats.fallbacks} answered by the secondary because the primary failed or was skipped")
+    for provider, wins in sorted(stats.hedge_wins.items()):
+        console.print(f"  {provider} won {wins} of {stats.hedged} hedged requests ({wins / stats.hedged:.0%})")
+    if stats.savings:
+        console.print(f"  Latency saved when the secondary won: {sum(stats.savings):.1f}s in total, "
+                      f"p50 {percentile(stats.savings, 0.5):.2f}s, p95 {percentile(stats.savings, 0.95):.2f}s")
+    states = ', '.join(f"{provider} {state}" for provider, state in sorted(breaker_states().items()))
+    if states:
+        console.print(f"  Circuit breakers: {states}")
+
+
+def manage_profiling(action, profiler):
+    """Switch profiling of the following turns on or off, or show whether it is on"""
+    if action == 'on':
+        if not profiler.enabled:
+            profiler.enable()
+        console.print(f"[info]Profiling every turn; profiles are saved to {profiler.directory}[/info]")
+    elif action == 'off':
+        if profiler.enabled:
+            profiler.disable()
+        console.print("[info]Profiling off.[/info]")
+    elif not action:
+        state = "on" if profiler.enabled else "off"
+        console.print(f"[info]Profiling is {state}. Usage: profile on|off[/info]")
+    else:
+        console.print("[warning]Usage: profile on|off[/warning]")
+
+
+def show_prefill_stats(prefiller):
+    """Show how much prompt evaluation the speculative prefill moved off the critical path"""
+    if not prefiller.sent:
+        return
+    console.print("\n[bold]Speculative prefill (this session)[/bold]")
+    if prefiller.warm:
+        console.print(f"  Startup warm-up: model load {(prefiller.warm.get('load_duration') or 0) * 1000:.0f} ms, "
+                      f"{prefiller.warm.get('prompt_tokens') or 0} prefix tokens evaluated in "
+                      f"{(prefiller.warm.get('prompt_eval_duration') or 0) * 1000:.0f} ms")
+    console.print(f"  {prefiller.sent} prefills: {prefiller.used} used, {prefiller.late} still running when "
+                  f"the question was sent, {prefiller.wasted} unused, {prefiller.failed} failed")
+    if prefiller.used:
+        console.print(f"  Prompt evaluation done while typing: {prefiller.saved * 1000:.0f} ms "
+                      f"({prefiller.saved_tokens} tokens)")
+    for label, timings in (("after a prefill", prefiller.eval_after_prefill),
+                           ("without a prefill", prefiller.eval_without_prefill)):
+        if timings:
+            console.print(f"  Request prompt evaluation {label}: p50 {percentile(timings, 0.5) * 1000:.0f} ms, "
+                          f"p95 {percentile(timings, 0.95) * 1000:.0f} ms over {len(timings)} requests")
+
+
+def manage_prefill(action, prefiller):
+    """Switch the speculative prefill on or off for this session, or show whether it is on"""
+    if action in ('on', 'off'):
+        prefiller.options['speculative_prefill'] = action == 'on'
+        console.print(f"[info]Speculative prefill {action} for this session "
+                      f"(set 'speculative_prefill' in the config file to keep it).[/info]")
+        if action == 'on' and prefiller.options['model_provider'] != 'ollama':
+            console.print("[warning]Prefill only applies to Ollama models.[/warning]")
+    elif not action:
+        state = "on" if prefiller.enabled() else "off"
+        console.print(f"[info]Speculative prefill is {state}. Usage: prefill on|off[/info]")
+    else:
+        console.print("[warning]Usage: prefill on|off[/warning]")
+
+
+def manage_shell(action, options):
+    """Show the shell pool's workers, or close them so the next command starts a fresh shell"""
+    pool = get_shell_pool(options)
+    if action == 'restart':
+        pool.close()
+        console.print("[info]Shells closed; the next command starts a new one.[/info]")
+    elif not action:
+        if options.get('command_runner', 'pool') == 'terminal':
+            console.print("[info]Commands open in a new terminal window ('command_runner' is 'terminal').[/info]")
+            return
+        workers = pool.status()
+        if not workers:
+            console.print("[info]No shell running; one starts with the next command.[/info]")
+        for pid, busy, cwd in workers:
+            state = "busy" if busy else "idle"
+            console.print(f"[info]Shell {pid} ({state}) in {escape(cwd or '?')}[/info]")
+    else:
+        console.print("[warning]Usage: shell [restart][/warning]")
+
+
+def search_history(args):
+    action, _, terms = args.partition(' ')
+    if action != 'search' or not terms.strip():
+        console.print("[warning]Usage: history search <terms>[/warning]")
+        return
+
+    start = time.perf_counter()
+    results = search_conversations(terms)
+    elapsed = (time.perf_counter() - start) * 1000
+    if not results:
+        console.print(f"[info]No matches for '{escape(terms)}'.[/info]")
+        return
+
+    for created, role, snippet in results:
+        when = time.strftime('%Y-%m-%d %H:%M', time.localtime(created))
+        # Escape the stored text, but keep the FTS match highlighting
+        snippet = escape(snippet).replace('\\[bold]', '[bold]').replace('\\[/bold]', '[/bold]')
+        console.print(f"[cyan]{when}[/cyan] [info]{role}[/info]: {snippet}")
+    console.print(f"[info]{len(results)} matches in {elapsed:.1f} ms[/info]")
+
+
+def summarize_with_progress(messages, options, previous_summary=None):
+    """Run a map-reduce summary of messages with a progress bar"""
+    from rich.progress import Progress
+
+    with Progress(console=console, transient=True) as progress_bar:
+        task = progress_bar.add_task("Summarizing conversation", total=None)
+
+        def progress(description, completed, total):
+            progress_bar.update(task, description=description, completed=completed, total=total)
+
+        return map_reduce_summary(messages, options, previous_summary, progress)
+
+
+def summarize_session(conversation, options, summarizer):
+    """Summarize the whole current conversation and store it for the next launch"""
+    _, history = split_pinned(conversation)
+    if not history:
+        console.print("[info]Nothing to summarize yet.[/info]")
+        return
+    try:
+        summary = summarize_with_progress(history, options)
+    except Exception as e:
+        console.print(f"[danger]Failed to summarize the conversation: {e}[/danger]")
+        return
+
+    from rich.markdown import Markdown
+
+    console.print(Markdown(summary))
     save_conversation(conversation)
-    console.print("[success]Conversation has been summarized and saved. Goodbye![/success]")
+    save_summary(current_session_id(), summary, len(history))
+    summarizer.summary = summary
+    summarizer.summarized_count = len(history)
+
+
+def exit_program(conversation, options=None, summarizer=None):
+    # Summarize turns the rolling summary has not covered yet, so the next
+    # launch can load the summary without a model call
+    save_conversation(conversation)
+    if options and summarizer:
+        _, history = split_pinned(conversation)
+        pending = history[summarizer.summarized_count:]
+        if count_tokens(pending, options['model_provider']) >= options.get('summary_threshold_tokens', 1500):
+            try:
+                summary = summarize_with_progress(pending, options, summarizer.summary)
+                save_summary(current_session_id(), summary, len(history))
+            except (Exception, KeyboardInterrupt) as e:
+                console.print(f"[warning]Skipped the conversation summary: {e or 'interrupted'}[/warning]")
+
+    end_conversation(conversation)
+    console.print("[success]Conversation has been saved. Goodbye![/success]")
     sys.exit(0)
 
 
@@ -76,14 +377,14 @@ def manage_api_key():
 
 def options_menu(options):
     original_options = options.copy()
-    models = load_available_models()
+    models = load_available_models(options)
 
     while True:
         console.print("\n[bold]Options Menu:[/bold]")
         console.print(f"1. Model: [cyan]{options['model']}[/cyan]")
         console.print(f"2. Temperature: [cyan]{options['temperature']}[/cyan]")
         console.print(f"3. Max tokens: [cyan]{options['max_tokens']}[/cyan]")
-        console.print(f"4. Context window size: [cyan]{options['context_window_size']}[/cyan]")
+        console.print(f"4. Context window size (messages, 0 = no limit): [cyan]{options['context_window_size']}[/cyan]")
         console.print("5. Save changes and return")
         console.print("6. Cancel changes and return")
         
@@ -5,6 +5,7 @@ import os
 from pathlib import Path
 from utils import ensure_sage_setup, load_key, decrypt_api_key, encrypt_api_key
 import sys
+import time
 import subprocess
 
 HOME_DIR = str(Path.home())
@@ -14,6 +15,11 @@ SYSTEM_CONFIG_FILE = '/etc/sage/config.json'
 MODELS_FILE = '/etc/sage/models.json'
 API_ENC_FILE = os.path.join(SAGE_DIR, 'api.enc')  # Add this line
 API_KEY_HELP_FILE = "path/to/api_key_help.txt"
+MODELS_CACHE_FILE = os.path.join(SAGE_DIR, 'models_cache.json')
+MODELS_CACHE_TTL = 3600
+# 'ollama list' is only a fallback; do not let a hung CLI block startup
+OLLAMA_LIST_TIMEOUT = 5
+OLLAMA_SYSTEM_MODELS_DIR = '/usr/share/ollama/.ollama/models'
 
 DEFAULT_OPTIONS = {
     'model': 'llama3.2',
@@ -21,7 +27,43 @@ DEFAULT_OPTIONS = {
     'temperature': 0.3,
     'max_tokens': 1500,
     'context_window_size': 10,
-    'terminal_emulator': 'gnome-terminal'
+    'terminal_emulator': 'gnome-terminal',
+    'command_runner': 'pool',
+    'shell_workers': 2,
+    'command_timeout': 600,
+    'command_output_chars': 4000,
+    'stream': True,
+    'ollama_url': 'http://localhost:11434',
+    'ollama_connect_timeout': 3.05,
+    'ollama_read_timeout': 300,
+    'ollama_keep_alive': '30m',
+    'request_timeout': None,
+    'max_concurrent_requests': 4,
+    'batch_concurrency': 4,
+    'speculative_prefill': True,
+    'hedge': False,
+    'hedge_delay': 2.0,
+    'hedge_model': None,
+    'hedge_failure_threshold': 3,
+    'hedge_cooldown': 60,
+    'background_startup': True,
+    'context_token_budget': None,
+    'context_trim_step': None,
+    'metrics_log': True,
+    'profile_top': 15,
+    'response_cache': 'auto',
+    'response_cache_max_mb': 50,
+    'response_cache_max_age_days': 30,
+    'semantic_cache': True,
+    'semantic_cache_model': 'nomic-embed-text',
+    'semantic_cache_threshold': 0.92,
+    'semantic_cache_max_entries': 5000,
+    'summary_threshold_tokens': 1500,
+    'summary_chunk_tokens': None,
+    'summary_parallelism': 2,
+    'capture_max_dimension': 1568,
+    'capture_format': 'jpeg',
+    'capture_quality': 85
 }
 
 DEFAULT_AVAILABLE_MODELS = [
@@ -29,40 +71,30 @@ DEFAULT_AVAILABLE_MODELS = [
     "gpt-4o"        # Full version available but not default
 ]
 
-def get_default_model():
+def get_default_model(options=None):
     """Determine the default model based on Ollama availability"""
     try:
-        ollama_models = get_ollama_models()
+        ollama_models = get_ollama_models(options)
         if 'llama3.2:latest' in ollama_models:
             return ('llama3.2:latest', 'ollama')
         return ('gpt-4o-mini', 'openai')
     except:
         return ('gpt-4o-mini', 'openai')
 
-# Update DEFAULT_OPTIONS to use the determined default model
-default_model, default_provider = get_default_model()
-DEFAULT_OPTIONS = {
-    'model': default_model,
-    'model_provider': default_provider,
-    'temperature': 0.3,
-    'max_tokens': 1500,
-    'context_window_size': 10,
-    'terminal_emulator': 'gnome-terminal'
-}
-
 def load_options():
     """
     Load user-specific options, then system-wide options, and finally default options.
     User settings override system settings.
     """
     options = DEFAULT_OPTIONS.copy()
+    configured = {}
 
     # Load system-wide options
     if os.path.exists(SYSTEM_CONFIG_FILE):
         try:
             with open(SYSTEM_CONFIG_FILE, 'r') as f:
                 system_options = json.load(f)
-            options.update(system_options)
+            configured.update(system_options)
         except json.JSONDecodeError as e:
             print(f"Error loading system options: {e}")
 
@@ -71,13 +103,15 @@ def load_options():
         try:
             with open(USER_CONFIG_FILE, 'r') as f:
                 user_options = json.load(f)
-            options.update(user_options)
+            configured.update(user_options)
         except json.JSONDecodeError as e:
             print(f"Error loading user options: {e}")
 
-    # Ensure all default options are present
-    for key, value in DEFAULT_OPTIONS.items():
-        options.setdefault(key, value)
+    options.update(configured)
+
+    # Only probe Ollama for a default model when none is configured
+    if 'model' not in configured:
+        options['model'], options['model_provider'] = get_default_model(options)
 
     return options
 
@@ -93,10 +127,77 @@ def save_options(options):
     except Exception as e:
         print(f"Error saving options: {e}")
 
-def get_ollama_models():
-    """Get list of installed Ollama models"""
+def get_ollama_models_dir():
+    """Return the directory Ollama stores its models in"""
+    if os.environ.get('OLLAMA_MODELS'):
+        return os.environ['OLLAMA_MODELS']
+    for path in (os.path.join(HOME_DIR, '.ollama', 'models'), OLLAMA_SYSTEM_MODELS_DIR):
+        if os.path.isdir(path):
+            return path
+    return None
+
+def get_ollama_models_mtime():
+    """
+    Return the latest modification time of the Ollama manifests tree.
+
+    Pulling or removing a model touches a directory under ``manifests``, so the
+    newest directory mtime changes whenever the installed model set changes.
+    """
+    models_dir = get_ollama_models_dir()
+    if not models_dir:
+        return None
+    manifests_dir = os.path.join(models_dir, 'manifests')
+    latest = None
+    for root, dirs, files in os.walk(manifests_dir):
+        try:
+            mtime = os.stat(root).st_mtime
+        except OSError:
+            continue
+        latest = mtime if latest is None else max(latest, mtime)
+    return latest
+
+def read_ollama_models_cache():
+    """Return the cached Ollama model list, or None if it is missing or stale"""
+    try:
+        with open(MODELS_CACHE_FILE, 'r') as f:
+            cache = json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return None
+    if time.time() - cache.get('timestamp', 0) > MODELS_CACHE_TTL:
+        return None
+    if cache.get('models_dir_mtime') != get_ollama_models_mtime():
+        return None
+    return cache.get('ollama')
+
+def write_ollama_models_cache(models):
     try:
-        result = subprocess.run(['ollama', 'list'], capture_output=True, text=True)
+        os.makedirs(SAGE_DIR, exist_ok=True)
+        tmp_file = f"{MODELS_CACHE_FILE}.{os.getpid()}.tmp"
+        with open(tmp_file, 'w') as f:
+            json.dump({
+                'timestamp': time.time(),
+                'models_dir_mtime': get_ollama_models_mtime(),
+                'ollama': models
+            }, f)
+        os.replace(tmp_file, MODELS_CACHE_FILE)
+    except OSError as e:
+        print(f"Error saving model cache: {e}")
+
+def fetch_ollama_models(options=None):
+    """
+    Query the Ollama server for installed models, falling back to 'ollama list'.
+
+    Returns None if neither answered, so a failure is not mistaken for (and
+    cached as) an empty model list.
+    """
+    from providers import get_ollama_client
+    try:
+        return get_ollama_client(options or DEFAULT_OPTIONS).list_models()
+    except Exception:
+        pass
+
+    try:
+        result = subprocess.run(['ollama', 'list'], capture_output=True, text=True, timeout=OLLAMA_LIST_TIMEOUT)
         if result.returncode == 0:
             # Parse the output to extract model names
             models = []
@@ -105,16 +206,35 @@ def get_ollama_models():
                     model_name = line.split()[0]  # First column is model name
                     models.append(model_name)
             return models
-        return []
+        return None
     except (subprocess.SubprocessError, FileNotFoundError):
+        return None
+
+def get_ollama_models(options=None, refresh=False):
+    """
+    Get list of installed Ollama models.
+
+    The list is cached in ~/.sage for MODELS_CACHE_TTL seconds and invalidated
+    early when the Ollama models directory changes. When Ollama cannot be
+    reached the result is an empty list that is not cached, so the next
+    launch asks again.
+    """
+    if not refresh:
+        models = read_ollama_models_cache()
+        if models is not None:
+            return models
+    models = fetch_ollama_models(options)
+    if models is None:
         return []
+    write_ollama_models_cache(models)
+    return models
 
-def load_available_models():
+def load_available_models(options=None, refresh=False):
     """
     Load available models from both Ollama and OpenAI
     """
     models = {
-        'ollama': get_ollama_models(),
+        'ollama': get_ollama_models(options, refresh),
         'openai': DEFAULT_AVAILABLE_MODELS.copy()
     }
     
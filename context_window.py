@@ -0,0 +1,231 @@
+# context_window.py
+
+import math
+
+# Context lengths of known models, in tokens. Unknown Ollama models fall back
+# to Ollama's default context length.
+MODEL_CONTEXT_LIMITS = {
+    'gpt-4o': 128000,
+    'gpt-4o-mini': 128000,
+    'gpt-4-turbo': 128000,
+    'gpt-4': 8192,
+    'gpt-3.5-turbo': 16385,
+    'gpt-3.5-turbo-16k': 16385
+}
+DEFAULT_OLLAMA_CONTEXT = 4096
+DEFAULT_OPENAI_CONTEXT = 8192
+
+# Rough characters-per-token ratios; Llama-family tokenizers split English text
+# a little finer than OpenAI's.
+CHARS_PER_TOKEN = {
+    'openai': 4.0,
+    'ollama': 3.5
+}
+MESSAGE_OVERHEAD_TOKENS = 4
+FOLD_PROMPT_CHARS = 100
+FOLD_MAX_PROMPTS = 10
+
+# System messages that record something that happened during the session.
+# They belong to the history rather than to the pinned prefix.
+NOTE_PREFIXES = ('Command executed:', 'Installed packages matching')
+
+# Trimming step, in messages, when no message limit is configured
+DEFAULT_TRIM_STEP = 8
+
+
+def estimate_tokens(message, provider='openai'):
+    """Estimate the number of tokens a message costs"""
+    content = message.get('content') or ''
+    if not isinstance(content, str):
+        # Multi-part content (e.g. text plus image); only count the text parts
+        content = ' '.join(part.get('text', '') for part in content if isinstance(part, dict))
+    ratio = CHARS_PER_TOKEN.get(provider, 4.0)
+    return MESSAGE_OVERHEAD_TOKENS + math.ceil(len(content) / ratio)
+
+
+def count_tokens(messages, provider='openai'):
+    return sum(estimate_tokens(msg, provider) for msg in messages)
+
+
+def token_budget(options):
+    """
+    Return the prompt token budget for the configured model.
+
+    The 'context_token_budget' option wins if set; otherwise the model's context
+    length minus the tokens reserved for the reply.
+    """
+    if options.get('context_token_budget'):
+        return options['context_token_budget']
+
+    model = options['model']
+    limit = MODEL_CONTEXT_LIMITS.get(model)
+    if limit is None:
+        if options['model_provider'] == 'ollama':
+            limit = DEFAULT_OLLAMA_CONTEXT
+        else:
+            limit = DEFAULT_OPENAI_CONTEXT
+    return max(limit - options.get('max_tokens', 0), limit // 4)
+
+
+def fold_messages(messages):
+    """Fold dropped turns into a short system note listing what the user asked"""
+    prompts = [msg['content'] for msg in messages
+               if msg['role'] == 'user' and isinstance(msg.get('content'), str)]
+    if not prompts:
+        return None
+    prompts = prompts[-FOLD_MAX_PROMPTS:]
+    asked = '; '.join(
+        prompt if len(prompt) <= FOLD_PROMPT_CHARS else prompt[:FOLD_PROMPT_CHARS] + '...'
+        for prompt in prompts
+    )
+    return {
+        'role': 'system',
+        'content': f"Earlier turns were trimmed from the context. The user previously asked: {asked}"
+    }
+
+
+def is_note(message):
+    return message['role'] == 'system' and message['content'].startswith(NOTE_PREFIXES)
+
+
+def split_pinned(conversation):
+    """
+    Split the pinned prefix from the rest of the conversation.
+
+    The prefix is the leading run of system messages (system prompt, system
+    info, previous conversation summary), up to the first session note.
+    """
+    pinned_count = 0
+    while pinned_count < len(conversation) and conversation[pinned_count]['role'] == 'system' \
+            and not is_note(conversation[pinned_count]):
+        pinned_count += 1
+    return conversation[:pinned_count], conversation[pinned_count:]
+
+
+def trim_step(options):
+    """Number of messages the window start moves by at a time"""
+    if options.get('context_trim_step'):
+        return options['context_trim_step']
+    max_messages = options.get('context_window_size', 0)
+    if not max_messages:
+        return DEFAULT_TRIM_STEP
+    # Half the window, rounded down to whole user/assistant pairs
+    half = max_messages // 2
+    return max(2, half - half % 2)
+
+
+def build_context_window(conversation, options, fold=fold_messages):
+    """
+    Select the messages to send for the next request.
+
+    The pinned prefix (system prompt, system info, summaries) is always kept.
+    The remaining history is filled newest-first until either
+    'context_window_size' messages (0 means no message limit) or the token
+    budget is reached; the latest message is always kept. Dropped turns are
+    passed to ``fold`` and its note, if it fits, is inserted after the pinned
+    messages.
+
+    The start of the window only moves in steps of trim_step() messages, so
+    the messages sent stay a byte-identical prefix of the next request for
+    several turns and providers can reuse their cached prompt evaluation.
+
+    Args:
+        conversation (List[Dict[str, Any]]): The full conversation history.
+        options (Dict[str, Any]): Configuration options.
+        fold (Callable): Turns dropped messages into a system message or None.
+
+    Returns:
+        Tuple[List[Dict[str, Any]], Dict[str, int]]: The messages to send and
+        the message and token counts before and after trimming.
+    """
+    provider = options['model_provider']
+    pinned, history = split_pinned(conversation)
+
+    max_messages = options.get('context_window_size', 0)
+    budget = token_budget(options)
+    used = count_tokens(pinned, provider)
+
+    kept = []
+    for msg in reversed(history):
+        if max_messages and len(kept) >= max_messages:
+            break
+        tokens = estimate_tokens(msg, provider)
+        if kept and used + tokens > budget:
+            break
+        kept.append(msg)
+        used += tokens
+    kept.reverse()
+
+    start = len(history) - len(kept)
+    if start:
+        # Round the start up to a step boundary; it then stays put until the
+        # history outgrows the limits again
+        step = trim_step(options)
+        start = min(-(-start // step) * step, len(history) - 1)
+        kept = history[start:]
+        used = count_tokens(pinned + kept, provider)
+
+    dropped = history[:start]
+    window = pinned + kept
+    if dropped and fold:
+        note = fold(dropped)
+        if note and used + estimate_tokens(note, provider) <= budget:
+            window = pinned + [note] + kept
+
+    stats = {
+        'messages_before': len(conversation),
+        'tokens_before': count_tokens(conversation, provider),
+        'messages_after': len(window),
+        'tokens_after': count_tokens(window, provider),
+        'dropped': len(dropped)
+    }
+    return window, stats
+
+
+def common_prefix_length(previous, current):
+    """Return the number of leading messages two message lists share"""
+    count = 0
+    for old, new in zip(previous, current):
+        if old != new:
+            break
+        count += 1
+    return count
+
+
+class PrefixStats:
+    """
+    Track how much of each request repeats the previous one.
+
+    A request whose leading messages are identical to the previous request
+    plus its reply can be served from the provider's cached prompt evaluation
+    (Ollama keeps it for the loaded model). For Ollama the tokens actually
+    evaluated and the prompt evaluation time are recorded too, so it can be
+    checked that they stay flat as the session grows.
+    """
+
+    MAX_TURNS = 50
+
+    def __init__(self):
+        self.previous = None
+        self.turns = []
+
+    def record(self, messages, reply, provider, usage=None):
+        usage = usage or {}
+        shared = common_prefix_length(self.previous, messages) if self.previous else 0
+        self.turns.append({
+            'messages': len(messages),
+            'shared_messages': shared,
+            'prompt_tokens': count_tokens(messages, provider),
+            'shared_tokens': count_tokens(messages[:shared], provider),
+            'evaluated_tokens': usage.get('prompt_tokens'),
+            'prompt_eval': usage.get('prompt_eval_duration')
+        })
+        del self.turns[:-self.MAX_TURNS]
+        self.previous = list(messages) + [{'role': 'assistant', 'content': reply}]
+
+    def summary(self):
+        """Return the average share of prompt tokens reused from the previous request, or None"""
+        turns = [turn for turn in self.turns[1:] if turn['prompt_tokens']]
+        if not turns:
+            return None
+        return sum(turn['shared_tokens'] / turn['prompt_tokens'] for turn in turns) / len(turns)
@@ -1,73 +1,273 @@
 # conversation.py
 
-import json
 import os
+import time
+import sqlite3
 from pathlib import Path
+from context_window import split_pinned
 
 HOME_DIR = str(Path.home())
 SAGE_DIR = os.path.join(HOME_DIR, '.sage')
-CONVERSATION_FILE = os.path.join(SAGE_DIR, 'conversation.json')
+CONVERSATION_DB_FILE = os.path.join(SAGE_DIR, 'conversations.db')
 
-def load_conversation():
-    """Load the previous conversation summary"""
-    if os.path.exists(CONVERSATION_FILE):
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    id INTEGER PRIMARY KEY,
+    started REAL NOT NULL,
+    ended REAL,
+    archived INTEGER NOT NULL DEFAULT 0,
+    summary TEXT,
+    summarized_count INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY,
+    session_id INTEGER NOT NULL REFERENCES sessions(id),
+    role TEXT NOT NULL,
+    content TEXT NOT NULL,
+    created REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS messages_session ON messages (session_id, id);
+"""
+
+FTS_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(
+    content, content='messages', content_rowid='id'
+);
+CREATE TRIGGER IF NOT EXISTS messages_fts_insert AFTER INSERT ON messages BEGIN
+    INSERT INTO messages_fts (rowid, content) VALUES (new.id, new.content);
+END;
+"""
+
+
+def message_text(message):
+    """Return a message's content as text; multi-part content keeps its text parts"""
+    content = message.get('content') or ''
+    if isinstance(content, str):
+        return content
+    return ' '.join(part.get('text', '') for part in content if isinstance(part, dict))
+
+
+class ConversationStore:
+    """
+    Append-only SQLite store of sessions and their messages.
+
+    The database runs in WAL mode with a busy timeout and every write is its own
+    short transaction, so several Sage instances can append at the same time.
+    Messages are indexed with FTS5 for 'history search' when SQLite has it.
+    """
+
+    def __init__(self, path=CONVERSATION_DB_FILE):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.db = sqlite3.connect(path, timeout=10)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        self.db.executescript(SCHEMA)
         try:
-            with open(CONVERSATION_FILE, 'r') as f:
-                summary = json.load(f)
-            
-            # Convert summary back into conversation format
-            conversation = []
-            
-            # Check if summary is a dictionary (expected format)
-            if isinstance(summary, dict) and (summary.get('key_points') or summary.get('topics_discussed')):
-                conversation.append({
-                    'role': 'system',
-                    'content': (
-                        "Previous conversation summary:\n"
-                        f"Topics discussed: {', '.join(summary['topics_discussed'])}\n"
-                        f"Key points: {', '.join(summary['key_points'])}"
-                    )
-                })
-                
-            return conversation
-        except json.JSONDecodeError as e:
-            print(f"Error loading conversation summary: {e}")
+            self.db.executescript(FTS_SCHEMA)
+            self.fts = True
+        except sqlite3.OperationalError:
+            self.fts = False
+        self.session_id = None
+        self.saved_count = 0
+        self.saved_conversation = None
+
+    def start_session(self):
+        with self.db:
+            cursor = self.db.execute('INSERT INTO sessions (started) VALUES (?)', (time.time(),))
+        self.session_id = cursor.lastrowid
+        self.saved_count = 0
+        return self.session_id
+
+    def end_session(self):
+        if self.session_id is not None:
+            with self.db:
+                self.db.execute('UPDATE sessions SET ended = ? WHERE id = ?', (time.time(), self.session_id))
+        self.session_id = None
+
+    def append(self, messages):
+        """Append messages to the current session, starting one if needed"""
+        if not messages:
+            return
+        if self.session_id is None:
+            self.start_session()
+        now = time.time()
+        with self.db:
+            self.db.executemany(
+                'INSERT INTO messages (session_id, role, content, created) VALUES (?, ?, ?, ?)',
+                [(self.session_id, msg['role'], msg['content'], now) for msg in messages]
+            )
+
+    def sync(self, conversation):
+        """
+        Persist the messages added to conversation since the last sync.
+
+        Only the history after the pinned prefix (see split_pinned()) is stored:
+        the system prompt, system info and previous conversation summary are
+        rebuilt on every launch, while session notes such as 'Command executed:'
+        belong to the history even before the first question. saved_count
+        counts history messages, so a summary inserted into the prefix after
+        a save does not shift it. A different conversation list, e.g. after
+        'clear', starts a new session.
+
+        Every history message is stored, multi-part content as its text, so
+        the stored messages line up with the history one to one; the
+        summarized_count of save_summary() indexes both.
+        """
+        _, history = split_pinned(conversation)
+        if conversation is not self.saved_conversation or len(history) < self.saved_count:
+            if self.saved_conversation is not None:
+                self.end_session()
+            self.saved_conversation = conversation
+            self.saved_count = 0
+
+        new_messages = [{'role': msg['role'], 'content': message_text(msg)} for msg in history[self.saved_count:]]
+        self.append(new_messages)
+        self.saved_count = len(history)
+
+    def previous_session(self):
+        """
+        Return the most recent earlier session that was not cleared.
+
+        Sessions without a user message, e.g. ones that were closed right after
+        the greeting, are skipped so they do not hide the conversation before.
+
+        Returns:
+            Tuple[List[Dict[str, str]], str, int, int]: Its messages, its stored
+            rolling summary (or None), how many of the messages that summary
+            covers and the session's id (None if there is no such session).
+        """
+        row = self.db.execute(
+            'SELECT s.id, s.summary, s.summarized_count FROM sessions s '
+            'WHERE s.archived = 0 AND s.id IS NOT ? '
+            "AND EXISTS (SELECT 1 FROM messages m WHERE m.session_id = s.id AND m.role = 'user') "
+            'ORDER BY s.id DESC LIMIT 1',
+            (self.session_id,)
+        ).fetchone()
+        if row is None:
+            return [], None, 0, None
+        messages = [
+            {'role': role, 'content': content}
+            for role, content in self.db.execute(
+                'SELECT role, content FROM messages WHERE session_id = ? ORDER BY id', (row[0],)
+            )
+        ]
+        return messages, row[1], row[2], row[0]
+
+    def save_summary(self, session_id, summary, summarized_count):
+        """Store a session's rolling summary, covering its first summarized_count stored messages"""
+        with self.db:
+            self.db.execute('UPDATE sessions SET summary = ?, summarized_count = ? WHERE id = ?',
+                            (summary, summarized_count, session_id))
+
+    def archive_all(self):
+        """
+        Archive the sessions that have ended, this instance's included.
+
+        Sessions other running instances are still writing to are left alone.
+        """
+        with self.db:
+            self.db.execute('UPDATE sessions SET archived = 1 WHERE ended IS NOT NULL OR id IS ?',
+                            (self.session_id,))
+
+    def search(self, terms, limit=10):
+        """
+        Search past messages.
+
+        Returns:
+            List[Tuple[float, str, str]]: (timestamp, role, snippet) tuples, best match first.
+        """
+        words = terms.split()
+        if not words:
             return []
-    return []
+        if self.fts:
+            query = ' '.join('"{}"'.format(word.replace('"', '""')) for word in words)
+            return self.db.execute(
+                'SELECT m.created, m.role, snippet(messages_fts, 0, "[bold]", "[/bold]", "...", 24) '
+                'FROM messages_fts JOIN messages m ON m.id = messages_fts.rowid '
+                'WHERE messages_fts MATCH ? ORDER BY rank LIMIT ?',
+                (query, limit)
+            ).fetchall()
+        clauses = ' AND '.join('content LIKE ?' for _ in words)
+        return self.db.execute(
+            f'SELECT created, role, substr(content, 1, 200) FROM messages WHERE {clauses} '
+            'ORDER BY id DESC LIMIT ?',
+            [f'%{word}%' for word in words] + [limit]
+        ).fetchall()
 
-def save_conversation(conversation):
-    """Summarize and save the important details from the conversation"""
+
+_store = None
+
+
+def get_store():
+    global _store
+    if _store is None:
+        _store = ConversationStore()
+    return _store
+
+
+def load_previous_session():
+    """Load the previous conversation's messages, stored summary, summarized message count and session id"""
+    try:
+        return get_store().previous_session()
+    except sqlite3.Error as e:
+        print(f"Error loading previous conversation: {e}")
+        return [], None, 0, None
+
+
+def save_summary(session_id, summary, summarized_count):
+    """
+    Store a session's rolling summary.
+
+    Uses its own connection so it can be called from the summarizer's thread.
+    """
+    if session_id is None:
+        return
     try:
-        summary = {
-            'key_points': [],
-            'topics_discussed': [],
-            'user_preferences': {}
-        }
-        
-        # Analyze conversation for important points and topics
-        for msg in conversation:
-            if msg['role'] == 'user':
-                # Add user queries to topics discussed
-                summary['topics_discussed'].append(msg['content'])
-            elif msg['role'] == 'assistant':
-                # Extract key points from assistant responses
-                if len(msg['content']) > 50:  # Only summarize substantial responses
-                    summary['key_points'].append(msg['content'][:100] + "...")  # Store beginning of response
-        
-        # Keep only the most recent topics and points
-        summary['topics_discussed'] = summary['topics_discussed'][-5:]  # Keep last 5 topics
-        summary['key_points'] = summary['key_points'][-3:]  # Keep last 3 key points
-        
-        # Save the summarized conversation
-        os.makedirs(SAGE_DIR, exist_ok=True)
-        with open(CONVERSATION_FILE, 'w') as f:
-            json.dump(summary, f, indent=4)
-            
-    except Exception as e:
+        store = ConversationStore()
+        try:
+            store.save_summary(session_id, summary, summarized_count)
+        finally:
+            store.db.close()
+    except sqlite3.Error as e:
         print(f"Error saving conversation summary: {e}")
 
+
+def current_session_id():
+    return get_store().session_id
+
+
+def save_conversation(conversation):
+    """Append the messages added since the last save to the conversation store"""
+    try:
+        get_store().sync(conversation)
+    except sqlite3.Error as e:
+        print(f"Error saving conversation: {e}")
+
+
+def end_conversation(conversation):
+    """Save any remaining messages and close the current session"""
+    save_conversation(conversation)
+    try:
+        get_store().end_session()
+    except sqlite3.Error as e:
+        print(f"Error closing conversation: {e}")
+
+
+def search_conversations(terms, limit=10):
+    try:
+        return get_store().search(terms, limit)
+    except sqlite3.Error as e:
+        print(f"Error searching conversation history: {e}")
+        return []
+
+
 def clear_conversation():
-    if os.path.exists(CONVERSATION_FILE):
-        os.remove(CONVERSATION_FILE)
+    """End the current session and keep past sessions out of the next launch's summary"""
+    try:
+        store = get_store()
+        store.end_session()
+        store.archive_all()
+    except sqlite3.Error as e:
+        print(f"Error clearing conversation: {e}")
     print("Conversation cleared.")
     return []
@@ -0,0 +1,322 @@
+# hedging.py
+
+import time
+import asyncio
+from async_providers import ProviderError, get_async_provider, get_provider_loop
+
+PROVIDERS = ('ollama', 'openai')
+
+# How long a losing primary is kept waiting for its first token, to measure
+# the latency the hedge saved; it is cancelled as soon as that token arrives
+LOSER_MEASURE_LIMIT = 20.0
+
+
+class CircuitBreaker:
+    """
+    Skip a provider that keeps failing.
+
+    After ``threshold`` consecutive failures the circuit opens and the provider
+    is skipped for ``cooldown`` seconds. After that it is tried again
+    (half-open): a success closes the circuit, another failure reopens it.
+    """
+
+    def __init__(self, threshold=3, cooldown=60):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = None
+
+    def state(self):
+        if self.opened_at is None:
+            return 'closed'
+        if time.monotonic() - self.opened_at >= self.cooldown:
+            return 'half-open'
+        return 'open'
+
+    def allow(self):
+        return self.state() != 'open'
+
+    def success(self):
+        self.failures = 0
+        self.opened_at = None
+
+    def failure(self):
+        self.failures += 1
+        if self.failures >= self.threshold:
+            self.opened_at = time.monotonic()
+
+
+class HedgeStats:
+    """Outcomes of this session's hedged requests"""
+
+    def __init__(self):
+        self.requests = 0
+        self.hedged = 0
+        self.fallbacks = 0
+        self.wins = {}
+        self.hedge_wins = {}
+        self.savings = []
+
+    def record(self, winner, hedged, fallback):
+        self.requests += 1
+        self.wins[winner] = self.wins.get(winner, 0) + 1
+        if hedged:
+            self.hedged += 1
+            self.hedge_wins[winner] = self.hedge_wins.get(winner, 0) + 1
+        if fallback:
+            self.fallbacks += 1
+
+    def record_saving(self, seconds):
+        self.savings.append(seconds)
+
+
+_breakers = {}
+_stats = HedgeStats()
+# Background tasks measuring losing requests, kept so they are not collected
+_measurements = set()
+
+
+def get_breaker(provider, options):
+    breaker = _breakers.get(provider)
+    if breaker is None:
+        breaker = _breakers[provider] = CircuitBreaker()
+    breaker.threshold = options.get('hedge_failure_threshold', 3)
+    breaker.cooldown = options.get('hedge_cooldown', 60)
+    return breaker
+
+
+def get_hedge_stats():
+    return _stats
+
+
+def breaker_states():
+    """Return {provider: circuit state} for the providers used so far"""
+    return {provider: breaker.state() for provider, breaker in _breakers.items()}
+
+
+def hedge_model(options, provider):
+    """Return the model used on the secondary provider, or None if there is none"""
+    from config import DEFAULT_AVAILABLE_MODELS, get_ollama_models
+
+    if options.get('hedge_model'):
+        return options['hedge_model']
+    if provider == 'openai':
+        return DEFAULT_AVAILABLE_MODELS[0]
+    models = get_ollama_models(options)
+    return models[0] if models else None
+
+
+class Attempt:
+    """One provider's request within a hedged request"""
+
+    def __init__(self, provider, model, client, temperature, max_tokens):
+        self.provider = provider
+        self.model = model
+        self.client = client
+        self.temperature = temperature
+        self.max_tokens = max_tokens
+        self.usage = {}
+        self.chunks = None
+        self.task = None
+        self.first = None
+        self.ttft = None
+
+    def start(self, messages, stream):
+        """Start the request; the task resolves to the first chunk (streaming) or the full reply"""
+        if stream:
+            self.chunks = self.client.stream_chat(self.model, messages, self.temperature, self.max_tokens, self.usage)
+            self.task = asyncio.ensure_future(self.chunks.__anext__())
+        else:
+            self.task = asyncio.ensure_future(
+                self.client.complete(self.model, messages, self.temperature, self.max_tokens)
+            )
+
+    async def cancel(self):
+        """Cancel the request and close its HTTP stream"""
+        self.task.cancel()
+        await asyncio.wait({self.task})
+        if self.chunks is not None:
+            await self.chunks.aclose()
+
+
+def plan_attempts(options, temperature=None, max_tokens=None):
+    """
+    Return the attempts of a hedged request, primary first.
+
+    The primary is options['model_provider'] with options['model']; the
+    secondary is the other provider with hedge_model(). Providers whose circuit
+    is open are left out, unless that would leave none. Both providers get
+    the same temperature and max_tokens, defaulting to the options.
+    """
+    primary = options['model_provider']
+    secondary = PROVIDERS[1] if primary == PROVIDERS[0] else PROVIDERS[0]
+    candidates = [(primary, options['model'])]
+    model = hedge_model(options, secondary)
+    if model:
+        candidates.append((secondary, model))
+
+    if temperature is None:
+        temperature = options['temperature']
+    if max_tokens is None:
+        max_tokens = options['max_tokens']
+    attempts = [
+        Attempt(provider, model, get_async_provider(options, provider), temperature, max_tokens)
+        for provider, model in candidates
+    ]
+    allowed = [attempt for attempt in attempts if get_breaker(attempt.provider, options).allow()]
+    return allowed or attempts
+
+
+async def race(attempts, messages, options, stream):
+    """
+    Run the attempts as a hedged race and return the first to answer.
+
+    The first attempt starts at once. The next one starts when the previous
+    has not produced a first token (or reply) within 'hedge_delay' seconds,
+    or right away if it failed. Failures count against the provider's circuit
+    breaker.
+
+    Returns:
+        Tuple[Attempt, List[Attempt], bool, bool]: The winner, the attempts
+        still running, whether a secondary request was sent before the
+        primary answered or failed, and whether the primary failed.
+    """
+    loop = asyncio.get_running_loop()
+    delay = options.get('hedge_delay', 2.0)
+    start = loop.time()
+    waiting = list(attempts)
+    running = []
+    errors = []
+    hedged = False
+
+    def launch():
+        attempt = waiting.pop(0)
+        attempt.start(messages, stream)
+        running.append(attempt)
+
+    launch()
+    try:
+        while running:
+            done, _ = await asyncio.wait(
+                [attempt.task for attempt in running],
+                timeout=delay if waiting else None,
+                return_when=asyncio.FIRST_COMPLETED
+            )
+            if not done:
+                hedged = True
+                launch()
+                continue
+            for attempt in [attempt for attempt in running if attempt.task in done]:
+                try:
+                    attempt.first = attempt.task.result()
+                except StopAsyncIteration:
+                    # An empty reply still counts as an answer
+                    attempt.first = None
+                except ProviderError as e:
+                    running.remove(attempt)
+                    errors.append((attempt, e))
+                    get_breaker(attempt.provider, options).failure()
+                    continue
+                attempt.ttft = loop.time() - start
+                running.remove(attempt)
+                primary_failed = any(failed is attempts[0] for failed, _ in errors)
+                return attempt, running, hedged and not primary_failed, primary_failed
+            if not running and waiting:
+                launch()
+    except BaseException:
+        for attempt in running:
+            await attempt.cancel()
+        raise
+
+    if len(errors) == 1:
+        raise errors[0][1]
+    raise ProviderError('; '.join(f"{attempt.provider}: {error}" for attempt, error in errors))
+
+
+async def measure_loser(loser, winner_ttft, start):
+    """Wait (up to LOSER_MEASURE_LIMIT) for the losing primary's first token, record the saving, cancel it"""
+    loop = asyncio.get_running_loop()
+    try:
+        remaining = LOSER_MEASURE_LIMIT - (loop.time() - start)
+        done, _ = await asyncio.wait({loser.task}, timeout=max(0.0, remaining))
+        if not done:
+            _stats.record_saving(LOSER_MEASURE_LIMIT - winner_ttft)
+        elif not loser.task.cancelled() and loser.task.exception() is None:
+            _stats.record_saving(max(0.0, loop.time() - start - winner_ttft))
+    finally:
+        await loser.cancel()
+
+
+def settle(winner, losers, attempts, start):
+    """Cancel the losers; a losing primary is first timed to its first token"""
+    for loser in losers:
+        if loser is attempts[0] and loser.chunks is not None:
+            task = asyncio.ensure_future(measure_loser(loser, winner.ttft, start))
+            _measurements.add(task)
+            task.add_done_callback(_measurements.discard)
+        else:
+            task = asyncio.ensure_future(loser.cancel())
+            _measurements.add(task)
+            task.add_done_callback(_measurements.discard)
+
+
+async def hedged_stream(attempts, messages, options, usage):
+    loop = asyncio.get_running_loop()
+    start = loop.time()
+    winner, losers, hedged, fallback = await race(attempts, messages, options, stream=True)
+    settle(winner, losers, attempts, start)
+    # The primary was skipped because its circuit is open
+    fallback = fallback or attempts[0].provider != options['model_provider']
+    _stats.record(winner.provider, hedged, fallback)
+    usage.update(provider=winner.provider, model=winner.model, hedged=hedged, fallback=fallback)
+    try:
+        if winner.first:
+            yield winner.first
+        if winner.first is not None:
+            async for chunk in winner.chunks:
+                yield chunk
+    except ProviderError:
+        get_breaker(winner.provider, options).failure()
+        raise
+    finally:
+        await winner.chunks.aclose()
+    get_breaker(winner.provider, options).success()
+    usage.update(winner.usage)
+
+
+async def hedged_complete(attempts, messages, options, usage):
+    loop = asyncio.get_running_loop()
+    start = loop.time()
+    winner, losers, hedged, fallback = await race(attempts, messages, options, stream=False)
+    settle(winner, losers, attempts, start)
+    # The primary was skipped because its circuit is open
+    fallback = fallback or attempts[0].provider != options['model_provider']
+    _stats.record(winner.provider, hedged, fallback)
+    get_breaker(winner.provider, options).success()
+    usage.update((key, value) for key, value in winner.first.items() if key != 'content')
+    usage.update(provider=winner.provider, model=winner.model, hedged=hedged, fallback=fallback)
+    return winner.first['content']
+
+
+def hedged_stream_chat(messages, options, temperature=None, max_tokens=None, usage=None):
+    """
+    Stream a reply from whichever provider answers first; see race().
+
+    usage, if given, is filled in with the winner's usage and 'provider',
+    'model', 'hedged' (a secondary request was raced against a slow primary)
+    and 'fallback' (the primary failed or its circuit is open).
+    """
+    attempts = plan_attempts(options, temperature, max_tokens)
+    return get_provider_loop().stream(
+        hedged_stream(attempts, messages, options, {} if usage is None else usage),
+        options.get('request_timeout')
+    )
+
+
+def hedged_chat(messages, options, temperature=None, max_tokens=None, usage=None):
+    """Return the reply text from whichever provider answers first; see hedged_stream_chat()"""
+    attempts = plan_attempts(options, temperature, max_tokens)
+    return get_provider_loop().run(
+        hedged_complete(attempts, messages, options, {} if usage is None else usage),
+        options.get('request_timeout')
+    )
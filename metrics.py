@@ -0,0 +1,201 @@
+# metrics.py
+
+import os
+import json
+import time
+from pathlib import Path
+
+HOME_DIR = str(Path.home())
+SAGE_DIR = os.path.join(HOME_DIR, '.sage')
+METRICS_FILE = os.path.join(SAGE_DIR, 'metrics.jsonl')
+METRICS_MAX_BYTES = 5 * 1024 * 1024
+
+# Per-turn model figures, shown under the stages by 'stats'
+MODEL_FIELDS = [
+    ('ttft', "time to first token"),
+    ('network', "network and queueing"),
+    ('load', "model load"),
+    ('prompt_eval', "prompt evaluation"),
+    ('eval', "generation (model)"),
+]
+
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of values, e.g. fraction=0.95 for p95; None if empty"""
+    values = sorted(values)
+    if not values:
+        return None
+    return values[min(len(values) - 1, int(round(fraction * (len(values) - 1))))]
+
+
+class TurnTimer:
+    """
+    Timing spans for one turn (or for startup).
+
+    lap(name) charges the time since the previous lap to the stage ``name``,
+    so stages can be marked in straight-line code without wrapping it.
+    Stages that occur more than once in a turn are added up.
+    """
+
+    def __init__(self, kind='chat'):
+        self.kind = kind
+        self.start = self.last = time.perf_counter()
+        self.spans = {}
+        self.fields = {}
+
+    def lap(self, name):
+        now = time.perf_counter()
+        self.add(name, now - self.last)
+        self.last = now
+
+    def add(self, name, seconds):
+        if seconds is not None:
+            self.spans[name] = self.spans.get(name, 0.0) + max(0.0, seconds)
+
+    def add_request(self, usage, provider):
+        """
+        Split the request stage using the timings in usage (see request_completion()).
+
+        The wait before the first token, generation and rendering become
+        stages of their own; token counts, tokens per second and Ollama's
+        load/prompt evaluation/generation durations are kept as fields.
+        """
+        request = self.spans.pop('request', None)
+        ttft = usage.get('ttft')
+        render = usage.get('render', 0.0)
+        elapsed = usage.get('elapsed')
+        if elapsed is not None:
+            if ttft is not None:
+                self.add('first_token', ttft)
+                self.add('generation', elapsed - ttft - render)
+            else:
+                self.add('model_request', elapsed - render)
+            self.add('render', render)
+            if request is not None:
+                # Heading, status lines and anything else around the request
+                self.add('request_other', request - elapsed)
+        else:
+            self.add('request', request)
+
+        fields = {
+            'provider': provider,
+            'prompt_tokens': usage.get('prompt_tokens'),
+            'completion_tokens': usage.get('completion_tokens'),
+            'ttft': ttft,
+            'load': usage.get('load_duration'),
+            'prompt_eval': usage.get('prompt_eval_duration'),
+            'eval': usage.get('eval_duration'),
+            'hedged': usage.get('hedged'),
+            'fallback': usage.get('fallback')
+        }
+        if ttft is not None and fields['prompt_eval'] is not None:
+            fields['network'] = max(0.0, ttft - fields['prompt_eval'] - (fields['load'] or 0.0))
+        if fields['completion_tokens'] and fields['eval']:
+            fields['tokens_per_second'] = fields['completion_tokens'] / fields['eval']
+        elif usage.get('chunks') and ttft is not None and elapsed is not None and elapsed > ttft:
+            # OpenAI streams do not report usage; each chunk is about one token
+            fields['tokens_per_second'] = usage['chunks'] / (elapsed - ttft)
+        self.fields.update((key, value) for key, value in fields.items() if value is not None)
+
+    def record(self):
+        """Return the turn as a JSON-serializable dict, with times in milliseconds"""
+        record = {
+            'time': round(time.time(), 3),
+            'kind': self.kind,
+            'total_ms': round((time.perf_counter() - self.start) * 1000, 2),
+            'spans': {name: round(seconds * 1000, 2) for name, seconds in self.spans.items()}
+        }
+        for key, value in self.fields.items():
+            if key in dict(MODEL_FIELDS):
+                record[f"{key}_ms"] = round(value * 1000, 2)
+            elif isinstance(value, float):
+                record[key] = round(value, 2)
+            else:
+                record[key] = value
+        return record
+
+
+class SessionMetrics:
+    """
+    Turn records for this session, also appended to ~/.sage/metrics.jsonl.
+
+    The file is rotated to metrics.jsonl.1 once it exceeds METRICS_MAX_BYTES.
+    Writing can be turned off with the 'metrics_log' option; the session's
+    records are still kept in memory for 'stats'.
+    """
+
+    MAX_TURNS = 1000
+
+    def __init__(self, path=METRICS_FILE, enabled=True):
+        self.path = path
+        self.enabled = enabled
+        self.turns = []
+
+    def record(self, timer, **fields):
+        record = timer.record()
+        record.update((key, value) for key, value in fields.items() if value is not None)
+        self.turns.append(record)
+        del self.turns[:-self.MAX_TURNS]
+        if self.enabled:
+            self._append(record)
+        return record
+
+    def _append(self, record):
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            if os.path.exists(self.path) and os.path.getsize(self.path) > METRICS_MAX_BYTES:
+                os.replace(self.path, f"{self.path}.1")
+            with open(self.path, 'a') as f:
+                f.write(json.dumps(record) + '\n')
+        except OSError as e:
+            print(f"Error writing metrics: {e}")
+            self.enabled = False
+
+    def load_all(self):
+        """Return every record in the metrics file, oldest first"""
+        records = []
+        for path in (f"{self.path}.1", self.path):
+            try:
+                with open(path, 'r') as f:
+                    for line in f:
+                        try:
+                            records.append(json.loads(line))
+                        except json.JSONDecodeError:
+                            continue
+            except OSError:
+                continue
+        return records
+
+
+def summarize_turns(turns):
+    """
+    Return the p50/p95 of every stage and model field over turns.
+
+    Returns:
+        Dict[str, Any]: 'stages' and 'model' map a name to (count, p50, p95)
+        in milliseconds; 'tokens_per_second', 'prompt_tokens' and
+        'completion_tokens' are (count, p50, p95), or None without data.
+    """
+    # Stages in the order they first occur, with the turn total last
+    stages = {}
+    for turn in turns:
+        for name, ms in turn.get('spans', {}).items():
+            stages.setdefault(name, []).append(ms)
+    stages['total'] = [turn.get('total_ms', 0.0) for turn in turns]
+
+    def summary(values):
+        return (len(values), percentile(values, 0.5), percentile(values, 0.95)) if values else None
+
+    model = {}
+    for key, _ in MODEL_FIELDS:
+        values = [turn[f"{key}_ms"] for turn in turns if turn.get(f"{key}_ms") is not None]
+        if values:
+            model[key] = summary(values)
+    return {
+        'stages': {name: summary(values) for name, values in stages.items() if values},
+        'model': model,
+        'tokens_per_second': summary([turn['tokens_per_second'] for turn in turns if turn.get('tokens_per_second')]),
+        'prompt_tokens': summary([turn['prompt_tokens'] for turn in turns if turn.get('prompt_tokens') is not None]),
+        'completion_tokens': summary([turn['completion_tokens'] for turn in turns
+                                      if turn.get('completion_tokens') is not None])
+    }
@@ -0,0 +1,106 @@
+# path_index.py
+
+import os
+import bisect
+from prompt_toolkit.completion import Completer, Completion
+
+
+class ExecutableIndex:
+    """
+    In-memory index of the executables on $PATH.
+
+    The index is built on first use and rebuilt only when $PATH or the mtime of
+    one of its directories changes, so a lookup is a few stat() calls and a
+    dictionary hit instead of a 'which' subprocess.
+    """
+
+    def __init__(self):
+        self.executables = {}
+        self.names = []
+        self.dir_mtimes = None
+        self.path = None
+
+    def _current_mtimes(self, directories):
+        mtimes = {}
+        for directory in directories:
+            try:
+                mtimes[directory] = os.stat(directory).st_mtime
+            except OSError:
+                mtimes[directory] = None
+        return mtimes
+
+    def refresh(self, force=False):
+        """Rebuild the index if $PATH or any of its directories changed"""
+        path = os.environ.get('PATH', '')
+        directories = [d for d in path.split(os.pathsep) if d]
+        mtimes = self._current_mtimes(directories)
+        if not force and path == self.path and mtimes == self.dir_mtimes:
+            return
+
+        executables = {}
+        for directory in directories:
+            if mtimes[directory] is None:
+                continue
+            try:
+                entries = os.scandir(directory)
+            except OSError:
+                continue
+            with entries:
+                for entry in entries:
+                    # Earlier PATH entries win, like the shell's lookup
+                    if entry.name in executables:
+                        continue
+                    try:
+                        if entry.is_file() and os.access(entry.path, os.X_OK):
+                            executables[entry.name] = entry.path
+                    except OSError:
+                        continue
+
+        self.executables = executables
+        self.names = sorted(executables)
+        self.path = path
+        self.dir_mtimes = mtimes
+
+    def lookup(self, name):
+        """Return the full path of an executable, or None"""
+        if os.sep in name:
+            return name if os.path.isfile(name) and os.access(name, os.X_OK) else None
+        self.refresh()
+        return self.executables.get(name)
+
+    def __contains__(self, name):
+        return self.lookup(name) is not None
+
+    def complete(self, prefix):
+        """Return the executable names starting with prefix"""
+        self.refresh()
+        start = bisect.bisect_left(self.names, prefix)
+        matches = []
+        for name in self.names[start:]:
+            if not name.startswith(prefix):
+                break
+            matches.append(name)
+        return matches
+
+
+executable_index = ExecutableIndex()
+
+
+class CommandCompleter(Completer):
+    """Complete the first word of the input from Sage commands and executables on $PATH"""
+
+    def __init__(self, commands=(), index=executable_index):
+        self.commands = sorted(commands)
+        self.index = index
+
+    def get_completions(self, document, complete_event):
+        text = document.text_before_cursor
+        if not text or ' ' in text.lstrip():
+            return
+        prefix = text.lstrip()
+        for name in self.commands:
+            if name.startswith(prefix):
+                yield Completion(name, start_position=-len(prefix), display_meta='sage')
+        for name in self.index.complete(prefix):
+            if name not in self.commands:
+                yield Completion(name, start_position=-len(prefix))
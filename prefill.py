@@ -0,0 +1,104 @@
+# prefill.py
+
+from async_providers import get_async_provider, get_provider_loop
+from context_window import common_prefix_length
+
+
+class Prefiller:
+    """
+    Speculative prefill of Ollama's KV cache while the user is typing.
+
+    Before the prompt is shown, the messages the next question's request
+    will start with are sent to Ollama with no reply generated, unless the
+    cache already holds them, i.e. they are exactly the previous request plus
+    its reply. The request that follows then only evaluates the new question.
+    At startup the same mechanism loads the model and evaluates the system
+    prefix.
+
+    A prefill counts as used when the next request starts with its messages;
+    the prompt evaluation time it spent is then time the request saved.
+    Requests are only made for the Ollama provider and while the
+    'speculative_prefill' option is on.
+    """
+
+    MAX_TIMINGS = 1000
+
+    def __init__(self, options):
+        self.options = options
+        self.pending = None
+        self.last = None
+        self.warm = None
+        self.sent = 0
+        self.used = 0
+        self.late = 0
+        self.wasted = 0
+        self.failed = 0
+        self.saved = 0.0
+        self.saved_tokens = 0
+        # Prompt evaluation of the real requests, with and without a used prefill
+        self.eval_after_prefill = []
+        self.eval_without_prefill = []
+
+    def enabled(self):
+        return self.options.get('speculative_prefill', True) and self.options['model_provider'] == 'ollama'
+
+    def warm_up(self, messages):
+        """Load the model and evaluate the pinned prefix at startup"""
+        self._submit(messages, warm=True)
+
+    def prefill(self, messages, previous=None):
+        """
+        Prefill messages unless they were just prefilled or are the previous request plus its reply.
+
+        Args:
+            messages (List[Dict[str, Any]]): The next request's leading messages.
+            previous (List[Dict[str, Any]]): The previous request and its reply.
+        """
+        if messages == self.last or (previous is not None and messages == previous):
+            return
+        self._submit(messages)
+
+    def _submit(self, messages, warm=False):
+        if not self.enabled() or not messages:
+            return
+        if self.pending is not None:
+            # Superseded before a request could use it
+            self.wasted += 1
+        client = get_async_provider(self.options, 'ollama')
+        future = get_provider_loop().submit(client.prefill(self.options['model'], messages),
+                                            self.options.get('request_timeout'))
+        if warm:
+            future.add_done_callback(self._record_warm_up)
+        self.pending = (list(messages), future)
+        self.last = list(messages)
+        self.sent += 1
+
+    def _record_warm_up(self, future):
+        if not future.cancelled() and future.exception() is None:
+            self.warm = future.result()
+
+    def record_request(self, messages, usage):
+        """Account for the pending prefill once the request it was meant for has been made"""
+        if usage.get('provider', self.options['model_provider']) != 'ollama':
+            return
+        prefilled, self.pending = self.pending, None
+        used = False
+        if prefilled is not None:
+            prefix, future = prefilled
+            if common_prefix_length(prefix, messages) < len(prefix):
+                self.wasted += 1
+            elif not future.done():
+                # The request was sent before the prefill finished
+                self.late += 1
+            elif future.cancelled() or future.exception() is not None:
+                self.failed += 1
+            else:
+                used = True
+                result = future.result()
+                self.used += 1
+                self.saved += result.get('prompt_eval_duration') or 0.0
+                self.saved_tokens += result.get('prompt_tokens') or 0
+        if usage.get('prompt_eval_duration') is not None:
+            timings = self.eval_after_prefill if used else self.eval_without_prefill
+            timings.append(usage['prompt_eval_duration'])
+            del timings[:-self.MAX_TIMINGS]
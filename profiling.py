@@ -0,0 +1,165 @@
+# profiling.py
+
+import os
+import time
+from pathlib import Path
+from rich.console import Console
+from rich.markup import escape
+
+HOME_DIR = str(Path.home())
+SAGE_DIR = os.path.join(HOME_DIR, '.sage')
+PROFILES_DIR = os.path.join(SAGE_DIR, 'profiles')
+TRACEMALLOC_FRAMES = 1
+
+console = Console()
+
+
+def read_rss():
+    """Return the resident set size of this process in bytes, or None if unknown"""
+    try:
+        with open('/proc/self/status', 'r') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    return None
+
+
+class Profiler:
+    """
+    cProfile and tracemalloc around startup and individual turns.
+
+    Each profiled section is written to ~/.sage/profiles as a .pstats file
+    (open it with 'python3 -m pstats' or snakeviz) and a tracemalloc snapshot
+    (tracemalloc.Snapshot.load()), and its top hotspots are printed. Memory
+    is compared with the snapshot taken when profiling was switched on, so
+    allocations that keep growing over a session stand out.
+
+    cProfile only sees the thread that starts it, the main thread here. Time
+    spent waiting for the provider loop therefore shows up as the queue or
+    future wait the main thread blocked in.
+    """
+
+    def __init__(self, directory=PROFILES_DIR, top=15):
+        self.directory = directory
+        self.top = top
+        self.enabled = False
+        self.profile = None
+        self.label = None
+        self.started = None
+        self.baseline = None
+        self.baseline_rss = None
+
+    def enable(self):
+        import tracemalloc
+
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(TRACEMALLOC_FRAMES)
+        self.enabled = True
+        self.baseline = tracemalloc.take_snapshot()
+        self.baseline_rss = read_rss()
+
+    def disable(self):
+        import tracemalloc
+
+        if self.profile is not None:
+            # Switched off in the middle of a profiled section: drop it
+            self.profile.disable()
+            self.profile = None
+        self.enabled = False
+        self.baseline = None
+        tracemalloc.stop()
+
+    def start(self, label):
+        """Start profiling a section, if profiling is enabled"""
+        import cProfile
+
+        if not self.enabled or self.profile is not None:
+            return
+        self.label = label
+        self.started = time.perf_counter()
+        self.profile = cProfile.Profile()
+        self.profile.enable()
+
+    def stop(self):
+        """
+        Stop the current section, save it and print its hotspots.
+
+        Returns:
+            str: The path of the saved .pstats file, or None if nothing was profiled.
+        """
+        import pstats
+        import tracemalloc
+
+        if self.profile is None:
+            return None
+        self.profile.disable()
+        elapsed = time.perf_counter() - self.started
+        profile, self.profile = self.profile, None
+
+        name = f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{self.label}"
+        stats_path = os.path.join(self.directory, f"{name}.pstats")
+        snapshot = tracemalloc.take_snapshot() if tracemalloc.is_tracing() else None
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            profile.dump_stats(stats_path)
+            if snapshot is not None:
+                snapshot.dump(os.path.join(self.directory, f"{name}.tracemalloc"))
+        except OSError as e:
+            console.print(f"[red]Error saving profile: {e}[/red]")
+            stats_path = None
+
+        console.print(f"[bold]Profile of {self.label}:[/bold] {elapsed * 1000:.0f} ms")
+        self._print_hotspots(pstats.Stats(profile))
+        if snapshot is not None:
+            self._print_memory(snapshot)
+        if stats_path:
+            console.print(f"[dim]Saved to {stats_path}[/dim]")
+        return stats_path
+
+    def _print_hotspots(self, stats):
+        """Print the functions with the most cumulative time, with their own (self) time"""
+        entries = []
+        for (filename, line, function), (_, calls, own, cumulative, _) in stats.stats.items():
+            if function == "<method 'disable' of '_lsprof.Profiler' objects>":
+                continue
+            entries.append((cumulative, own, calls, filename, line, function))
+        entries.sort(reverse=True)
+        console.print(f"[dim]{'cumulative':>12}{'self':>10}{'calls':>9}  function[/dim]")
+        for cumulative, own, calls, filename, line, function in entries[:self.top]:
+            location = f"{short_path(filename)}:{line}({function})" if line else function
+            console.print(f"{cumulative * 1000:>9.1f} ms{own * 1000:>7.1f} ms{calls:>9}  {escape(location)}")
+
+    def _print_memory(self, snapshot):
+        """Print RSS and the allocation sites that grew most since profiling was enabled"""
+        import tracemalloc
+
+        rss = read_rss()
+        if rss is not None:
+            line = f"RSS {rss / 1024 / 1024:.1f} MB"
+            if self.baseline_rss is not None:
+                line += f" ({(rss - self.baseline_rss) / 1024 / 1024:+.1f} MB since profiling was enabled)"
+            tracing = tracemalloc.get_tracemalloc_memory()
+            console.print(f"{line}, of which tracemalloc itself uses {tracing / 1024 / 1024:.1f} MB")
+        if self.baseline is None:
+            return
+        differences = [stat for stat in snapshot.compare_to(self.baseline, 'lineno') if stat.size_diff > 0]
+        total = sum(stat.size_diff for stat in differences)
+        console.print(f"Python allocations grown since profiling was enabled: {total / 1024:.0f} KB; largest:")
+        for stat in differences[:5]:
+            frame = stat.traceback[0]
+            console.print(f"{stat.size_diff / 1024:>9.1f} KB{stat.count_diff:>+9} blocks  "
+                          f"{escape(short_path(frame.filename))}:{frame.lineno}")
+
+
+def short_path(filename):
+    """Shorten paths under site-packages or the Python library for display"""
+    for marker in ('site-packages/', 'dist-packages/'):
+        index = filename.find(marker)
+        if index >= 0:
+            return filename[index + len(marker):]
+    index = filename.find('/lib/python')
+    if index >= 0:
+        return filename[index + len('/lib/python'):].split('/', 1)[-1]
+    return os.path.basename(filename) if os.path.isabs(filename) else filename
@@ -0,0 +1,109 @@
+# providers.py
+
+import sys
+
+
+class OllamaClient:
+    """
+    Persistent HTTP client for Ollama's model list and embeddings endpoints.
+
+    Connections are pooled and kept alive across turns, and embedding requests
+    carry a ``keep_alive`` so Ollama keeps the model loaded between turns. Chat
+    requests go through async_providers. requests is imported when the first
+    client is created, usually from a startup background task, so it stays off
+    the launch path.
+    """
+
+    def __init__(self, base_url='http://localhost:11434', connect_timeout=3.05,
+                 read_timeout=300, keep_alive='30m', pool_size=4):
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        self.base_url = base_url.rstrip('/')
+        self.timeout = (connect_timeout, read_timeout)
+        self.keep_alive = keep_alive
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def url(self, path):
+        return f"{self.base_url}{path}"
+
+    def list_models(self, timeout=2):
+        """Return the names of locally installed models from /api/tags"""
+        response = self.session.get(self.url('/api/tags'), timeout=(self.timeout[0], timeout))
+        response.raise_for_status()
+        return [model['name'] for model in response.json().get('models', [])]
+
+    def embed(self, model, text):
+        """Return the embedding vector of text, using /api/embed or the older /api/embeddings"""
+        payload = {'model': model, 'input': text}
+        if self.keep_alive is not None:
+            payload['keep_alive'] = self.keep_alive
+        response = self.session.post(self.url('/api/embed'), json=payload, timeout=self.timeout)
+        if response.status_code == 404:
+            response = self.session.post(self.url('/api/embeddings'),
+                                         json={'model': model, 'prompt': text}, timeout=self.timeout)
+            response.raise_for_status()
+            return response.json()['embedding']
+        response.raise_for_status()
+        return response.json()['embeddings'][0]
+
+    def close(self):
+        self.session.close()
+
+
+_ollama_client = None
+_ollama_client_settings = None
+
+
+def get_ollama_client(options):
+    """
+    Return the shared Ollama client for the given options.
+
+    The client is created once and reused, so its connection pool survives
+    between turns. It is rebuilt only when the connection settings change.
+    """
+    global _ollama_client, _ollama_client_settings
+    settings = (
+        options.get('ollama_url', 'http://localhost:11434'),
+        options.get('ollama_connect_timeout', 3.05),
+        options.get('ollama_read_timeout', 300),
+        options.get('ollama_keep_alive', '30m')
+    )
+    if _ollama_client is None or settings != _ollama_client_settings:
+        if _ollama_client is not None:
+            _ollama_client.close()
+        _ollama_client = OllamaClient(*settings)
+        _ollama_client_settings = settings
+    return _ollama_client
+
+
+_openai_api_key = None
+
+
+def set_openai_api_key(api_key):
+    """Remember the OpenAI API key; it is applied when the openai package is first imported"""
+    global _openai_api_key
+    _openai_api_key = api_key
+    if 'openai' in sys.modules:
+        sys.modules['openai'].api_key = api_key
+
+
+def get_openai():
+    """
+    Import and return the openai module.
+
+    Importing openai costs several hundred milliseconds (it pulls in aiohttp),
+    so it is deferred until the first OpenAI request instead of happening at
+    startup.
+    """
+    import openai
+
+    if openai.api_key is None:
+        if _openai_api_key is None:
+            from config import read_api_key
+            set_openai_api_key(read_api_key())
+        openai.api_key = _openai_api_key
+    return openai
@@ -1,4 +1,5 @@
 #!/bin/bash
+python3 check_import_time.py || exit 1
 sudo dpkg -r sage
 pyinstaller --noconfirm sage.spec
 cp ./dist/sage/sage ./sage_deb_package/usr/local/bin/sage
@@ -0,0 +1,137 @@
+# response_cache.py
+
+import os
+import re
+import json
+import time
+import sqlite3
+import hashlib
+from pathlib import Path
+
+HOME_DIR = str(Path.home())
+SAGE_DIR = os.path.join(HOME_DIR, '.sage')
+RESPONSE_CACHE_FILE = os.path.join(SAGE_DIR, 'response_cache.db')
+
+
+def normalize_prompt(prompt):
+    """Lowercase, collapse whitespace and drop trailing punctuation"""
+    prompt = re.sub(r'\s+', ' ', prompt.strip().lower())
+    return prompt.rstrip(' ?.!')
+
+
+def context_hash(messages):
+    """Hash the messages an answer depends on besides the prompt itself"""
+    return hashlib.sha256(json.dumps(messages, sort_keys=True).encode()).hexdigest()
+
+
+class ResponseCache:
+    """
+    Persistent cache of model answers, stored in SQLite under ~/.sage.
+
+    Entries are keyed by model, temperature, normalized prompt and a context
+    hash. Entries older than max_age are dropped, and the least recently used
+    ones are evicted once the cache grows past max_bytes.
+    """
+
+    def __init__(self, path=RESPONSE_CACHE_FILE, max_bytes=50 * 1024 * 1024, max_age=30 * 24 * 3600):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.db = sqlite3.connect(path, timeout=5, check_same_thread=False)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute(
+            'CREATE TABLE IF NOT EXISTS responses ('
+            'key TEXT PRIMARY KEY, model TEXT, prompt TEXT, response TEXT, '
+            'created REAL, last_used REAL, hits INTEGER DEFAULT 0, size INTEGER)'
+        )
+        self.db.execute('CREATE INDEX IF NOT EXISTS responses_last_used ON responses (last_used)')
+        self.db.commit()
+
+    @staticmethod
+    def make_key(model, temperature, prompt, context):
+        raw = json.dumps([model, float(temperature), normalize_prompt(prompt), context_hash(context)])
+        return hashlib.sha256(raw.encode()).hexdigest()
+
+    def get(self, key):
+        now = time.time()
+        row = self.db.execute(
+            'SELECT response FROM responses WHERE key = ? AND created >= ?',
+            (key, now - self.max_age)
+        ).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.db.execute('UPDATE responses SET last_used = ?, hits = hits + 1 WHERE key = ?', (now, key))
+        self.db.commit()
+        self.hits += 1
+        return row[0]
+
+    def put(self, key, model, prompt, response):
+        now = time.time()
+        self.db.execute(
+            'INSERT OR REPLACE INTO responses (key, model, prompt, response, created, last_used, hits, size) '
+            'VALUES (?, ?, ?, ?, ?, ?, 0, ?)',
+            (key, model, prompt, response, now, now, len(prompt.encode()) + len(response.encode()))
+        )
+        self.evict(now)
+        self.db.commit()
+
+    def evict(self, now=None):
+        """Drop expired entries, then least recently used ones until under max_bytes"""
+        now = now or time.time()
+        self.db.execute('DELETE FROM responses WHERE created < ?', (now - self.max_age,))
+        total = self.db.execute('SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for key, size in self.db.execute('SELECT key, size FROM responses ORDER BY last_used').fetchall():
+            self.db.execute('DELETE FROM responses WHERE key = ?', (key,))
+            total -= size
+            if total <= self.max_bytes:
+                break
+
+    def stats(self):
+        entries, total = self.db.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses').fetchone()
+        return {
+            'entries': entries,
+            'bytes': total,
+            'session_hits': self.hits,
+            'session_misses': self.misses,
+            'path': self.path
+        }
+
+    def clear(self):
+        self.db.execute('DELETE FROM responses')
+        self.db.commit()
+        self.db.execute('VACUUM')
+
+
+_response_cache = None
+
+
+def get_response_cache(options):
+    """Return the shared response cache, created on first use"""
+    global _response_cache
+    if _response_cache is None:
+        _response_cache = ResponseCache(
+            max_bytes=int(options.get('response_cache_max_mb', 50) * 1024 * 1024),
+            max_age=options.get('response_cache_max_age_days', 30) * 24 * 3600
+        )
+    return _response_cache
+
+
+def cache_enabled(options):
+    """
+    Return whether answers should be served from and stored in the cache.
+
+    'auto' (the default) only caches deterministic requests, i.e. temperature 0;
+    'always' caches regardless of temperature and 'off' disables the cache.
+    """
+    mode = options.get('response_cache', 'auto')
+    if mode == 'always':
+        return True
+    if mode == 'auto':
+        return float(options.get('temperature', 0)) == 0
+    return False
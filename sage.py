@@ -1,42 +1,89 @@
 import os
 import sys
-import openai
-import platform
-import socket
-import getpass
-import psutil
 import subprocess
 import shlex
-from commands import show_help, exit_program, options_menu, manage_api_key, clear_conversation
+from commands import show_help, exit_program, options_menu, manage_api_key, clear_conversation, show_packages, manage_response_cache, search_history, summarize_session, show_stats, manage_profiling, manage_prefill, manage_shell
 from pathlib import Path
-from config import load_options, load_available_models, save_options, read_api_key
-from conversation import load_conversation, save_conversation, clear_conversation
-from capture_tool import start_capture
+from config import load_options, load_available_models, save_options
+from conversation import load_previous_session, save_conversation, clear_conversation, save_summary, current_session_id
 from rich.console import Console
-from rich.markdown import Markdown
 from rich.rule import Rule
 from prompt_toolkit import PromptSession
 from prompt_toolkit.styles import Style
-from prompt_toolkit.shortcuts import radiolist_dialog
-from prompt_toolkit.formatted_text import HTML
-from utils import ensure_sage_setup, load_key, encrypt_api_key, decrypt_api_key, encode_image
-from rich.panel import Panel
-from rich.syntax import Syntax
-import textwrap
-import tempfile
+from utils import ensure_sage_setup, load_key, encrypt_api_key, decrypt_api_key, encode_image_bytes
 from prompt_toolkit.history import InMemoryHistory
 from prompt_toolkit.auto_suggest import AutoSuggestFromHistory
-from prompt_toolkit.key_binding import KeyBindings
+from prompt_toolkit.patch_stdout import patch_stdout
 import re
-import requests
+import time
+import threading
+from concurrent.futures import CancelledError
+from streaming import render_stream
+from providers import get_openai
+from async_providers import ProviderError, chat, get_provider_loop, stream_chat
+from hedging import hedged_chat, hedged_stream_chat
+from background import BackgroundTasks, task_cancelled
+from context_window import build_context_window, count_tokens, fold_messages, split_pinned, PrefixStats
+from metrics import SessionMetrics, TurnTimer
+from prefill import Prefiller
+from profiling import Profiler
+from shell_pool import ShellError, get_shell_pool, truncate_output
+from summarizer import RollingSummarizer, build_summary_prompt
+from system_info import system_info_digest, relevant_packages
+from path_index import executable_index, CommandCompleter
+from response_cache import ResponseCache, get_response_cache, cache_enabled, normalize_prompt, context_hash
+
+# Heavy optional dependencies are imported where they are first needed:
+# PyQt5 in capture_and_process(), openai and aiohttp with the first request,
+# numpy through the semantic cache and rich.markdown when a reply is rendered.
 
 console = Console()
 
+# Appended to a reply that was cut short with Ctrl-C, so the model (and the
+# user, in later sessions) can tell the answer is incomplete
+TRUNCATED_MARKER = "\n\n[Response interrupted by the user]"
+SUMMARY_ERROR = "Unable to generate summary due to an error."
+
+# Shell builtins accepted as commands; their effect carries over to the next
+# command run in the shell pool
+STATE_BUILTINS = {'cd', 'pushd', 'popd', 'export', 'unset'}
+
+# Words that are also commands but mostly start a question or request. When
+# the rest of the line is plain words including a function word, as in
+# "which ports are open" or "find my largest files", it is treated as prose.
+QUESTION_LEADS = {'which', 'who', 'what', 'whatis', 'find', 'locate', 'time', 'help', 'watch',
+                  'look', 'see', 'tell', 'show', 'list', 'check', 'top', 'free', 'last'}
+FUNCTION_WORDS = {'the', 'a', 'an', 'my', 'me', 'is', 'are', 'was', 'were', 'be', 'of', 'to', 'for', 'on',
+                  'in', 'at', 'with', 'from', 'about', 'that', 'this', 'these', 'those', 'it', 'its', 'your',
+                  'our', 'there', 'any', 'some', 'most', 'which', 'what', 'why', 'how', 'where', 'when',
+                  'who', 'do', 'does', 'did', 'can', 'could', 'should', 'would', 'using', 'taking', 'running'}
+PLAIN_WORD = re.compile(r"[A-Za-z]+")
+
+# The argument forms of Sage's commands that take arguments. Other input that
+# starts with one of these names, e.g. 'history | tail', is not intercepted
+COMMAND_ARGUMENTS = {
+    'packages': re.compile(r'[\w.+:@-]+'),
+    'cache': re.compile(r'stats|clear'),
+    'history': re.compile(r'search\s+[^|;&<>`$()]+'),
+    'stats': re.compile(r'all'),
+    'profile': re.compile(r'on|off'),
+    'prefill': re.compile(r'on|off'),
+    'shell': re.compile(r'restart'),
+}
+
+# Serializes rendering between the main loop and background startup tasks
+output_lock = threading.RLock()
+
 HOME_DIR = str(Path.home())
 SAGE_DIR = os.path.join(HOME_DIR, '.sage')
 SECRET_KEY_FILE = os.path.join(SAGE_DIR, 'secret.key')
 API_ENC_FILE = os.path.join(SAGE_DIR, 'api.enc')
 API_KEY_HELP_FILE = '/usr/share/sage/Get_API_Key.txt'
+# The system prompt bundled next to this file (or in the PyInstaller bundle)
+BUNDLED_SYSTEM_PROMPT_FILE = os.path.join(
+    getattr(sys, '_MEIPASS', os.path.dirname(os.path.abspath(__file__))), 'system_prompt.txt'
+)
+DEFAULT_SYSTEM_PROMPT = "You are Sage, an assistant for Linux system administration."
 
 def read_api_key():
     if ensure_sage_setup():
@@ -75,7 +122,15 @@ def read_api_key():
             print("Exiting without setting API key.")
             sys.exit(1)
 
-def load_system_prompt():
+def default_system_prompt():
+    """Return the system prompt shipped with Sage, or a one-line fallback"""
+    try:
+        with open(BUNDLED_SYSTEM_PROMPT_FILE, 'r') as f:
+            return f.read().strip()
+    except OSError:
+        return DEFAULT_SYSTEM_PROMPT
+
+def load_system_prompt(interactive=True):
     system_prompt_file = '/usr/share/sage/system_prompt.txt'
     if os.path.exists(system_prompt_file):
         try:
@@ -85,6 +140,9 @@ def load_system_prompt():
         except Exception as e:
             print(f"Error loading system prompt: {e}")
             return None
+    elif not interactive:
+        # Nobody to ask, e.g. in batch mode
+        return default_system_prompt()
     else:
         system_prompt = input("System prompt not found. Please enter a system prompt:\n")
         try:
@@ -96,50 +154,28 @@ def load_system_prompt():
 
 def gather_system_info():
     try:
-        user_name = getpass.getuser()
-        host_name = socket.gethostname()
-        os_details = platform.platform()
-        os_version = platform.version()
-        processor = platform.processor()
-        cpu_count = os.cpu_count()
-        total_memory = psutil.virtual_memory().total // (1024 ** 2)
-        uptime = subprocess.check_output(['uptime', '-p']).decode().strip()
-        ip_address = socket.gethostbyname(host_name)
-
-        try:
-            installed_packages = subprocess.check_output(['dpkg', '--get-selections']).decode().strip()
-        except Exception:
-            installed_packages = "Could not retrieve installed packages."
-
-        shell = os.environ.get('SHELL', 'Unknown')
-        terminal = os.environ.get('TERM', 'Unknown')
-
-        system_info = (
-            f"User: {user_name}\n"
-            f"Host: {host_name}\n"
-            f"OS: {os_details} (Version: {os_version})\n"
-            f"Processor: {processor}\n"
-            f"CPU Count: {cpu_count}\n"
-            f"Total Memory: {total_memory} MB\n"
-            f"Uptime: {uptime}\n"
-            f"IP Address: {ip_address}\n"
-            f"Installed Packages: {installed_packages}\n"
-            f"Shell: {shell}\n"
-            f"Terminal: {terminal}"
-        )
-        return system_info
+        return system_info_digest()
     except Exception as e:
         print(f"Error gathering system info: {e}")
         return "Failed to gather system information."
 
 def capture_and_process(conversation, options):
-    captured_image_path = start_capture()
-    if os.path.exists(captured_image_path):
+    from capture_tool import start_capture
+
+    capture = start_capture(
+        max_dimension=options.get('capture_max_dimension', 1568),
+        image_format=options.get('capture_format', 'jpeg'),
+        quality=options.get('capture_quality', 85)
+    )
+    if capture:
+        image_data, mime_type, (width, height) = capture
         console.print("[green]Image captured.[/green]")
-        prompt = input("Enter your question about the captured image: ")
         
         # Encode the image
-        base64_image = encode_image(captured_image_path)
+        base64_image = encode_image_bytes(image_data)
+        console.print(f"[dim]{width}x{height} {mime_type}, {len(image_data) / 1024:.0f} KB "
+                      f"({len(base64_image) / 1024:.0f} KB base64 upload)[/dim]")
+        prompt = input("Enter your question about the captured image: ")
         
         # Prepare the messages for the API
         messages = [
@@ -153,7 +189,7 @@ def capture_and_process(conversation, options):
                     {
                         "type": "image_url",
                         "image_url": {
-                            "url": f"data:image/png;base64,{base64_image}"
+                            "url": f"data:{mime_type};base64,{base64_image}"
                         }
                     }
                 ]
@@ -161,48 +197,55 @@ def capture_and_process(conversation, options):
         ]
         
         # Process with AI
-        try:
-            response = openai.ChatCompletion.create(
-                model=options['model'],
-                messages=messages,
-                max_tokens=options['max_tokens']
-            )
-            assistant_message = response['choices'][0]['message']['content']
-            
-            # Convert markdown to Rich Markdown and display
-            markdown = Markdown(assistant_message)
-            console.print(Rule())
-            console.print("[bold yellow]Assistant:[/bold yellow]")
-            console.print(markdown)
-
+        assistant_message = request_completion(messages, options, provider='openai',
+                                               heading="[bold yellow]Assistant:[/bold yellow]")
+        if assistant_message is not None:
             conversation.append({'role': 'user', 'content': f"[Image analysis request] {prompt}"})
             conversation.append({'role': 'assistant', 'content': assistant_message})
-        except openai.error.OpenAIError as e:
-            console.print(f"[red]An error occurred: {e}[/red]")
     else:
         print("Image capture failed or was cancelled.")
 
-def summarize_conversation(conversation, options):
-    summary_prompt = """Please summarize the following conversation..."""
+def summarize_conversation(conversation, options, previous_summary=None):
+    summary_prompt = build_summary_prompt(conversation, previous_summary)
     
     try:
-        if options['model_provider'] == 'ollama':
-            summary_response = execute_ollama_request([{
-                'role': 'user',
-                'content': summary_prompt
-            }], options)
-            return summary_response
-        else:
-            summary_response = openai.ChatCompletion.create(
-                model=options['model'],
-                messages=[{'role': 'user', 'content': summary_prompt}],
-                temperature=0.2,
-                max_tokens=500
-            )
-            return summary_response['choices'][0]['message']['content']
+        return request_completion([{'role': 'user', 'content': summary_prompt}], options,
+                                  temperature=0.2, max_tokens=500,
+                                  heading="[bold cyan]Previous Conversation Summary:[/bold cyan]")
     except Exception as e:
         console.print(f"[red]An error occurred while summarizing the conversation: {e}[/red]")
-        return "Unable to generate summary due to an error."
+        return SUMMARY_ERROR
+
+def summarize_previous_session(session_id, messages, summarized_count, options, previous_summary=None):
+    """
+    Summarize the previous session's turns after its stored summary, and store the result.
+
+    The new summary covers all of the session's messages, so the next launch
+    can show it without another model call.
+    """
+    summary = summarize_conversation(messages[summarized_count:], options, previous_summary)
+    if summary and summary != SUMMARY_ERROR:
+        save_summary(session_id, summary, len(messages))
+    return summary
+
+def show_stored_summary(summary, unsummarized):
+    """
+    Show the previous conversation's stored summary without a model call.
+
+    Turns after the last rolling summary are added as a short note listing the
+    user's questions.
+    """
+    from rich.markdown import Markdown
+
+    note = fold_messages(unsummarized)
+    if note:
+        summary = f"{summary}\n\n{note['content']}" if summary else note['content']
+    if summary:
+        with output_lock:
+            console.print(Rule())
+            console.print("[bold cyan]Previous Conversation Summary:[/bold cyan]")
+            console.print(Markdown(summary))
+    return summary
 
 def extract_bash_commands(text):
     """
@@ -226,6 +269,53 @@ def extract_bash_commands(text):
     return commands
 
 def execute_bash_command(command, options):
+    """
+    Runs a bash command in the persistent shell pool, with its output shown as
+    it arrives, or in a new terminal window when 'command_runner' is 'terminal'.
+    
+    Args:
+        command (str): The bash command to execute.
+        options (Dict[str, Any]): Configuration options.
+        
+    Returns:
+        str: The note that records the command and its outcome in the conversation.
+    """
+    if options.get('command_runner', 'pool') == 'terminal':
+        open_in_terminal(command, options)
+        return f"Command executed: {command}"
+
+    timeout = options.get('command_timeout') or None
+    try:
+        with output_lock:
+            result = get_shell_pool(options).run(command, timeout)
+    except (ShellError, OSError) as e:
+        console.print(f"[red]Failed to execute command '{command}': {e}[/red]")
+        return f"Command executed: {command}\nIt could not be started: {e}"
+
+    if result.exit_code is not None:
+        status = f"exit code {result.exit_code}"
+    elif result.timed_out or result.interrupted:
+        status = "killed"
+    else:
+        status = "the command ended its shell"
+    if result.timed_out:
+        console.print(f"[yellow]Stopped after {timeout:g} s (see 'command_timeout' in the config file).[/yellow]")
+        status += f", timed out after {timeout:g} s"
+    elif result.interrupted:
+        console.print("[yellow]Interrupted.[/yellow]")
+        status += ", interrupted by the user"
+    elif result.exit_code:
+        console.print(f"[dim]Exit code {result.exit_code}[/dim]")
+    if result.exit_code is None:
+        console.print("[dim]The shell was closed; the next command starts a new one.[/dim]")
+
+    output = truncate_output(result.output.strip('\n'), options.get('command_output_chars', 4000))
+    note = f"Command executed: {command}\nResult: {status}"
+    if output:
+        note += f"\nOutput:\n```\n{output}\n```"
+    return note
+
+def open_in_terminal(command, options):
     """
     Executes a bash command in a new terminal window.
     The terminal will close automatically after the command completes.
@@ -258,35 +348,43 @@ def execute_bash_command(command, options):
     except Exception as e:
         console.print(f"[red]Failed to execute command '{command}' in terminal '{terminal}': {e}[/red]")
 
-def handle_bash_commands(bash_commands, conversation, options, history):
+def parse_command_arguments(user_input):
     """
-    Handles the execution of bash commands by adding them to history and executing them.
+    Match input against the argument forms in COMMAND_ARGUMENTS.
     
     Args:
-        bash_commands (List[str]): List of bash commands to execute.
-        conversation (List[Dict[str, str]]): The conversation history.
-        options (Dict[str, Any]): Configuration options.
-        history: The command history object.
+        user_input (str): The input, stripped.
+        
+    Returns:
+        Tuple[str, str]: The command name and its arguments, or (None, None)
+        if the input is not one of Sage's commands with arguments.
     """
-    if not bash_commands:
-        return
-
-    # Add commands to history
-    for cmd in bash_commands:
-        history.append_string(cmd)
-
-    # Execute the commands
-    for command in bash_commands:
-        try:
-            subprocess.Popen(cmd)
-            console.print(f"[bold green]Executing command: [/] {command}")
-            conversation.append({'role': 'system', 'content': f"Command executed: {command}"})
-        except Exception as e:
-            console.print(f"[red]Failed to execute command '{command}': {e}[/red]")
+    name, _, args = user_input.partition(' ')
+    form = COMMAND_ARGUMENTS.get(name.lower())
+    args = args.strip()
+    if form is None or not form.fullmatch(args):
+        return None, None
+    return name.lower(), args
+
+def looks_like_prose(command):
+    """Return whether a line that starts with a command name reads as an English question or request"""
+    words = command.split()
+    if len(words) < 3 or words[0].lower() not in QUESTION_LEADS:
+        return False
+    rest = words[1:]
+    return all(PLAIN_WORD.fullmatch(word) for word in rest) and any(word.lower() in FUNCTION_WORDS for word in rest)
 
 def is_valid_bash_command(command):
     """
-    Check if a command is a valid bash command by using 'which'.
+    Check if a command is a valid bash command using the in-memory $PATH index.
+    
+    Builtins that change the shell's state count too, since commands share a
+    persistent shell (see shell_pool.py).
+
+    Input ending in a question mark, that the shell could not parse (e.g. an
+    unbalanced apostrophe in "what's"), or that looks_like_prose() is treated as
+    a question even when its first word names a real binary, as in "which
+    ports are open" or "find my largest files".
     
     Args:
         command (str): The command to check.
@@ -294,31 +392,140 @@ def is_valid_bash_command(command):
     Returns:
         bool: True if the command exists, False otherwise.
     """
+    if command.rstrip().endswith('?') or looks_like_prose(command):
+        return False
     try:
         # Split the command to get just the executable part
         cmd_executable = shlex.split(command)[0]
-        # Use 'which' to check if command exists in PATH
-        result = subprocess.run(['which', cmd_executable], 
-                              capture_output=True, 
-                              text=True)
-        return result.returncode == 0
-    except (subprocess.SubprocessError, FileNotFoundError, IndexError):
+    except (ValueError, IndexError):
         return False
+    return cmd_executable in executable_index or cmd_executable in STATE_BUILTINS
+
+def execute_ollama_request(conversation, options, usage=None):
+    """
+    Execute request to Ollama API.
+
+    System messages are sent as they are, so the system prompt and system info
+    form a stable prefix that Ollama can keep evaluated between turns.
+    max_tokens is sent as Ollama's num_predict.
+    """
+    return chat(conversation, options, options['temperature'], options['max_tokens'],
+                provider='ollama', usage=usage)
+
+def stream_ollama_request(conversation, options, usage=None):
+    """Yield response chunks from the Ollama API as they are generated"""
+    return stream_chat(conversation, options, options['temperature'], options['max_tokens'],
+                       provider='ollama', usage=usage)
+
+def stream_openai_request(messages, options, temperature=None, max_tokens=None):
+    """Yield response chunks from the OpenAI chat completion API as they are generated"""
+    return stream_chat(
+        messages, options,
+        temperature=options['temperature'] if temperature is None else temperature,
+        max_tokens=options['max_tokens'] if max_tokens is None else max_tokens,
+        provider='openai'
+    )
+
+def hedge_note(usage, primary):
+    """Return 'Answered by <provider> (<model>, ...)' if a hedged request was won by the secondary provider"""
+    if usage.get('provider', primary) == primary:
+        return None
+    reason = f"{primary} unavailable" if usage.get('fallback') else f"{primary} was slow"
+    return f"Answered by {usage['provider']} ({usage.get('model')}, {reason})"
+
+def request_completion(messages, options, temperature=None, max_tokens=None, heading=None, provider=None,
+                       usage=None):
+    """
+    Send messages to the configured provider and render the reply.
+
+    With the 'stream' option enabled, tokens are rendered as they arrive and the
+    time to first token is reported; otherwise the full reply is rendered once.
+    The request runs on the shared provider loop, so it can overlap with the
+    startup and summary requests, and is cancelled after 'request_timeout'
+    seconds if that option is set. Ctrl-C cancels it; a streamed reply keeps
+    the text received so far, ending with TRUNCATED_MARKER.
+
+    Args:
+        messages (List[Dict[str, Any]]): Messages to send.
+        options (Dict[str, Any]): Configuration options.
+        temperature (float): Overrides the configured temperature (OpenAI only).
+        max_tokens (int): Overrides the configured max tokens (OpenAI only).
+        heading (str): Rich markup printed above the reply.
+        provider (str): Overrides options['model_provider'].
+        usage (Dict[str, Any]): Filled in with the token counts and timings
+            the provider reports, if any, and the measured 'ttft' (streaming
+            only), 'elapsed' and 'render' times in seconds.
+
+    Returns:
+        str: The assistant message, or None if the request failed or was
+        interrupted before any text arrived.
+    """
+    from rich.markdown import Markdown
+
+    # Hedging applies to requests that follow the configured provider
+    hedge = provider is None and options.get('hedge', False)
+    provider = provider or options['model_provider']
+    usage = {} if usage is None else usage
+
+    def print_heading():
+        console.print(Rule())
+        if heading:
+            console.print(heading)
 
-def execute_ollama_request(conversation, options):
-    """Execute request to Ollama API"""
-    messages = [msg for msg in conversation if msg['role'] != 'system']
-    
     try:
-        response = requests.post('http://localhost:11434/api/chat', json={
-            'model': options['model'],
-            'messages': messages,
-            'stream': False
-        })
-        response.raise_for_status()
-        return response.json()['message']['content']
-    except requests.exceptions.RequestException as e:
-        console.print(f"[red]Error communicating with Ollama: {e}[/red]")
+        if options.get('stream', True):
+            if hedge:
+                chunks = hedged_stream_chat(messages, options, temperature, max_tokens, usage)
+            elif provider == 'ollama':
+                chunks = stream_ollama_request(messages, options, usage)
+            else:
+                chunks = stream_openai_request(messages, options, temperature, max_tokens)
+            with output_lock:
+                if task_cancelled():
+                    chunks.close()
+                    return None
+                print_heading()
+                assistant_message, stats = render_stream(chunks, console)
+                usage.update((key, stats[key]) for key in ('ttft', 'elapsed', 'render', 'chunks'))
+                if stats['interrupted']:
+                    console.print("[yellow]Interrupted.[/yellow]")
+                    return assistant_message + TRUNCATED_MARKER if assistant_message else None
+                note = hedge_note(usage, provider)
+                if stats['ttft'] is not None:
+                    timing = f"First token: {stats['ttft']:.2f}s | Total: {stats['elapsed']:.2f}s"
+                    console.print(f"[dim]{timing} | {note}[/dim]" if note else f"[dim]{timing}[/dim]")
+            return assistant_message
+
+        start = time.perf_counter()
+        if hedge:
+            assistant_message = hedged_chat(messages, options, temperature, max_tokens, usage)
+        elif provider == 'ollama':
+            assistant_message = execute_ollama_request(messages, options, usage)
+        else:
+            assistant_message = chat(
+                messages, options,
+                temperature=options['temperature'] if temperature is None else temperature,
+                max_tokens=options['max_tokens'] if max_tokens is None else max_tokens,
+                provider='openai',
+                usage=usage
+            )
+        received = time.perf_counter()
+        with output_lock:
+            if task_cancelled():
+                # A background request that was called off while the reply arrived
+                return None
+            print_heading()
+            console.print(Markdown(assistant_message))
+            note = hedge_note(usage, provider)
+            if note:
+                console.print(f"[dim]{note}[/dim]")
+        usage.update(elapsed=time.perf_counter() - start, render=time.perf_counter() - received)
+        return assistant_message
+    except ProviderError as e:
+        console.print(f"[red]{e}[/red]")
+        return None
+    except KeyboardInterrupt:
+        console.print("\n[yellow]Request cancelled.[/yellow]")
         return None
 
 def create_greeting(conversation, system_info, summary=None):
@@ -360,75 +567,191 @@ def create_greeting(conversation, system_info, summary=None):
     
     return greeting_query
 
-def main():
-    ensure_sage_setup()
-    openai.api_key = read_api_key()
-    options = load_options()
-    
-    # Load components in order
-    system_prompt = load_system_prompt()
-    system_info = gather_system_info()
-    previous_conversation = load_conversation()
+def startup_greeting(conversation, system_info, options, summary_future=None):
+    """Create and render the greeting once the previous conversation summary is known"""
+    summary = summary_future.result() if summary_future else None
+    if task_cancelled():
+        return None
+    if summary:
+        conversation = conversation + [{'role': 'system', 'content': f"Previous conversation summary: {summary}"}]
 
-    # Initialize summary as None or an empty string
-    summary = None
-    
-    # Initialize new conversation with system context
-    conversation = [
-        {'role': 'system', 'content': system_prompt},
-        {'role': 'system', 'content': system_info}
-    ]    
-    
-    # If there's a previous conversation, summarize it
-    if previous_conversation and len(previous_conversation) > 2:
-        summary = summarize_conversation(previous_conversation, options)
-        if summary:
-            conversation.append({'role': 'system', 'content': f"Previous conversation summary: {summary}"})
-            console.print(Panel(Markdown(summary), title="Previous Conversation Summary", border_style="cyan"))    
-            
     # Create greeting that includes system info
     greeting_query = create_greeting(conversation, system_info, summary)
 
     try:
-        if options['model_provider'] == 'ollama':
-            greeting_message = execute_ollama_request([{
-                'role': 'user',
-                'content': greeting_query
-            }], options)
-        else:
-            greeting_response = openai.ChatCompletion.create(
-                model=options['model'],
-                messages=conversation + [{'role': 'user', 'content': greeting_query}],
-                temperature=0.7,
-                max_tokens=options['max_tokens']
-            )
-            greeting_message = greeting_response['choices'][0]['message']['content']
-        
-        console.print(Rule())
-        console.print(Markdown(greeting_message))
-        conversation.append({'role': 'assistant', 'content': greeting_message})
+        # Sending the conversation's system messages first also has Ollama
+        # evaluate the prompt prefix every later turn starts with
+        greeting_messages = conversation + [{'role': 'user', 'content': greeting_query}]
+        return request_completion(greeting_messages, options, temperature=0.7)
+    except CancelledError:
+        # The user asked something first
+        return None
     except Exception as e:
         console.print(f"[red]An error occurred during initial greeting: {e}[/red]")
+        return None
 
-    # Load the available models
-    models = load_available_models()
+def validate_model(options, models):
+    """Fall back to a default model if the configured one is not available"""
     if options['model_provider'] == 'ollama':
         available_models = models.get('ollama', [])
     else:
         available_models = models.get('openai', [])
 
     if options['model'] not in available_models:
-        console.print(f"[yellow]Warning: Current model '{options['model']}' is not in the list of available models.[/yellow]")
-        # Set default model based on provider
-        if options['model_provider'] == 'ollama':
-            default_model = available_models[0] if available_models else 'llama2'
-            console.print(f"[yellow]Using default model '{default_model}'[/yellow]")
-            options['model'] = default_model
-        else:
-            default_model = available_models[0] if available_models else 'gpt-4o-mini'
+        with output_lock:
+            console.print(f"[yellow]Warning: Current model '{options['model']}' is not in the list of available models.[/yellow]")
+            # Set default model based on provider
+            if options['model_provider'] == 'ollama':
+                default_model = available_models[0] if available_models else 'llama2'
+            else:
+                default_model = available_models[0] if available_models else 'gpt-4o-mini'
             console.print(f"[yellow]Using default model '{default_model}'[/yellow]")
             options['model'] = default_model
-        save_options(options)
+            save_options(options)
+
+def collect_startup_results(tasks, conversation, options, wait=False):
+    """
+    Fold finished startup tasks into the conversation.
+
+    Args:
+        tasks (BackgroundTasks): The startup tasks.
+        conversation (List[Dict[str, str]]): The conversation history.
+        options (Dict[str, Any]): Configuration options.
+        wait (bool): Block on the summary and model list, which the next model
+            request depends on. A greeting that is still running is detached so
+            it cannot land in the history after the user's first question.
+    """
+    if tasks.pending('summary') and (wait or tasks.done('summary')):
+        summary = tasks.pop('summary')
+        if summary:
+            # Keep it in the pinned prefix even if a command was run before the first question
+            pinned, _ = split_pinned(conversation)
+            conversation.insert(len(pinned), {'role': 'system', 'content': f"Previous conversation summary: {summary}"})
+
+    if tasks.pending('greeting') and not tasks.pending('summary'):
+        if tasks.done('greeting') or (wait and not options.get('background_startup', True)):
+            greeting_message = tasks.pop('greeting')
+            if greeting_message is not None:
+                conversation.append({'role': 'assistant', 'content': greeting_message})
+        elif wait:
+            tasks.cancel('greeting')
+
+    if tasks.pending('models') and (wait or tasks.done('models')):
+        validate_model(options, tasks.pop('models', {}))
+
+def build_request_messages(conversation, user_input, options, summarizer=None):
+    """
+    Trim the conversation to the context window and add notes relevant to this question.
+
+    Notes that only apply to this question go after it, at the very end, so
+    they never break the prefix shared with the next request.
+    """
+    messages, window_stats = build_context_window(conversation, options, fold=summarizer or fold_messages)
+    mentioned_packages = relevant_packages(user_input)
+    if mentioned_packages:
+        package_list = ', '.join(f"{name} {version}" for name, version in mentioned_packages)
+        messages.append({'role': 'system', 'content': f"Installed packages mentioned in the question: {package_list}"})
+    if window_stats['dropped']:
+        console.print(
+            f"[dim]Context trimmed: {window_stats['messages_before']} messages / "
+            f"~{window_stats['tokens_before']} tokens -> {window_stats['messages_after']} messages / "
+            f"~{window_stats['tokens_after']} tokens[/dim]"
+        )
+    return messages
+
+def next_request_prefix(conversation, options, summarizer=None):
+    """Return the messages the next question's request will start with, for prefilling"""
+    placeholder = {'role': 'user', 'content': ''}
+    messages, _ = build_context_window(conversation + [placeholder], options, fold=summarizer or fold_messages)
+    return messages[:-1]
+
+def cache_context(conversation):
+    """
+    Return the context a cached answer depends on: the system prompt and the
+    previous question, so follow-ups like "and how do I stop it?" are keyed by
+    what they follow.
+    """
+    system_prompt = conversation[0]['content'] if conversation else None
+    previous_prompts = [msg['content'] for msg in conversation[:-1] if msg['role'] == 'user']
+    previous_prompt = normalize_prompt(previous_prompts[-1]) if previous_prompts else None
+    return [system_prompt, previous_prompt]
+
+def main(profile=False):
+    """
+    Run the interactive session.
+
+    Args:
+        profile (bool): Profile startup and every turn (see profiling.Profiler).
+    """
+    startup_timer = TurnTimer(kind='startup')
+    profiler = Profiler()
+    if profile:
+        profiler.enable()
+        profiler.start('startup')
+    ensure_sage_setup()
+    options = load_options()
+    profiler.top = options.get('profile_top', 15)
+    if options['model_provider'] == 'openai' or options.get('hedge', False):
+        # Ask for a missing API key at launch rather than in the middle of a turn
+        get_openai()
+    startup_timer.lap('load_options')
+    
+    # Load components in order
+    system_prompt = load_system_prompt()
+    startup_timer.lap('system_prompt')
+    system_info = gather_system_info()
+    startup_timer.lap('gather_system_info')
+    previous_messages, previous_summary, summarized_count, previous_session_id = load_previous_session()
+    startup_timer.lap('load_session')
+
+    # Initialize new conversation with system context
+    conversation = [
+        {'role': 'system', 'content': system_prompt},
+        {'role': 'system', 'content': system_info}
+    ]    
+
+    # Have Ollama load the model and evaluate the system prefix right away
+    prefiller = Prefiller(options)
+    prefiller.warm_up(conversation)
+
+    # Summary, greeting and model list run as background tasks. In background
+    # mode the prompt is shown straight away and their output is printed above
+    # it; otherwise startup waits for them as before.
+    background = options.get('background_startup', True)
+    startup_options = dict(options, stream=False) if background else options
+    # Cancelling a task (the greeting, once the user asks something) also
+    # cancels its model request, which would otherwise hold up the question
+    tasks = BackgroundTasks(on_cancel=get_provider_loop().cancel_thread)
+
+    # Reuse the previous conversation's stored summary. Only call the model when
+    # the turns it does not cover exceed the summary token threshold.
+    summary_future = None
+    # summarized_count indexes the stored messages, which are the session's
+    # history after the pinned prefix, the list the summarizer counted in
+    summarized_count = min(summarized_count, len(previous_messages))
+    unsummarized = previous_messages[summarized_count:]
+    if count_tokens(unsummarized, options['model_provider']) >= options.get('summary_threshold_tokens', 1500):
+        summary_future = tasks.submit('summary', summarize_previous_session, previous_session_id, previous_messages,
+                                      summarized_count, startup_options, previous_summary)
+    elif previous_summary or unsummarized:
+        summary_future = tasks.submit('summary', show_stored_summary, previous_summary, unsummarized)
+
+    tasks.submit('greeting', startup_greeting, conversation[:], system_info, startup_options, summary_future)
+    tasks.submit('models', load_available_models, options)
+
+    startup_timer.lap('start_tasks')
+
+    if not background:
+        collect_startup_results(tasks, conversation, options, wait=True)
+        startup_timer.lap('startup_tasks')
+
+    # Fold turns that leave the context window into a running summary, stored
+    # with the session so the next launch can load it without a model call
+    summarizer = RollingSummarizer(
+        options, on_summary=lambda summary, count: save_summary(current_session_id(), summary, count)
+    )
+    prefix_stats = PrefixStats()
+    metrics = SessionMetrics(enabled=options.get('metrics_log', True))
 
     COMMANDS = {
         'help': show_help,
@@ -436,7 +759,15 @@ def main():
         'api': manage_api_key,
         'capture': lambda: capture_and_process(conversation, options),
         'clear': lambda: clear_conversation(),
-        'exit': lambda: exit_program(conversation)
+        'packages': lambda pattern='': show_packages(pattern, conversation),
+        'cache': lambda action='': manage_response_cache(action, options, prefix_stats),
+        'history': lambda args='': search_history(args),
+        'stats': lambda scope='': show_stats(metrics, scope, prefiller),
+        'prefill': lambda action='': manage_prefill(action, prefiller),
+        'profile': lambda action='': manage_profiling(action, profiler),
+        'shell': lambda action='': manage_shell(action, options),
+        'summarize': lambda: summarize_session(conversation, options, summarizer),
+        'exit': lambda: exit_program(conversation, options, summarizer)
     }
 
     console.print("\n(type 'exit' to quit or 'help' to show commands)")
@@ -448,33 +779,66 @@ def main():
     session = PromptSession(
         history=history,
         enable_history_search=True,
-        auto_suggest=AutoSuggestFromHistory()
+        auto_suggest=AutoSuggestFromHistory(),
+        completer=CommandCompleter(COMMANDS),
+        complete_while_typing=False
     )
 
     style = Style.from_dict({
         'prompt': 'bold cyan',
     })
+    startup_timer.lap('setup')
+    metrics.record(startup_timer, session=current_session_id())
+    profiler.stop()
 
     while True:
+        # Timing spans of this turn, from Enter to the next prompt
+        timer = None
         try:
-            # Prompt for user input with history support
+            # Prompt for user input with history support. Ctrl-C here exits;
+            # Ctrl-C while a turn is being processed only stops that turn.
             console.print(Rule())
-            user_input = session.prompt(
-                [('class:prompt', 'Prompt: ')],
-                style=style
-            ).strip()
+            # Evaluate the history in Ollama while the user types the next question
+            prefiller.prefill(next_request_prefix(conversation, options, summarizer), prefix_stats.previous)
+            try:
+                with patch_stdout(raw=True):
+                    user_input = session.prompt(
+                        [('class:prompt', 'Prompt: ')],
+                        style=style
+                    ).strip()
+            except KeyboardInterrupt:
+                print("\nProgram interrupted. Exiting...")
+                break
 
             # Check if input is empty
             if not user_input:
                 continue
+            timer = TurnTimer(kind='command')
+            profiler.start(f"turn-{len(metrics.turns)}")
+
+            # Pick up any startup work that finished while the user was typing
+            collect_startup_results(tasks, conversation, options)
+            timer.lap('startup_tasks')
+
+            # Commands that take arguments, e.g. 'packages nginx'
+            command_name, command_args = parse_command_arguments(user_input)
+            if command_name:
+                COMMANDS[command_name](command_args)
+                timer.lap('command')
+                continue
 
             # First check for built-in commands
             if user_input.lower() in COMMANDS:
                 if user_input.lower() == 'options':
                     options_menu(options)
                     options = load_options()
+                    summarizer.options = options
+                    prefiller.options = options
                 elif user_input.lower() == 'clear':
+                    tasks.discard('summary')
+                    tasks.cancel('greeting')
                     conversation = COMMANDS[user_input.lower()]()
+                    summarizer = RollingSummarizer(summarizer.options, summarizer.on_summary)
                     if not conversation:
                         system_prompt = load_system_prompt()
                         system_info = gather_system_info()
@@ -484,55 +848,137 @@ def main():
                         ]
                 else:
                     COMMANDS[user_input.lower()]()
+                timer.lap('command')
                 continue
 
             # Then check if input is a valid bash command
-            if is_valid_bash_command(user_input):
-                execute_bash_command(user_input, options)
-                conversation.append({'role': 'system', 'content': f"Command executed: {user_input}"})
+            is_command = is_valid_bash_command(user_input)
+            timer.lap('classify')
+            if is_command:
+                timer.kind = 'bash'
+                note = execute_bash_command(user_input, options)
+                conversation.append({'role': 'system', 'content': note})
+                timer.lap('execute')
                 continue
 
-            # If not a command, process with AI
-            try:
-                conversation.append({'role': 'user', 'content': user_input})
-                
-                if options['model_provider'] == 'ollama':
-                    assistant_message = execute_ollama_request(conversation, options)
-                    if assistant_message is None:
-                        continue
-                else:
-                    response = openai.ChatCompletion.create(
-                        model=options['model'],
-                        messages=conversation,
-                        temperature=options['temperature'],
-                        max_tokens=options['max_tokens']
-                    )
-                    assistant_message = response['choices'][0]['message']['content']
-                
-                # Display the response
-                console.print(Rule())
-                console.print("[bold yellow]Sage:[/bold yellow]")
-                console.print(Markdown(assistant_message))
-                
-                # Add response to conversation history
-                conversation.append({'role': 'assistant', 'content': assistant_message})
-                
-                # Extract and add any bash commands from the response to history
-                bash_commands = extract_bash_commands(assistant_message)
-                for cmd in bash_commands:
-                    history.append_string(cmd)
-                    
-            except openai.error.OpenAIError as e:
-                console.print(f"[red]An error occurred: {e}[/red]")
+            # If not a command, process with AI. A leading '!' skips the response cache.
+            bypass_cache = user_input.startswith('!')
+            if bypass_cache:
+                user_input = user_input[1:].strip()
+            timer.kind = 'chat'
+            collect_startup_results(tasks, conversation, options, wait=True)
+            conversation.append({'role': 'user', 'content': user_input})
+            timer.lap('startup_tasks')
+
+            cache_key = None
+            embedding = None
+            assistant_message = None
+            if cache_enabled(options) and not bypass_cache:
+                context = cache_context(conversation)
+                cache_key = ResponseCache.make_key(options['model'], options['temperature'], user_input, context)
+                assistant_message = get_response_cache(options).get(cache_key)
+
+                # Fall back to a semantic match, e.g. "show listening ports" for "which ports are open"
+                from semantic_cache import get_semantic_cache, embed_prompt
+                semantic_cache = get_semantic_cache(options) if assistant_message is None else None
+                if semantic_cache is not None:
+                    embedding = embed_prompt(user_input, options)
+                    if embedding is not None:
+                        assistant_message = semantic_cache.lookup(embedding, options['model'], context_hash(context))
+
+                timer.lap('cache_lookup')
+                if assistant_message is not None:
+                    from rich.markdown import Markdown
+                    timer.kind = 'cached'
+                    with output_lock:
+                        console.print(Rule())
+                        console.print("[bold yellow]Sage:[/bold yellow] [dim](cached - prefix with ! to ask again)[/dim]")
+                        console.print(Markdown(assistant_message))
+                    timer.lap('render')
+
+            if assistant_message is None:
+                messages = build_request_messages(conversation, user_input, options, summarizer)
+                timer.lap('build_request')
+                usage = {}
+                assistant_message = request_completion(messages, options,
+                                                       heading="[bold yellow]Sage:[/bold yellow]", usage=usage)
+                timer.lap('request')
+                timer.add_request(usage, usage.get('provider', options['model_provider']))
+                prefiller.record_request(messages, usage)
+                if assistant_message is None:
+                    timer.kind = 'failed'
+                    continue
+                prefix_stats.record(messages, assistant_message, options['model_provider'], usage)
+                if assistant_message.endswith(TRUNCATED_MARKER):
+                    # Keep the partial answer in the history, but never serve it from the cache
+                    cache_key = None
+                    embedding = None
+                if cache_key:
+                    get_response_cache(options).put(cache_key, options['model'], user_input, assistant_message)
+                if embedding is not None:
+                    semantic_cache.add(embedding, options['model'], context_hash(context),
+                                       user_input, assistant_message)
+
+            # Add response to conversation history
+            conversation.append({'role': 'assistant', 'content': assistant_message})
+
+            # Extract and add any bash commands from the response to history
+            bash_commands = extract_bash_commands(assistant_message)
+            for cmd in bash_commands:
+                history.append_string(cmd)
+            timer.lap('post_process')
 
         except EOFError:
             print("\nExiting program...")
             break
         except KeyboardInterrupt:
-            print("\nProgram interrupted. Exiting...")
-            break
-
-    exit_program(conversation)
+            console.print("\n[yellow]Interrupted.[/yellow]")
+        finally:
+            # Persist this turn's messages right away rather than at exit
+            save_conversation(conversation)
+            if timer is not None:
+                timer.lap('save')
+                metrics.record(timer, session=current_session_id(), model=options['model'])
+            profiler.stop()
+
+    exit_program(conversation, options, summarizer)
+
+def batch_main(input_path, output_path=None, concurrency=None):
+    """Answer the prompts in input_path without greeting or prompting; see batch.run_batch()"""
+    from batch import run_batch
+
+    has_api_key = ensure_sage_setup()
+    options = load_options()
+    if options['model_provider'] == 'openai':
+        if not has_api_key:
+            # read_api_key() would ask for one, and an unattended run would hang
+            print("No OpenAI API key is configured. Run sage interactively once to enter it, "
+                  "or switch to an Ollama model.", file=sys.stderr)
+            return 1
+        get_openai()
+    prefix_messages = [
+        {'role': 'system', 'content': load_system_prompt(interactive=False)},
+        {'role': 'system', 'content': gather_system_info()}
+    ]
+    return run_batch(input_path, options, prefix_messages, output_path, concurrency)
+
+def parse_args(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(prog='sage', description="Sage, an AI Linux system administration assistant")
+    parser.add_argument('--batch', metavar='INPUT',
+                        help="answer the prompts in a JSON lines file non-interactively and exit")
+    parser.add_argument('--output', metavar='FILE',
+                        help="batch results file (default: INPUT with a .results.jsonl suffix)")
+    parser.add_argument('--concurrency', type=int, metavar='N',
+                        help="maximum concurrent batch requests (default: the 'batch_concurrency' option)")
+    parser.add_argument('--profile', action='store_true',
+                        help="profile startup and every turn with cProfile and tracemalloc, "
+                             "saving the results to ~/.sage/profiles")
+    return parser.parse_args(argv)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    args = parse_args()
+    if args.batch:
+        sys.exit(batch_main(args.batch, args.output, args.concurrency))
+    main(profile=args.profile)
\ No newline at end of file
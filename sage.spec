@@ -34,8 +34,23 @@ a = Analysis(
         ('conversation.py', '.'),
         ('commands.py', '.'),
         ('capture_tool.py', '.'),   
-        ('constants.py', '.'),  
         ('utils.py', '.'),
+        ('streaming.py', '.'),
+        ('providers.py', '.'),
+        ('async_providers.py', '.'),
+        ('batch.py', '.'),
+        ('hedging.py', '.'),
+        ('metrics.py', '.'),
+        ('profiling.py', '.'),
+        ('prefill.py', '.'),
+        ('shell_pool.py', '.'),
+        ('background.py', '.'),
+        ('context_window.py', '.'),
+        ('system_info.py', '.'),
+        ('path_index.py', '.'),
+        ('response_cache.py', '.'),
+        ('semantic_cache.py', '.'),
+        ('summarizer.py', '.'),
         ('__pycache__', '.'),
     ],
     hiddenimports=hidden_imports,
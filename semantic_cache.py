@@ -0,0 +1,247 @@
+# semantic_cache.py
+
+import os
+import json
+import time
+import numpy as np
+from pathlib import Path
+from providers import get_ollama_client
+
+HOME_DIR = str(Path.home())
+SAGE_DIR = os.path.join(HOME_DIR, '.sage')
+SEMANTIC_CACHE_DIR = os.path.join(SAGE_DIR, 'semantic_cache')
+
+# Searches run on a random projection of the embeddings to PROJECTION_DIM
+# dimensions, which keeps a scan of tens of thousands of entries well under a
+# millisecond. The best RERANK_CANDIDATES are then rescored with the full vectors.
+PROJECTION_DIM = 64
+RERANK_CANDIDATES = 16
+
+
+class SemanticCache:
+    """
+    Answer cache keyed by prompt meaning rather than exact text.
+
+    Prompt embeddings are appended to a raw float32 file and their metadata to a
+    JSON lines file, so adding an entry normally never rewrites the index. Both
+    are loaded into NumPy arrays on first use.
+
+    Entries older than max_age seconds are dropped, and once there are more
+    than max_entries the least recently used are dropped down to 90% of it;
+    both files are then rewritten.
+
+    Like the exact response cache it sits behind, it is only consulted when
+    cache_enabled() is true: with the default 'auto' mode that needs
+    temperature 0, since a sampled answer is not worth replaying.
+    """
+
+    def __init__(self, embed_model, threshold=0.92, path=SEMANTIC_CACHE_DIR, max_entries=5000,
+                 max_age=30 * 24 * 3600):
+        self.embed_model = embed_model
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.max_age = max_age
+        self.path = path
+        self.vectors_file = os.path.join(path, 'vectors.f32')
+        self.entries_file = os.path.join(path, 'entries.jsonl')
+        self.meta_file = os.path.join(path, 'meta.json')
+        self.dim = None
+        self.vectors = None
+        self.projected = None
+        self.projection = None
+        self.entries = []
+        # (row indices, their projected vectors as one contiguous matrix) by
+        # (model, context): the entries a lookup can match, scored in one product
+        self.rows = {}
+        self.load()
+
+    def load(self):
+        os.makedirs(self.path, exist_ok=True)
+        try:
+            with open(self.meta_file, 'r') as f:
+                meta = json.load(f)
+        except (OSError, json.JSONDecodeError):
+            meta = {}
+        if meta.get('embed_model') != self.embed_model:
+            # Vectors from a different embedding model are not comparable
+            self.reset()
+            return
+        if not meta.get('dim'):
+            return
+
+        self.dim = meta['dim']
+        self.entries = []
+        try:
+            with open(self.entries_file, 'r') as f:
+                for line in f:
+                    try:
+                        self.entries.append(json.loads(line))
+                    except json.JSONDecodeError:
+                        break
+        except OSError:
+            pass
+
+        vectors = np.fromfile(self.vectors_file, dtype=np.float32) if os.path.exists(self.vectors_file) else np.empty(0, np.float32)
+        count = min(len(self.entries), vectors.size // self.dim)
+        self.entries = self.entries[:count]
+        self.vectors = vectors[:count * self.dim].reshape(count, self.dim)
+        self._init_projection()
+        self.projected = self._project(self.vectors)
+        self._index()
+        self.evict()
+
+    def _index(self):
+        groups = {}
+        for row, entry in enumerate(self.entries):
+            groups.setdefault((entry['model'], entry['context']), []).append(row)
+        self.rows = {key: (np.asarray(rows), self.projected[rows]) for key, rows in groups.items()}
+
+    def reset(self):
+        for file in (self.vectors_file, self.entries_file):
+            if os.path.exists(file):
+                os.remove(file)
+        self.dim = None
+        self.vectors = None
+        self.projected = None
+        self.entries = []
+        self.rows = {}
+        with open(self.meta_file, 'w') as f:
+            json.dump({'embed_model': self.embed_model}, f)
+
+    def _init_projection(self):
+        rng = np.random.default_rng(0)
+        self.projection = rng.standard_normal((self.dim, PROJECTION_DIM)).astype(np.float32)
+
+    def _project(self, vectors):
+        projected = vectors @ self.projection
+        norms = np.linalg.norm(projected, axis=-1, keepdims=True)
+        return projected / np.maximum(norms, 1e-12)
+
+    @staticmethod
+    def normalize(embedding):
+        vector = np.asarray(embedding, dtype=np.float32)
+        return vector / max(float(np.linalg.norm(vector)), 1e-12)
+
+    def lookup(self, embedding, model, context):
+        """
+        Return the cached answer whose prompt is most similar to embedding, or None.
+
+        Only entries for the same model and context qualify, and only if their
+        cosine similarity reaches the threshold. They are selected before the
+        projected search, so entries for other contexts cannot crowd them out
+        of the candidates.
+        """
+        group = self.rows.get((model, context))
+        if self.dim is None or group is None:
+            return None
+        rows, projected = group
+        vector = self.normalize(embedding)
+        if vector.shape[0] != self.dim:
+            return None
+
+        scores = projected @ self._project(vector)
+        k = min(RERANK_CANDIDATES, len(rows))
+        candidates = rows[np.argpartition(scores, -k)[-k:]]
+        exact = self.vectors[candidates] @ vector
+        best = int(np.argmax(exact))
+        if exact[best] < self.threshold:
+            return None
+        entry = self.entries[candidates[best]]
+        # Kept in memory; written out with the next eviction
+        entry['used'] = time.time()
+        return entry['response']
+
+    def add(self, embedding, model, context, prompt, response):
+        vector = self.normalize(embedding)
+        if self.dim is None:
+            self.dim = vector.shape[0]
+            self.vectors = np.empty((0, self.dim), np.float32)
+            self._init_projection()
+            self.projected = self._project(self.vectors)
+            with open(self.meta_file, 'w') as f:
+                json.dump({'embed_model': self.embed_model, 'dim': self.dim}, f)
+        if vector.shape[0] != self.dim:
+            return
+
+        entry = {'model': model, 'context': context, 'prompt': prompt,
+                 'response': response, 'created': time.time()}
+        with open(self.vectors_file, 'ab') as f:
+            f.write(vector.tobytes())
+        with open(self.entries_file, 'a') as f:
+            f.write(json.dumps(entry) + '\n')
+
+        point = self._project(vector)
+        rows, projected = self.rows.get((model, context), (np.empty(0, np.intp), self.projected[:0]))
+        self.rows[(model, context)] = (np.append(rows, len(self.entries)), np.vstack([projected, point]))
+        self.entries.append(entry)
+        self.vectors = np.vstack([self.vectors, vector])
+        self.projected = np.vstack([self.projected, point])
+        self.evict()
+
+    def evict(self, now=None):
+        """Drop expired entries, then least recently used ones when over max_entries"""
+        now = now or time.time()
+        keep = [row for row, entry in enumerate(self.entries) if now - entry['created'] < self.max_age]
+        if len(keep) > self.max_entries:
+            keep.sort(key=lambda row: self.entries[row].get('used', self.entries[row]['created']))
+            keep = sorted(keep[len(keep) - int(self.max_entries * 0.9):])
+        if len(keep) == len(self.entries):
+            return
+
+        self.entries = [self.entries[row] for row in keep]
+        self.vectors = self.vectors[keep]
+        self.projected = self.projected[keep]
+        self._index()
+        vectors_tmp = f"{self.vectors_file}.{os.getpid()}.tmp"
+        entries_tmp = f"{self.entries_file}.{os.getpid()}.tmp"
+        try:
+            self.vectors.tofile(vectors_tmp)
+            with open(entries_tmp, 'w') as f:
+                for entry in self.entries:
+                    f.write(json.dumps(entry) + '\n')
+            os.replace(vectors_tmp, self.vectors_file)
+            os.replace(entries_tmp, self.entries_file)
+        except OSError as e:
+            print(f"Error compacting semantic cache: {e}")
+
+    def clear(self):
+        self.reset()
+
+
+_semantic_cache = None
+_semantic_cache_failed = False
+
+
+def get_semantic_cache(options):
+    """
+    Return the shared semantic cache, or None if it is disabled or unavailable.
+
+    Callers also check cache_enabled(), which the semantic cache shares with
+    the exact response cache.
+    """
+    global _semantic_cache
+    if not options.get('semantic_cache', True) or _semantic_cache_failed:
+        return None
+    if _semantic_cache is None:
+        _semantic_cache = SemanticCache(
+            options.get('semantic_cache_model', 'nomic-embed-text'),
+            threshold=options.get('semantic_cache_threshold', 0.92),
+            max_entries=options.get('semantic_cache_max_entries', 5000),
+            max_age=options.get('response_cache_max_age_days', 30) * 24 * 3600
+        )
+    return _semantic_cache
+
+
+def embed_prompt(prompt, options):
+    """
+    Embed a prompt through the local Ollama embeddings endpoint.
+
+    Returns None if embedding fails; the semantic cache is then switched off for
+    the rest of the session so later turns don't pay for the failed call.
+    """
+    global _semantic_cache_failed
+    try:
+        return get_ollama_client(options).embed(options.get('semantic_cache_model', 'nomic-embed-text'), prompt)
+    except Exception:
+        _semantic_cache_failed = True
+        return None
@@ -0,0 +1,424 @@
+# shell_pool.py
+
+import os
+import re
+import sys
+import time
+import atexit
+import shlex
+import shutil
+import signal
+import select
+import threading
+
+# How long an interrupted command gets to exit after Ctrl-C before its worker
+# is killed
+KILL_GRACE = 3.0
+STARTUP_TIMEOUT = 5.0
+# Output kept per command: the first and the last CAPTURE_BYTES / 2 bytes
+CAPTURE_BYTES = 256 * 1024
+
+ANSI_ESCAPE = re.compile(r'\x1b\[[0-?]*[ -/]*[@-~]|\x1b\][^\x07\x1b]*(?:\x07|\x1b\\)|\x1b[@-Z\\-_]')
+
+
+class ShellError(Exception):
+    pass
+
+
+class CommandResult:
+    """The outcome of a command run by a ShellWorker"""
+
+    def __init__(self, command, exit_code, output, duration, timed_out=False, interrupted=False):
+        self.command = command
+        # None if the command was killed or ended its shell
+        self.exit_code = exit_code
+        self.output = output
+        self.duration = duration
+        self.timed_out = timed_out
+        self.interrupted = interrupted
+
+
+class ShellWorker:
+    """
+    A long-lived bash running on a pseudo-terminal.
+
+    Commands are sourced into the shell, so 'cd', exports and shell variables
+    carry over to the next command, and they run in the shell's own process
+    group with the pseudo-terminal as their terminal: output is streamed as
+    it is produced, colours and progress bars included, and keys typed while
+    a command runs are passed on (so sudo and [Y/n] prompts work). bash reads
+    the commands from a pipe, which keeps them out of the output and away
+    from the commands' input.
+
+    Ctrl-C is passed on to the command. A command still running KILL_GRACE
+    seconds later, or after a second Ctrl-C, is killed with its whole process
+    group, shell included; the pool starts a new shell for the next command.
+    """
+
+    def __init__(self):
+        import pty
+        import tempfile
+
+        self.busy = False
+        self.marker = f"__sage_done_{os.urandom(8).hex()}__".encode()
+        self.directory = tempfile.mkdtemp(prefix='sage-shell-')
+        self.script = os.path.join(self.directory, 'command.sh')
+        commands_read, self.commands = os.pipe()
+        self.pid, self.fd = pty.fork()
+        if self.pid == 0:
+            try:
+                os.dup2(commands_read, 0)
+                os.close(commands_read)
+                os.close(self.commands)
+                os.execvp('bash', ['bash', '--noprofile', '--norc', '-s'])
+            finally:
+                os._exit(127)
+        os.close(commands_read)
+        self.resize()
+        # A trap, rather than ignoring SIGINT, keeps Ctrl-C from ending the
+        # shell while commands still get the default handler
+        self._send("trap : INT")
+        if self._read_until_marker(STARTUP_TIMEOUT) is None:
+            self.kill()
+            raise ShellError("The shell did not start")
+
+    def alive(self):
+        return self.pid is not None
+
+    def resize(self):
+        """Give the pseudo-terminal the size of Sage's terminal"""
+        import fcntl
+        import struct
+        import termios
+
+        columns, rows = shutil.get_terminal_size()
+        try:
+            fcntl.ioctl(self.fd, termios.TIOCSWINSZ, struct.pack('HHHH', rows, columns, 0, 0))
+        except OSError:
+            pass
+
+    def cwd(self):
+        try:
+            return os.readlink(f"/proc/{self.pid}/cwd")
+        except (OSError, TypeError):
+            return None
+
+    def _send(self, line):
+        """Run line in the shell, followed by the completion marker with its exit status"""
+        os.write(self.commands, f"{line}\nprintf '\\n%s:%s\\n' {self.marker.decode()} \"$?\"\n".encode())
+
+    def _read_until_marker(self, timeout):
+        """Discard output up to the next completion marker; return its status line, or None"""
+        deadline = time.monotonic() + timeout
+        pending = b''
+        while time.monotonic() < deadline:
+            readable, _, _ = select.select([self.fd], [], [], deadline - time.monotonic())
+            if not readable:
+                continue
+            try:
+                data = os.read(self.fd, 65536)
+            except OSError:
+                return None
+            if not data:
+                return None
+            pending += data
+            index = pending.find(self.marker)
+            if index >= 0 and b'\n' in pending[index:]:
+                return pending[index:].split(b'\n', 1)[0]
+        return None
+
+    def run(self, command, timeout=None, write=None):
+        """
+        Run a command and wait for it to finish.
+
+        Args:
+            command (str): The command, possibly several lines.
+            timeout (float): Seconds after which the command is interrupted, or None.
+            write (Callable[[bytes], None]): Receives the output as it arrives;
+                written to stdout by default.
+
+        Returns:
+            CommandResult: The exit status and the captured output.
+        """
+        write = write or _write_stdout
+        with open(self.script, 'w') as f:
+            f.write(command + '\n')
+        self.resize()
+        start = time.monotonic()
+        # Sourced with the terminal as input, so the commands read the keyboard
+        self._send(f". {shlex.quote(self.script)} </dev/tty")
+
+        capture = Capture()
+        pending = b''
+        exit_code = None
+        stopping = None
+        timed_out = interrupted = False
+        keyboard = _Keyboard()
+        try:
+            while True:
+                try:
+                    now = time.monotonic()
+                    if stopping is not None and now >= stopping:
+                        self.kill()
+                        break
+                    if stopping is None and timeout and now - start >= timeout:
+                        timed_out = True
+                        stopping = self._interrupt()
+                        continue
+                    wait = stopping - now if stopping is not None else (
+                        start + timeout - now if timeout else None)
+                    readable, _, _ = select.select([self.fd] + keyboard.fds, [], [], wait)
+                    if keyboard.fds and keyboard.fds[0] in readable:
+                        data = keyboard.read()
+                        if data:
+                            os.write(self.fd, data)
+                    if self.fd not in readable:
+                        continue
+                    try:
+                        data = os.read(self.fd, 65536)
+                    except OSError:
+                        data = b''
+                    if not data:
+                        # The command ended the shell, e.g. with 'exit'
+                        write(pending)
+                        capture.add(pending)
+                        self.kill()
+                        break
+                    pending += data
+                    index = pending.find(self.marker)
+                    if index >= 0:
+                        if b'\n' not in pending[index:]:
+                            continue
+                        status = pending[index + len(self.marker) + 1:].split(b'\n', 1)[0]
+                        output = pending[:index]
+                        # The line break printed before the marker
+                        if output.endswith(b'\r\n'):
+                            output = output[:-2]
+                        write(output)
+                        capture.add(output)
+                        try:
+                            exit_code = int(status.strip())
+                        except ValueError:
+                            exit_code = None
+                        break
+                    # Hold back what could be the start of the marker
+                    keep = len(self.marker) + 2
+                    if len(pending) > keep:
+                        write(pending[:-keep])
+                        capture.add(pending[:-keep])
+                        pending = pending[-keep:]
+                except KeyboardInterrupt:
+                    interrupted = True
+                    if stopping is None:
+                        stopping = self._interrupt()
+                    else:
+                        self.kill()
+                        break
+        finally:
+            keyboard.restore()
+        if capture.last_byte not in (None, b'\n'):
+            write(b'\r\n')
+        if not self.alive():
+            exit_code = None
+        return CommandResult(command, exit_code, capture.text(), time.monotonic() - start,
+                             timed_out=timed_out, interrupted=interrupted and not timed_out)
+
+    def _interrupt(self):
+        """Send Ctrl-C to the command; return when to give up and kill it"""
+        try:
+            os.write(self.fd, b'\x03')
+        except OSError:
+            pass
+        return time.monotonic() + KILL_GRACE
+
+    def kill(self):
+        """Kill the shell and everything in its process group"""
+        self.close(signal.SIGKILL)
+
+    def close(self, sig=signal.SIGHUP):
+        """End the shell, like closing its terminal window"""
+        if self.pid is None:
+            return
+        for fd in (self.commands, self.fd):
+            try:
+                os.close(fd)
+            except OSError:
+                pass
+        try:
+            os.killpg(self.pid, sig)
+        except (ProcessLookupError, PermissionError):
+            pass
+        try:
+            os.waitpid(self.pid, 0)
+        except ChildProcessError:
+            pass
+        self.pid = None
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+
+class Capture:
+    """The output of a command, without its first and last CAPTURE_BYTES / 2 bytes in between"""
+
+    def __init__(self, limit=CAPTURE_BYTES):
+        self.half = limit // 2
+        self.head = bytearray()
+        self.tail = bytearray()
+        self.dropped = 0
+        self.last_byte = None
+
+    def add(self, data):
+        if not data:
+            return
+        self.last_byte = data[-1:]
+        room = self.half - len(self.head)
+        if room > 0:
+            self.head += data[:room]
+            data = data[room:]
+        self.tail += data
+        if len(self.tail) > self.half:
+            self.dropped += len(self.tail) - self.half
+            del self.tail[:-self.half]
+
+    def text(self):
+        text = clean_output(bytes(self.head))
+        if self.dropped:
+            text += f"\n[... {self.dropped} bytes omitted ...]\n"
+        return text + clean_output(bytes(self.tail))
+
+
+def clean_output(data):
+    """Decode terminal output and drop colour codes and overwritten progress lines"""
+    text = ANSI_ESCAPE.sub('', data.decode('utf-8', errors='replace'))
+    lines = []
+    for line in text.replace('\r\n', '\n').split('\n'):
+        # What a carriage return wrote over is not on the screen any more
+        lines.append(line.rsplit('\r', 1)[-1])
+    return '\n'.join(lines)
+
+
+def truncate_output(text, limit):
+    """Shorten text to about limit characters, keeping its beginning and (mostly) its end"""
+    if not limit or len(text) <= limit:
+        return text
+    head = limit // 4
+    tail = limit - head
+    return f"{text[:head]}\n[... {len(text) - limit} characters omitted ...]\n{text[-tail:]}"
+
+
+class _Keyboard:
+    """Sage's terminal in cbreak mode while a command runs, so keys reach it one at a time"""
+
+    def __init__(self):
+        import termios
+        import tty
+
+        self.fds = []
+        self.saved = None
+        try:
+            fd = sys.stdin.fileno()
+            if os.isatty(fd):
+                self.saved = termios.tcgetattr(fd)
+                # Keeps ISIG: Ctrl-C still interrupts Sage, which passes it on
+                tty.setcbreak(fd)
+                self.fds = [fd]
+        except (OSError, ValueError, termios.error):
+            self.saved = None
+
+    def read(self):
+        try:
+            return os.read(self.fds[0], 1024)
+        except OSError:
+            return b''
+
+    def restore(self):
+        import termios
+
+        if self.saved is not None:
+            termios.tcsetattr(self.fds[0], termios.TCSADRAIN, self.saved)
+            self.saved = None
+
+
+def _write_stdout(data):
+    if not data:
+        return
+    sys.stdout.flush()
+    stream = getattr(sys.stdout, 'buffer', None)
+    if stream is None:
+        sys.stdout.write(data.decode('utf-8', errors='replace'))
+        sys.stdout.flush()
+    else:
+        stream.write(data)
+        stream.flush()
+
+
+class ShellPool:
+    """
+    A few ShellWorkers, started when first needed and kept for the session.
+
+    A command goes to the first idle worker, so consecutive commands share
+    one shell and its state; another worker is only started while the
+    earlier ones are busy. Workers whose shell ended or was killed are
+    replaced on the next command.
+    """
+
+    def __init__(self, size=2):
+        self.size = size
+        self.workers = []
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        with self.lock:
+            self.workers = [worker for worker in self.workers if worker.alive()]
+            for worker in self.workers:
+                if not worker.busy:
+                    break
+            else:
+                if len(self.workers) >= max(1, self.size):
+                    raise ShellError(f"All {len(self.workers)} shell workers are busy")
+                worker = ShellWorker()
+                self.workers.append(worker)
+            worker.busy = True
+            return worker
+
+    def run(self, command, timeout=None, write=None):
+        """Run a command on an idle worker; see ShellWorker.run()"""
+        worker = self.acquire()
+        try:
+            return worker.run(command, timeout, write)
+        finally:
+            worker.busy = False
+
+    def status(self):
+        """Return (pid, busy, working directory) for each live worker"""
+        with self.lock:
+            return [(worker.pid, worker.busy, worker.cwd()) for worker in self.workers if worker.alive()]
+
+    def close(self):
+        """End every idle worker's shell; busy ones are killed"""
+        with self.lock:
+            workers, self.workers = self.workers, []
+        for worker in workers:
+            if worker.busy:
+                worker.kill()
+            else:
+                worker.close()
+
+
+_pool = None
+
+
+def get_shell_pool(options):
+    """Return the session's shell pool, sized by the 'shell_workers' option"""
+    global _pool
+    if _pool is None:
+        _pool = ShellPool()
+    _pool.size = options.get('shell_workers', 2)
+    return _pool
+
+
+def close_shell_pool():
+    if _pool is not None:
+        _pool.close()
+
+
+atexit.register(close_shell_pool)
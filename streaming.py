@@ -0,0 +1,138 @@
+# streaming.py
+
+import time
+from rich.live import Live
+
+
+class MarkdownStream:
+    """
+    Render a Markdown reply incrementally while it is being streamed.
+
+    Finished blocks (paragraphs, lists, fenced code) are printed once and never
+    redrawn. Only the block currently being written lives in a rich ``Live``
+    region, so each refresh re-renders a few lines instead of the whole reply.
+    update() only appends to the buffer; the block is parsed as Markdown when
+    Live refreshes, at most ``refresh_per_second`` times a second, rather than
+    once per chunk.
+    """
+
+    def __init__(self, console, refresh_per_second=12):
+        self.console = console
+        self.buffer = ''
+        self.committed = 0
+        # The uncommitted block, read by the Live refresh thread
+        self.pending = ''
+        self.live = Live(
+            PendingBlock(self),
+            console=console,
+            refresh_per_second=refresh_per_second,
+            transient=True,
+            vertical_overflow='visible'
+        )
+
+    def __enter__(self):
+        self.live.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.finish()
+        return False
+
+    def update(self, chunk):
+        self.buffer += chunk
+        if '\n' in chunk:
+            # Blocks can only end at a line break
+            boundary = self._last_block_boundary()
+            if boundary > self.committed:
+                self.pending = ''
+                self._print_block(self.live.console, self.buffer[self.committed:boundary])
+                self.committed = boundary
+        self.pending = self.buffer[self.committed:]
+
+    def finish(self):
+        self.pending = ''
+        self.live.stop()
+        self._print_block(self.console, self.buffer[self.committed:])
+        self.committed = len(self.buffer)
+
+    def _print_block(self, console, text):
+        from rich.markdown import Markdown
+
+        if text.strip():
+            console.print(Markdown(text))
+
+    def _last_block_boundary(self):
+        """Return the offset just past the last complete block outside a code fence."""
+        boundary = self.committed
+        offset = self.committed
+        in_fence = False
+        for line in self.buffer[self.committed:].splitlines(keepends=True):
+            if not line.endswith('\n'):
+                break
+            offset += len(line)
+            stripped = line.strip()
+            if stripped.startswith('```') or stripped.startswith('~~~'):
+                in_fence = not in_fence
+                if not in_fence:
+                    boundary = offset
+            elif not stripped and not in_fence:
+                boundary = offset
+        return boundary
+
+
+class PendingBlock:
+    """The block being written, parsed as Markdown only when Live renders it"""
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.text = None
+        self.markdown = None
+
+    def __rich_console__(self, console, options):
+        from rich.markdown import Markdown
+
+        text = self.stream.pending
+        if not text.strip():
+            return
+        if text != self.text:
+            self.text = text
+            self.markdown = Markdown(text)
+        yield self.markdown
+
+
+def render_stream(chunks, console):
+    """
+    Consume an iterator of text chunks, rendering them as Markdown as they arrive.
+
+    Ctrl-C stops the stream: the iterator is closed, which cancels the request,
+    and the text received so far is returned with ``interrupted`` set.
+
+    Args:
+        chunks (Iterator[str]): Text fragments from a streaming provider call.
+        console (Console): The rich console to render to.
+
+    Returns:
+        Tuple[str, Dict[str, Any]]: The full text and timing stats
+        (``ttft``, ``elapsed`` and ``render`` in seconds, the latter being the
+        time spent rendering rather than waiting; ``chunks`` received, whether
+        the stream was ``interrupted``).
+    """
+    start = time.perf_counter()
+    stats = {'ttft': None, 'elapsed': 0.0, 'render': 0.0, 'chunks': 0, 'interrupted': False}
+    with MarkdownStream(console) as stream:
+        try:
+            for chunk in chunks:
+                received = time.perf_counter()
+                if stats['ttft'] is None:
+                    stats['ttft'] = received - start
+                stats['chunks'] += 1
+                stream.update(chunk)
+                stats['render'] += time.perf_counter() - received
+        except KeyboardInterrupt:
+            stats['interrupted'] = True
+            if hasattr(chunks, 'close'):
+                chunks.close()
+        finishing = time.perf_counter()
+    stats['render'] += time.perf_counter() - finishing
+    stats['elapsed'] = time.perf_counter() - start
+    return stream.buffer, stats
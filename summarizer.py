@@ -0,0 +1,224 @@
+# summarizer.py
+
+import asyncio
+import threading
+from concurrent.futures import as_completed
+from background import BackgroundTasks
+from context_window import count_tokens, estimate_tokens, fold_messages, token_budget
+from async_providers import complete_chat, get_async_provider, get_provider_loop
+
+TRANSCRIPT_MESSAGE_CHARS = 2000
+SUMMARY_MAX_TOKENS = 500
+
+
+def format_transcript(messages):
+    """Render messages as plain text for a summarization prompt"""
+    lines = []
+    for msg in messages:
+        content = msg.get('content')
+        if not isinstance(content, str):
+            continue
+        if len(content) > TRANSCRIPT_MESSAGE_CHARS:
+            content = content[:TRANSCRIPT_MESSAGE_CHARS] + ' [...]'
+        lines.append(f"{msg['role'].capitalize()}: {content}")
+    return '\n\n'.join(lines)
+
+
+def build_summary_prompt(messages, previous_summary=None):
+    prompt = (
+        "Summarize this conversation between a user and Sage, a Linux system administration "
+        "assistant. Keep the user's goals, the systems and services involved, commands that were "
+        "run or recommended, and any unresolved problems. Reply with the summary only, in at most "
+        "200 words.\n\n"
+    )
+    if previous_summary:
+        prompt += f"Summary of the conversation so far:\n{previous_summary}\n\nNew turns to fold in:\n"
+    return prompt + format_transcript(messages)
+
+
+def summarize_messages(messages, options, previous_summary=None):
+    """Summarize messages, folding them into previous_summary if given"""
+    return complete_chat(
+        [{'role': 'user', 'content': build_summary_prompt(messages, previous_summary)}],
+        options, temperature=0.2, max_tokens=SUMMARY_MAX_TOKENS
+    )
+
+
+def build_merge_prompt(summaries):
+    parts = '\n\n'.join(f"Part {i}:\n{summary}" for i, summary in enumerate(summaries, 1))
+    return (
+        "The following are summaries of consecutive parts of one conversation between a user "
+        "and Sage, a Linux system administration assistant. Merge them into a single summary that "
+        "keeps the user's goals, the systems and services involved, important commands and any "
+        "unresolved problems. Reply with the summary only, in at most 200 words.\n\n" + parts
+    )
+
+
+def split_by_token_budget(messages, budget, provider):
+    """Split messages into consecutive chunks of at most budget estimated tokens"""
+    chunks = []
+    current = []
+    used = 0
+    for msg in messages:
+        content = msg.get('content')
+        if not isinstance(content, str):
+            continue
+        if len(content) > TRANSCRIPT_MESSAGE_CHARS:
+            msg = dict(msg, content=content[:TRANSCRIPT_MESSAGE_CHARS] + ' [...]')
+        tokens = estimate_tokens(msg, provider)
+        if current and used + tokens > budget:
+            chunks.append(current)
+            current = []
+            used = 0
+        current.append(msg)
+        used += tokens
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def group_by_token_budget(summaries, budget, provider):
+    """Group partial summaries for merging, at least two per group so every round shrinks"""
+    groups = []
+    current = []
+    used = 0
+    for summary in summaries:
+        tokens = estimate_tokens({'content': summary}, provider)
+        if len(current) >= 2 and used + tokens > budget:
+            groups.append(current)
+            current = []
+            used = 0
+        current.append(summary)
+        used += tokens
+    if current:
+        if len(current) == 1 and groups:
+            groups[-1].append(current[0])
+        else:
+            groups.append(current)
+    return groups
+
+
+def map_reduce_summary(messages, options, previous_summary=None, progress=None):
+    """
+    Summarize a long conversation in chunks.
+
+    The transcript is split by token budget, the chunks are summarized
+    concurrently ('summary_parallelism' requests at a time) and the partial
+    summaries are merged in rounds until one remains.
+
+    Args:
+        messages (List[Dict[str, str]]): The messages to summarize.
+        options (Dict[str, Any]): Configuration options.
+        previous_summary (str): An existing summary of earlier turns to merge in.
+        progress (Callable[[str, int, int], None]): Called with a stage
+            description, completed and total request counts.
+
+    Returns:
+        str: The summary, or previous_summary if there was nothing to summarize.
+    """
+    provider = options['model_provider']
+    budget = options.get('summary_chunk_tokens') or min(2000, token_budget(options) // 2)
+    workers = max(1, options.get('summary_parallelism', 2))
+
+    def run_round(description, prompts):
+        results = [None] * len(prompts)
+        if progress:
+            progress(description, 0, len(prompts))
+        # All requests of a round share the provider loop; at most 'workers' run at a time
+        limit = asyncio.Semaphore(workers)
+
+        async def summarize(prompt):
+            async with limit:
+                return await get_async_provider(options).chat(
+                    options['model'], [{'role': 'user', 'content': prompt}], 0.2, SUMMARY_MAX_TOKENS
+                )
+
+        futures = {get_provider_loop().submit(summarize(prompt), options.get('request_timeout')): index
+                   for index, prompt in enumerate(prompts)}
+        try:
+            for completed, future in enumerate(as_completed(futures), 1):
+                results[futures[future]] = future.result()
+                if progress:
+                    progress(description, completed, len(prompts))
+        finally:
+            for future in futures:
+                future.cancel()
+        return results
+
+    chunks = split_by_token_budget(messages, budget, provider)
+    if not chunks:
+        return previous_summary
+    summaries = run_round("Summarizing conversation",
+                          [build_summary_prompt(chunk) for chunk in chunks])
+    if previous_summary:
+        summaries.insert(0, previous_summary)
+
+    merge_round = 1
+    while len(summaries) > 1:
+        groups = group_by_token_budget(summaries, budget, provider)
+        summaries = run_round(f"Merging summaries (round {merge_round})",
+                              [build_merge_prompt(group) for group in groups])
+        merge_round += 1
+    return summaries[0]
+
+
+class RollingSummarizer:
+    """
+    Keep a running summary of the turns that have left the context window.
+
+    Used as the ``fold`` callback of build_context_window(). Dropped turns are
+    folded into the summary on a background thread once the unsummarized ones
+    reach 'summary_threshold_tokens'; until then they are represented by a cheap
+    note listing the user's questions. Each new summary is handed to on_summary
+    so it can be stored for the next launch.
+
+    summarized_count counts messages of the history after the pinned prefix
+    (split_pinned()), which build_context_window() drops from the front and
+    ConversationStore stores one to one, so the stored count is also an
+    index into the stored session.
+    """
+
+    def __init__(self, options, on_summary=None):
+        self.options = options
+        self.on_summary = on_summary
+        self.summary = None
+        self.summarized_count = 0
+        self.lock = threading.Lock()
+        self.tasks = BackgroundTasks()
+
+    def __call__(self, dropped):
+        return self.fold(dropped)
+
+    def fold(self, dropped):
+        with self.lock:
+            summary = self.summary
+            pending = dropped[self.summarized_count:]
+
+        threshold = self.options.get('summary_threshold_tokens', 1500)
+        if pending and not self.tasks.pending('summary') \
+                and count_tokens(pending, self.options['model_provider']) >= threshold:
+            self.tasks.submit('summary', self._summarize, pending, summary)
+
+        if not summary:
+            return fold_messages(pending)
+        note = f"Summary of earlier turns in this conversation: {summary}"
+        recent = fold_messages(pending)
+        if recent:
+            note += f"\n{recent['content']}"
+        return {'role': 'system', 'content': note}
+
+    def _summarize(self, pending, previous_summary):
+        try:
+            summary = summarize_messages(pending, self.options, previous_summary)
+        except Exception:
+            # Keep the cheap note and retry once more turns have been dropped
+            self.tasks.discard('summary')
+            return None
+        with self.lock:
+            self.summary = summary
+            self.summarized_count += len(pending)
+            summarized_count = self.summarized_count
+        self.tasks.discard('summary')
+        if self.on_summary:
+            self.on_summary(summary, summarized_count)
+        return summary
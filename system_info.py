@@ -0,0 +1,257 @@
+# system_info.py
+
+import os
+import json
+import time
+import socket
+import getpass
+import platform
+import subprocess
+from pathlib import Path
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from background import BackgroundTasks
+
+HOME_DIR = str(Path.home())
+SAGE_DIR = os.path.join(HOME_DIR, '.sage')
+SYSTEM_INFO_CACHE_FILE = os.path.join(SAGE_DIR, 'system_info.json')
+SYSTEM_INFO_CACHE_TTL = 24 * 3600
+DPKG_STATUS_FILE = '/var/lib/dpkg/status'
+OS_RELEASE_FILE = '/etc/os-release'
+MAX_RELEVANT_PACKAGES = 20
+PROBE_TIMEOUT = 2.0
+# Per-probe overrides; DNS is the usual culprit on hosts with broken resolvers
+PROBE_TIMEOUTS = {
+    'ip_address': 1.0,
+    'packages': 5.0
+}
+
+# Most recent timing of each probe: {name: {'seconds': float, 'status': str}}
+probe_timings = {}
+
+_static_info = None
+_static_info_key = None
+
+
+def get_dpkg_status_mtime():
+    try:
+        return os.stat(DPKG_STATUS_FILE).st_mtime
+    except OSError:
+        return None
+
+
+def read_installed_packages():
+    """
+    Return a {name: version} dict of installed dpkg packages.
+
+    Reads /var/lib/dpkg/status directly, which is much faster than running
+    'dpkg --get-selections' and needs no subprocess.
+    """
+    packages = {}
+    try:
+        with open(DPKG_STATUS_FILE, 'r', errors='replace') as f:
+            name = version = status = None
+            for line in f:
+                if line.startswith('Package:'):
+                    name = line.split(':', 1)[1].strip()
+                elif line.startswith('Version:'):
+                    version = line.split(':', 1)[1].strip()
+                elif line.startswith('Status:'):
+                    status = line.split(':', 1)[1].strip()
+                elif not line.strip():
+                    if name and status and status.endswith(' installed'):
+                        packages[name] = version or ''
+                    name = version = status = None
+            if name and status and status.endswith(' installed'):
+                packages[name] = version or ''
+    except OSError:
+        return None
+    return packages
+
+
+def read_distro():
+    try:
+        with open(OS_RELEASE_FILE, 'r') as f:
+            for line in f:
+                if line.startswith('PRETTY_NAME='):
+                    return line.split('=', 1)[1].strip().strip('"')
+    except OSError:
+        pass
+    return platform.system()
+
+
+def read_total_memory():
+    # psutil is only needed when the snapshot cache is cold
+    import psutil
+
+    return psutil.virtual_memory().total // (1024 ** 2)
+
+
+def run_probes(probes, defaults=None):
+    """
+    Run system probes concurrently, each with its own timeout.
+
+    A probe that fails or exceeds its timeout yields its default ("Unknown"
+    unless given in defaults) instead of blocking the others. Timed-out probes
+    are left to finish on their daemon thread.
+
+    Args:
+        probes (Dict[str, Callable]): Probe functions by name.
+        defaults (Dict[str, Any]): Fallback values by name.
+
+    Returns:
+        Tuple[Dict[str, Any], bool]: Results by name, and whether every probe succeeded.
+    """
+    defaults = defaults or {}
+    tasks = BackgroundTasks()
+    started = time.perf_counter()
+    # Filled in by the probe threads; only read for probes that finished in
+    # time, so one that times out and finishes later keeps its 'timeout'
+    durations = {}
+
+    def timed(name, probe):
+        start = time.perf_counter()
+        try:
+            return probe()
+        finally:
+            durations[name] = time.perf_counter() - start
+
+    futures = {name: tasks.submit(name, timed, name, probe) for name, probe in probes.items()}
+    results = {}
+    complete = True
+    for name, future in futures.items():
+        timeout = PROBE_TIMEOUTS.get(name, PROBE_TIMEOUT)
+        remaining = max(0.0, started + timeout - time.perf_counter())
+        try:
+            results[name] = future.result(timeout=remaining)
+            probe_timings[name] = {'seconds': durations[name], 'status': 'ok'}
+        except FutureTimeoutError:
+            probe_timings[name] = {'seconds': timeout, 'status': 'timeout'}
+            results[name] = defaults.get(name, "Unknown")
+            complete = False
+        except Exception as e:
+            probe_timings[name] = {'seconds': durations.get(name, time.perf_counter() - started),
+                                   'status': f"error: {e}"}
+            results[name] = defaults.get(name, "Unknown")
+            complete = False
+    return results, complete
+
+
+def get_probe_timings():
+    """Return the most recent per-probe timings, for diagnostics"""
+    return dict(probe_timings)
+
+
+def read_uptime():
+    return subprocess.check_output(['uptime', '-p'], timeout=PROBE_TIMEOUT).decode().strip()
+
+
+def collect_static_info():
+    """
+    Collect the parts of the system snapshot that rarely change.
+
+    Returns:
+        Tuple[Dict[str, Any], bool]: The snapshot, and whether every probe succeeded.
+    """
+    return run_probes({
+        'user_name': getpass.getuser,
+        'host_name': socket.gethostname,
+        'distro': read_distro,
+        'kernel': platform.release,
+        'platform': platform.platform,
+        'processor': platform.processor,
+        'cpu_count': os.cpu_count,
+        'total_memory': read_total_memory,
+        'packages': read_installed_packages
+    }, defaults={'packages': None})
+
+
+def load_static_info():
+    """
+    Return the static system snapshot, from the on-disk cache when still valid.
+
+    The cache is invalidated when /var/lib/dpkg/status changes (a package was
+    installed or removed), when the kernel changes, or after a day.
+    """
+    global _static_info, _static_info_key
+    dpkg_mtime = get_dpkg_status_mtime()
+    key = (dpkg_mtime, platform.release())
+    if _static_info is not None and _static_info_key == key:
+        return _static_info
+
+    try:
+        with open(SYSTEM_INFO_CACHE_FILE, 'r') as f:
+            cache = json.load(f)
+        if (cache.get('dpkg_status_mtime') == dpkg_mtime
+                and cache.get('info', {}).get('kernel') == platform.release()
+                and time.time() - cache.get('timestamp', 0) < SYSTEM_INFO_CACHE_TTL):
+            _static_info, _static_info_key = cache['info'], key
+            return _static_info
+    except (OSError, json.JSONDecodeError, KeyError):
+        pass
+
+    info, complete = collect_static_info()
+    _static_info, _static_info_key = info, key
+    if not complete:
+        # Don't persist a snapshot with holes in it; retry on the next launch
+        return info
+    try:
+        os.makedirs(SAGE_DIR, exist_ok=True)
+        tmp_file = f"{SYSTEM_INFO_CACHE_FILE}.{os.getpid()}.tmp"
+        with open(tmp_file, 'w') as f:
+            json.dump({'timestamp': time.time(), 'dpkg_status_mtime': dpkg_mtime, 'info': info}, f)
+        os.replace(tmp_file, SYSTEM_INFO_CACHE_FILE)
+    except OSError as e:
+        print(f"Error saving system info cache: {e}")
+    return info
+
+
+def format_package_count(packages):
+    if packages is None:
+        return "Unknown"
+    return f"{len(packages)} installed (dpkg); use 'packages <name>' to look up specific packages"
+
+
+def system_info_digest():
+    """
+    Return a compact system description for the model.
+
+    The installed package list is summarized as a count; individual packages
+    are only exposed through find_packages().
+    """
+    info = load_static_info()
+    volatile, _ = run_probes({
+        'uptime': read_uptime,
+        'ip_address': lambda: socket.gethostbyname(info['host_name'])
+    })
+    uptime = volatile['uptime']
+    ip_address = volatile['ip_address']
+
+    return (
+        f"User: {info['user_name']}\n"
+        f"Host: {info['host_name']}\n"
+        f"OS: {info['distro']} (Kernel: {info['kernel']})\n"
+        f"Platform: {info['platform']}\n"
+        f"Processor: {info['processor']}\n"
+        f"CPU Count: {info['cpu_count']}\n"
+        f"Total Memory: {info['total_memory']} MB\n"
+        f"Uptime: {uptime}\n"
+        f"IP Address: {ip_address}\n"
+        f"Installed Packages: {format_package_count(info['packages'])}\n"
+        f"Shell: {os.environ.get('SHELL', 'Unknown')}\n"
+        f"Terminal: {os.environ.get('TERM', 'Unknown')}"
+    )
+
+
+def find_packages(pattern):
+    """Return sorted (name, version) pairs of installed packages whose name contains pattern"""
+    packages = load_static_info()['packages'] or {}
+    pattern = pattern.lower()
+    return sorted((name, version) for name, version in packages.items() if pattern in name.lower())
+
+
+def relevant_packages(text):
+    """Return installed packages that are mentioned by name in text"""
+    packages = load_static_info()['packages'] or {}
+    words = {word.strip('.,;:!?()[]{}"\'`').lower() for word in text.split()}
+    matches = sorted((word, packages[word]) for word in words if word in packages)
+    return matches[:MAX_RELEVANT_PACKAGES]
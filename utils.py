@@ -2,7 +2,6 @@ import os
 import sys
 import base64
 from pathlib import Path
-from cryptography.fernet import Fernet
 
 HOME_DIR = str(Path.home())
 SAGE_DIR = os.path.join(HOME_DIR, '.sage')
@@ -20,6 +19,8 @@ def ensure_sage_setup():
     return True
 
 def generate_key():
+    from cryptography.fernet import Fernet
+
     key = Fernet.generate_key()
     try:
         with open(SECRET_KEY_FILE, 'wb') as key_file:
@@ -39,6 +40,8 @@ def load_key():
         sys.exit(1)
 
 def encrypt_api_key(api_key, key):
+    from cryptography.fernet import Fernet
+
     f = Fernet(key)
     encrypted_key = f.encrypt(api_key.encode())
     try:
@@ -49,6 +52,8 @@ def encrypt_api_key(api_key, key):
         sys.exit(1)
 
 def decrypt_api_key(encrypted_key, key):
+    from cryptography.fernet import Fernet
+
     f = Fernet(key)
     try:
         decrypted_key = f.decrypt(encrypted_key).decode()
@@ -57,6 +62,5 @@ def decrypt_api_key(encrypted_key, key):
         print(f"Error decrypting API key: {e}")
         sys.exit(1)
 
-def encode_image(image_path):
-    with open(image_path, "rb") as image_file:
-        return base64.b64encode(image_file.read()).decode('utf-8')
\ No newline at end of file
+def encode_image_bytes(data):
+    return base64.b64encode(data).decode('utf-8')